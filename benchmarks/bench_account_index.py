@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for the per-account message index and unread counters.
+
+Fills a fresh Storage with 100k messages spread over 5k accounts and times
+the work done by a GET /api/accounts page load and by listing every inbox,
+compared with the full-scan approach the index replaced.
+
+Usage: python benchmarks/bench_account_index.py [messages] [accounts]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_email_server.storage import Storage
+
+
+def populate(storage, message_count, account_count):
+    """Create the accounts and spread the messages round-robin over them."""
+    account_ids = []
+    for i in range(account_count):
+        account = storage.create_email_account({
+            "username": f"user{i}",
+            "domain": "bench.test",
+            "email": f"user{i}@bench.test",
+            "password": "password123"
+        })
+        account_ids.append(account.id)
+
+    for i in range(message_count):
+        storage.create_email_message({
+            "account_id": account_ids[i % account_count],
+            "sender": "Bench",
+            "sender_email": "bench@bench.test",
+            "recipient": "user@bench.test",
+            "subject": f"Message {i}",
+            "content": "Hello"
+        })
+        # Leave roughly a third of the messages unread
+        if i % 3:
+            storage.mark_email_as_read(i + 1)
+
+    return account_ids
+
+
+def scan_unread_count(storage, account_id):
+    """Unread count computed by scanning every message (previous approach)."""
+    return sum(
+        1 for msg in storage.email_messages.values()
+        if msg.account_id == account_id and not msg.read
+    )
+
+
+def scan_messages(storage, account_id):
+    """Inbox listing computed by scanning and sorting (previous approach)."""
+    messages = [
+        msg for msg in storage.email_messages.values()
+        if msg.account_id == account_id
+    ]
+    return sorted(messages, key=lambda x: x.received_at, reverse=True)
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed * 1000:10.2f} ms")
+    return result
+
+
+def main():
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    account_count = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+
+    storage = Storage()
+    print(f"Populating {message_count} messages over {account_count} accounts...")
+    account_ids = timed("populate", lambda: populate(storage, message_count, account_count))
+
+    # A sample of accounts keeps the scan-based baseline from taking minutes
+    sample = account_ids[:200]
+    scale = len(account_ids) / len(sample)
+
+    indexed = timed("indexed unread counts (all accounts)",
+                    lambda: [storage.get_unread_count(a) for a in account_ids])
+    scanned = timed(f"scanned unread counts ({len(sample)} accounts)",
+                    lambda: [scan_unread_count(storage, a) for a in sample])
+    assert indexed[:len(sample)] == scanned
+    print(f"  (scan extrapolated to all accounts: x{scale:.0f})")
+
+    indexed = timed("indexed inbox listing (all accounts)",
+                    lambda: [storage.get_email_messages(a) for a in account_ids])
+    scanned = timed(f"scanned inbox listing ({len(sample)} accounts)",
+                    lambda: [scan_messages(storage, a) for a in sample])
+    assert [[m.id for m in ms] for ms in indexed[:len(sample)]] == \
+        [[m.id for m in ms] for ms in scanned]
+    print(f"  (scan extrapolated to all accounts: x{scale:.0f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for provisioning many inboxes at once.
+
+Creates the same accounts through the Flask test client, for the in-memory
+and SQLite backends:
+
+- one POST /api/accounts per account, as test environments did on boot,
+- one POST /api/accounts/bulk with an NDJSON body,
+- the CSV import behind ACCOUNTS_IMPORT_FILE and the import CLI,
+
+then imports the file a second time to time duplicate detection alone.
+
+Usage: python benchmarks/bench_accounts.py [accounts]
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_email_server.import_accounts import import_account_file
+from python_email_server.main import create_app
+from python_email_server.sqlite_storage import SQLiteStorage
+from python_email_server.storage import Storage
+
+
+def account(i):
+    return {"username": f"user{i}", "domain": "bench.test", "password": "password123"}
+
+
+def single(client, path, count):
+    for i in range(count):
+        response = client.post("/api/accounts", json={**account(i), "confirm_password": "password123"})
+        assert response.status_code == 201, response.status_code
+
+
+def bulk(client, path, count):
+    body = "".join(json.dumps(account(i)) + "\n" for i in range(count))
+    response = client.post("/api/accounts/bulk", data=body, content_type="application/x-ndjson")
+    assert response.json["created"] == count, response.json["failed"]
+
+
+def csv_import(client, path, count):
+    counts = import_account_file(client.storage, path)
+    assert counts["created"] + counts["duplicates"] == count, counts
+
+
+def measure(backend, make_storage, method, path, count, repeat=False):
+    storage = make_storage()
+    client = create_app(storage).test_client()
+    client.storage = storage
+    if repeat:
+        csv_import(client, path, count)
+    start = time.perf_counter()
+    method(client, path, count)
+    elapsed = time.perf_counter() - start
+    name = f"{method.__name__}{' again' if repeat else ''}"
+    print(f"{backend:<8} {name:<18} {count / elapsed:10,.0f} accounts/s   ({elapsed:.2f} s)")
+    storage.close()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    print(f"{count:,} accounts")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "accounts.csv")
+        with open(path, "w") as f:
+            f.write("username,domain,password\n")
+            f.writelines(f"user{i},bench.test,password123\n" for i in range(count))
+
+        databases = iter(range(1_000))
+        backends = {
+            "memory": Storage,
+            "sqlite": lambda: SQLiteStorage(os.path.join(directory, f"{next(databases)}.db"))
+        }
+        for backend, make_storage in backends.items():
+            # Far fewer single requests: they are the slow path
+            measure(backend, make_storage, single, path, max(count // 10, 1))
+            measure(backend, make_storage, bulk, path, count)
+            measure(backend, make_storage, csv_import, path, count)
+            measure(backend, make_storage, csv_import, path, count, repeat=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for seeding mail over HTTP, one message per request or in batches.
+
+Serves the API on a local port with the threaded Werkzeug server and posts
+the same messages with http.client to:
+
+- POST /api/simulate/receive-email, one request per message,
+- POST /api/simulate/receive-emails with a JSON array per request,
+- POST /api/simulate/receive-emails with one NDJSON body streamed in chunks,
+
+and reports messages per second for the in-memory and SQLite backends.
+
+Usage: python benchmarks/bench_batch_ingest.py [messages] [batch size]
+"""
+
+import http.client
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server
+
+from python_email_server.main import create_app
+from python_email_server.sqlite_storage import SQLiteStorage
+from python_email_server.storage import Storage
+
+
+def generate(count):
+    for i in range(count):
+        yield {
+            "account_id": 1 + i % 3,
+            "sender": "Example Shop",
+            "sender_email": "noreply@shop.test",
+            "recipient": "dev@openmail.org",
+            "subject": f"Your order {i}",
+            "content": f"Order {i} has shipped. Sign in: https://shop.test/login?token={i}"
+        }
+
+
+def post(port, path, body, content_type, chunked=False):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.request("POST", path, body=body, headers={"Content-Type": content_type},
+                       encode_chunked=chunked)
+    response = connection.getresponse()
+    data = response.read()
+    connection.close()
+    if response.status not in (200, 201):
+        raise RuntimeError(f"{path} returned {response.status}: {data[:200]!r}")
+    return data
+
+
+def single(port, count, batch_size):
+    for message in generate(count):
+        post(port, "/api/simulate/receive-email", json.dumps(message), "application/json")
+
+
+def json_batches(port, count, batch_size):
+    messages = list(generate(count))
+    for start in range(0, count, batch_size):
+        post(port, "/api/simulate/receive-emails", json.dumps(messages[start:start + batch_size]),
+             "application/json")
+
+
+def ndjson_stream(port, count, batch_size):
+    messages = list(generate(count))
+    # One HTTP chunk per batch of lines, as a client streaming from a file would send
+    blocks = (
+        "".join(json.dumps(message) + "\n" for message in messages[start:start + batch_size]).encode()
+        for start in range(0, count, batch_size)
+    )
+    post(port, "/api/simulate/receive-emails", blocks, "application/x-ndjson", chunked=True)
+
+
+def measure(backend, storage, method, count, batch_size):
+    server = make_server("127.0.0.1", 0, create_app(storage), threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        start = time.perf_counter()
+        method(server.port, count, batch_size)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        thread.join()
+    print(f"{backend:<8} {method.__name__:<14} {count / elapsed:10,.0f} messages/s   ({elapsed:.2f} s)")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    print(f"{count:,} messages, JSON batches of {batch_size:,}")
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for method in (single, json_batches, ndjson_stream):
+            # Far fewer single requests: they are the slow path
+            n = max(count // 10, 1) if method is single else count
+            measure("memory", Storage(), method, n, batch_size)
+            storage = SQLiteStorage(os.path.join(directory, f"{method.__name__}.db"))
+            measure("sqlite", storage, method, n, batch_size)
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for keeping message bodies compressed in the memory backend.
+
+Generates a corpus of HTML emails shaped like real notification and
+marketing mail (nested layout tables, inline styles, per-message names,
+amounts, products and sign-in links, with a plain text alternative), then
+for Storage() and Storage(compress_bodies=True):
+
+- stores them and reports the time taken and the heap they occupy,
+- times GET /api/emails/<id> through the Flask test client, without
+  Accept-Encoding (compressed bodies decompressed, with the cache hot and
+  with it disabled) and with Accept-Encoding: gzip (stored bytes copied
+  into the response), and reports the response sizes.
+
+For comparison it also times gzipping the uncompressed response, which is
+what compressing responses on the fly would cost.
+
+Usage: python benchmarks/bench_body_compression.py [messages] [requests]
+"""
+
+import gzip
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_email_server.main import create_app
+from python_email_server.storage import Storage
+
+WORDS = (
+    "account order shipped delivery update review security sign device new payment receipt invoice "
+    "subscription renew plan team invite project comment mention weekly digest summary offer sale "
+    "limited time exclusive members free shipping returns support help center privacy settings"
+).split()
+PRODUCTS = ["Wireless Headphones", "Running Shoes", "Coffee Grinder", "Desk Lamp", "Backpack", "Water Bottle"]
+
+
+def sentence(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def html_email(rng, i):
+    name = rng.choice(["Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey"])
+    token = "%032x" % rng.getrandbits(128)
+    rows = "".join(
+        f'<tr><td style="padding:12px 24px;border-bottom:1px solid #eeeeee;font-family:Helvetica,Arial,sans-serif;'
+        f'font-size:14px;color:#333333;">{rng.choice(PRODUCTS)}</td>'
+        f'<td style="padding:12px 24px;border-bottom:1px solid #eeeeee;font-family:Helvetica,Arial,sans-serif;'
+        f'font-size:14px;color:#333333;text-align:right;">${rng.randint(5, 400)}.{rng.randint(0, 99):02d}</td></tr>\n'
+        for _ in range(rng.randint(3, 12))
+    )
+    paragraphs = "".join(
+        f'<p style="margin:0 0 16px;font-family:Helvetica,Arial,sans-serif;font-size:15px;line-height:22px;'
+        f'color:#444444;">{sentence(rng, rng.randint(10, 40))}</p>\n'
+        for _ in range(rng.randint(4, 20))
+    )
+    footer_links = "".join(
+        f'<a href="https://shop.example/{word}?utm_source=email&amp;utm_campaign=c{i % 50}" '
+        f'style="color:#888888;text-decoration:underline;">{word.capitalize()}</a> | '
+        for word in rng.sample(WORDS, 8)
+    )
+    html = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width">
+<style>@media only screen and (max-width:600px){{.container{{width:100% !important}}.stack{{display:block !important}}}}</style>
+</head><body style="margin:0;padding:0;background-color:#f4f4f4;">
+<table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0" style="background-color:#f4f4f4;">
+<tr><td align="center" style="padding:24px 0;">
+<table role="presentation" class="container" width="600" cellpadding="0" cellspacing="0" border="0" style="background-color:#ffffff;border-radius:8px;">
+<tr><td style="padding:32px 24px;font-family:Helvetica,Arial,sans-serif;font-size:22px;font-weight:bold;color:#111111;">Hi {name}, your order #{100000 + i} is on its way</td></tr>
+<tr><td style="padding:0 24px;">{paragraphs}</td></tr>
+<tr><td><table role="presentation" width="100%" cellpadding="0" cellspacing="0" border="0">{rows}</table></td></tr>
+<tr><td align="center" style="padding:32px 24px;"><a href="https://shop.example/login?token={token}" style="background-color:#0066ff;border-radius:4px;color:#ffffff;display:inline-block;font-family:Helvetica,Arial,sans-serif;font-size:16px;padding:14px 28px;text-decoration:none;">Sign in to track your order</a></td></tr>
+<tr><td style="padding:24px;font-family:Helvetica,Arial,sans-serif;font-size:12px;color:#888888;">{footer_links}<br>{sentence(rng, 30)}</td></tr>
+</table></td></tr></table></body></html>"""
+    text = f"Hi {name}, your order #{100000 + i} is on its way.\n\nSign in: https://shop.example/login?token={token}\n"
+    return text, html
+
+
+def corpus(messages, account_id):
+    rng = random.Random(25)
+    result = []
+    for i in range(messages):
+        text, html = html_email(rng, i)
+        result.append({
+            "account_id": account_id,
+            "sender": "Example Shop",
+            "sender_email": "orders@shop.example",
+            "recipient": "dev@openmail.org",
+            "subject": f"Your order #{100000 + i} has shipped",
+            "content": text,
+            "html_content": html
+        })
+    return result
+
+
+def store(storage, messages_data):
+    start = time.perf_counter()
+    for i in range(0, len(messages_data), 500):
+        storage.create_email_message_batch(messages_data[i:i + 500])
+    return time.perf_counter() - start
+
+
+def heap_used(make_storage, messages, account_id):
+    """Heap held by a storage after storing a corpus generated for it."""
+    tracemalloc.start()
+    storage = make_storage()
+    before = tracemalloc.get_traced_memory()[0]
+    # Bodies of their own, as received mail has, which the storage keeps
+    # (or not) once the corpus is dropped
+    messages_data = corpus(messages, account_id)
+    store(storage, messages_data)
+    del messages_data
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used
+
+
+def time_requests(client, message_ids, headers, requests):
+    sizes = []
+    start = time.perf_counter()
+    for i in range(requests):
+        response = client.get(f"/api/emails/{message_ids[i % len(message_ids)]}", headers=headers)
+        assert response.status_code == 200
+        sizes.append(len(response.data))
+    return (time.perf_counter() - start) / requests, sum(sizes) / len(sizes)
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    account_id = Storage().get_email_account_by_email("dev@openmail.org").id
+    messages_data = corpus(messages, account_id)
+    html_sizes = sorted(len(message["html_content"]) for message in messages_data)
+    print(f"{messages:,} messages, HTML bodies {html_sizes[0] / 1024:.1f}-{html_sizes[-1] / 1024:.1f} KiB "
+          f"(median {html_sizes[len(html_sizes) // 2] / 1024:.1f} KiB)")
+
+    backends = (
+        ("plain", lambda: Storage()),
+        ("compressed", lambda: Storage(compress_bodies=True))
+    )
+    for label, make_storage in backends:
+        seconds = store(make_storage(), messages_data)
+        used = heap_used(make_storage, messages, account_id)
+        print(f"{label:<12} stored in {seconds:6.2f} s ({messages / seconds:7,.0f} msgs/s)   "
+              f"heap {used / 2 ** 20:7.1f} MiB")
+
+    plain = Storage()
+    store(plain, messages_data)
+    compressed = Storage(compress_bodies=True)
+    store(compressed, messages_data)
+    stats = compressed.get_body_stats()
+    print(f"{'':<12} bodies {stats['stored_bytes'] / 2 ** 20:.1f} MiB, compressed "
+          f"{stats['compressed_bytes'] / 2 ** 20:.1f} MiB ({stats['compression_ratio']:.1f}x)")
+    # Without a cache every read decompresses
+    uncached = Storage(compress_bodies=True, body_cache_size=0)
+    store(uncached, messages_data)
+
+    hot = [message.id for message in plain.get_email_messages(account_id)][:20]
+    for label, storage, headers in (
+        ("plain", plain, {}),
+        ("cache hit", compressed, {}),
+        ("no cache", uncached, {}),
+        ("gzip", compressed, {"Accept-Encoding": "gzip"})
+    ):
+        ids = [message.id for message in storage.get_email_messages(account_id)][:20] if storage is not plain else hot
+        seconds, size = time_requests(create_app(storage).test_client(), ids, headers, requests)
+        print(f"GET /api/emails/<id> {label:<10} {seconds * 1000:7.3f} ms   {size / 1024:6.1f} KiB")
+
+    client = create_app(plain).test_client()
+    body = client.get(f"/api/emails/{hot[0]}").data
+    start = time.perf_counter()
+    for _ in range(requests):
+        gzip.compress(body, 6)
+    print(f"gzip of one plain response       {(time.perf_counter() - start) / requests * 1000:7.3f} ms   "
+          f"{len(gzip.compress(body, 6)) / 1024:6.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
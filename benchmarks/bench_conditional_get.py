@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for polling unchanged data with and without If-None-Match.
+
+Stores mail for one account among many, then times the requests a
+dashboard repeats every few seconds through the Flask test client, for the
+in-memory and SQLite backends:
+
+- GET /api/accounts
+- GET /api/accounts/<id>/emails
+- GET /api/accounts/<id>/emails/summary
+
+each sent plain (200 with the full body) and with the ETag of the previous
+response (304 Not Modified).
+
+Usage: python benchmarks/bench_conditional_get.py [accounts] [messages] [requests]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_email_server.main import create_app
+from python_email_server.sqlite_storage import SQLiteStorage
+from python_email_server.storage import Storage
+
+
+def populate(storage, accounts, messages):
+    storage.create_email_accounts([
+        {"username": f"user{i}", "domain": "bench.test", "email": f"user{i}@bench.test", "password": "password123"}
+        for i in range(accounts)
+    ])
+    account_id = storage.get_email_account_by_email("dev@openmail.org").id
+    storage.create_email_message_batch([
+        {
+            "account_id": account_id,
+            "sender": "Example Shop",
+            "sender_email": "noreply@shop.test",
+            "recipient": "dev@openmail.org",
+            "subject": f"Your order {i}",
+            "content": f"Order {i} has shipped. Sign in: https://shop.test/login?token={i}\n" * 20
+        }
+        for i in range(messages)
+    ])
+    storage.flush()
+    return account_id
+
+
+def measure(backend, client, path, requests):
+    etag = client.get(path).headers["ETag"]
+    timings = {}
+    for label, headers, status in (("full", {}, 200), ("304", {"If-None-Match": etag}, 304)):
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = client.get(path, headers=headers)
+            assert response.status_code == status, response.status_code
+        timings[label] = (time.perf_counter() - start) / requests
+    print(f"{backend:<8} {path:<32} full {timings['full'] * 1000:8.3f} ms   "
+          f"304 {timings['304'] * 1000:6.3f} ms   {timings['full'] / timings['304']:6.1f}x")
+
+
+def main():
+    accounts = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    requests = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    print(f"{accounts:,} accounts, {messages:,} messages in the polled account, {requests} requests each")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for backend, storage in (("memory", Storage()), ("sqlite", SQLiteStorage(os.path.join(directory, "bench.db")))):
+            account_id = populate(storage, accounts, messages)
+            client = create_app(storage).test_client()
+            for path in ("/api/accounts", f"/api/accounts/{account_id}/emails",
+                         f"/api/accounts/{account_id}/emails/summary"):
+                measure(backend, client, path, requests)
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
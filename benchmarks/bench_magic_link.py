@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for looking up the newest magic link sent to an address.
+
+Fills one inbox with mail, one message in `link_every` carrying a magic
+link, and times through the Flask test client:
+
+- the lookup endpoint, answered from the per-account link index,
+- the same with a sender filter that only old messages match,
+- what clients did before: find the account, list its whole inbox, pick
+  the newest email with links and fetch it, which also marked it read.
+
+Usage: python benchmarks/bench_magic_link.py [inbox size] [link_every]
+"""
+
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_email_server.main import create_app
+from python_email_server.storage import Storage
+
+ADDRESS = "dev@openmail.org"
+REQUESTS = 200
+
+
+def fill(storage, count, link_every):
+    account_id = storage.get_email_account_by_email(ADDRESS).id
+    for i in range(count):
+        # The first message is the only one from this sender
+        sender = "security@bank.test" if i == 0 else "noreply@shop.test"
+        content = f"Order {i} has shipped."
+        if i % link_every == 0:
+            content = f"Sign in: https://shop.test/login?token={i}"
+        storage.create_email_message({
+            "account_id": account_id,
+            "sender": "Shop",
+            "sender_email": sender,
+            "recipient": ADDRESS,
+            "subject": f"Message {i}",
+            "content": content
+        })
+
+
+def lookup(client, query=""):
+    response = client.get(f"/api/addresses/{ADDRESS}/magic-link{query}")
+    assert response.status_code == 200, response.status_code
+    return response.json["links"]
+
+
+def scan(client):
+    accounts = client.get("/api/accounts").json
+    account_id = next(account["id"] for account in accounts if account["email"] == ADDRESS)
+    emails = client.get(f"/api/accounts/{account_id}/emails").json
+    newest = next(email for email in emails if email["magic_links"])
+    return client.get(f"/api/emails/{newest['id']}").json["magic_links"]
+
+
+def measure(name, request, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        request()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    print(f"{name:<22} p50 {statistics.median(latencies):9.3f} ms   "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1]:9.3f} ms")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    link_every = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    storage = Storage()
+    client = create_app(storage).test_client()
+    fill(storage, count, link_every)
+    print(f"{count:,} messages in the inbox, one in {link_every} with a magic link")
+
+    assert lookup(client) == scan(client)
+    measure("index", lambda: lookup(client), REQUESTS)
+    measure("index, keyword", lambda: lookup(client, "?keyword=login"), REQUESTS)
+    measure("index, old sender", lambda: lookup(client, "?sender=bank"), max(REQUESTS // 10, 1))
+    measure("inbox scan", lambda: scan(client), max(REQUESTS // 20, 1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Memory and ingest benchmark for the internal message representation.
+
+Stores the same messages as pydantic `EmailMessage` models (what Storage
+used to keep) and as `MessageRecord` objects, and reports the heap bytes per
+message as traced by tracemalloc. Bodies are shared between messages, as
+Storage interns them, so the figures are the per-message overhead: object,
+subject, snippet, timestamp, headers.
+
+Then compares ingest throughput: building each representation, and
+end-to-end `Storage.create_email_message`.
+
+Usage: python benchmarks/bench_message_memory.py [messages]
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_email_server.email_parser import extract_message_magic_links, make_snippet
+from python_email_server.models import EmailMessage, MessageRecord
+from python_email_server.storage import Storage
+
+CONTENT = "Click https://example.com/login?token=abc123 to sign in.\n\n" + "This link expires in 15 minutes. " * 20
+HTML = f"<html><body><p>{CONTENT}</p></body></html>"
+
+
+def fields(i):
+    return {
+        "id": i,
+        "account_id": i % 1000,
+        "sender": "Example",
+        "sender_email": "noreply@example.com",
+        "recipient": f"user{i % 1000}@example.com",
+        "subject": f"Your sign-in link #{i}",
+        "content": CONTENT,
+        "html_content": HTML,
+        "snippet": make_snippet(CONTENT, HTML),
+        "magic_links": extract_message_magic_links(CONTENT, HTML),
+        "attachments": [],
+        "received_at": datetime.now(),
+        "read": False,
+        "headers": {"Message-ID": f"<{i}@example.com>"}
+    }
+
+
+def measure_memory(name, factory, count):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    messages = {i: factory(**fields(i)) for i in range(1, count + 1)}
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del messages
+    print(f"{name:<14} {used / count:8.0f} bytes/message   {used / 2 ** 20:9.1f} MiB for {count:,}")
+    return used / count
+
+
+def measure_build(name, factory, count):
+    batch = [fields(i) for i in range(count)]
+    start = time.perf_counter()
+    for data in batch:
+        factory(**data)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<14} {count / elapsed:12,.0f} builds/s")
+
+
+def measure_ingest(count):
+    storage = Storage()
+    start = time.perf_counter()
+    for i in range(count):
+        storage.create_email_message({
+            "account_id": 1 + i % 3,
+            "sender": "Example",
+            "sender_email": "noreply@example.com",
+            "recipient": "dev@openmail.org",
+            "subject": f"Your sign-in link #{i}",
+            "content": CONTENT,
+            "html_content": HTML,
+            "headers": {"Message-ID": f"<{i}@example.com>"}
+        })
+    elapsed = time.perf_counter() - start
+    print(f"{'Storage':<14} {count / elapsed:12,.0f} create_email_message/s")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+    print("Memory")
+    model = measure_memory("EmailMessage", EmailMessage, count)
+    record = measure_memory("MessageRecord", MessageRecord, count)
+    print(f"{'':<14} x{model / record:.1f} smaller")
+
+    build_count = min(count, 200_000)
+    print("\nIngest")
+    measure_build("EmailMessage", EmailMessage, build_count)
+    measure_build("MessageRecord", MessageRecord, build_count)
+    measure_ingest(build_count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for bytes-native MIME parsing.
+
+Builds a corpus of large multipart messages (UTF-8 and ISO-8859-1 text and
+HTML parts sent as 8bit, a base64 attachment) and
+compares the previous path -- decode the whole message to str, parse with
+message_from_string, decode every payload as UTF-8 -- with parse_email on
+the raw bytes. Reports wall time, peak traced allocations, and how many
+messages the previous path decoded incorrectly.
+
+Usage: python benchmarks/bench_mime_parsing.py [messages] [body KB]
+"""
+
+import base64
+import email
+import os
+import sys
+import time
+import tracemalloc
+from email.policy import default
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_email_server.email_parser import parse_email
+
+
+def build_corpus(count, body_kb):
+    attachment = base64.encodebytes(os.urandom(body_kb * 256))
+    corpus = []
+    for i in range(count):
+        charset = "iso-8859-1" if i % 2 else "utf-8"
+        text = (f"Bonjour {i}, cliquez ici pour vérifier votre adresse électronique.\n" * 16 * body_kb)[:body_kb * 1024]
+        html = f"<html><body><p>{text}</p><a href='https://example.com/verify?token={i}'>Vérifier</a></body></html>"
+
+        # Text parts are raw 8bit in their declared charset, as many real mailers send them
+        raw = b"".join([
+            b"From: Bench <bench@example.com>\r\n"
+            b"To: user@example.com\r\n",
+            f"Subject: Message {i}\r\n".encode(),
+            b"MIME-Version: 1.0\r\n"
+            b'Content-Type: multipart/mixed; boundary="outer"\r\n\r\n'
+            b"--outer\r\n"
+            b'Content-Type: multipart/alternative; boundary="inner"\r\n\r\n'
+            b"--inner\r\n",
+            f"Content-Type: text/plain; charset={charset}\r\n".encode(),
+            b"Content-Transfer-Encoding: 8bit\r\n\r\n",
+            text.encode(charset),
+            b"\r\n--inner\r\n",
+            f"Content-Type: text/html; charset={charset}\r\n".encode(),
+            b"Content-Transfer-Encoding: 8bit\r\n\r\n",
+            html.encode(charset),
+            b"\r\n--inner--\r\n"
+            b"--outer\r\n"
+            b'Content-Type: application/octet-stream; name="report.bin"\r\n'
+            b"Content-Transfer-Encoding: base64\r\n\r\n",
+            attachment,
+            b"--outer--\r\n"
+        ])
+        corpus.append((raw, text, html))
+    return corpus
+
+
+def legacy_parse(raw):
+    """The previous path: str round trip and UTF-8 payload decoding."""
+    msg = email.message_from_string(raw.decode("utf-8", errors="replace"), policy=default)
+    text, html = "", None
+    for part in msg.walk():
+        if part.get_content_type() == "text/plain":
+            text = part.get_payload(decode=True).decode("utf-8", errors="replace")
+        elif part.get_content_type() == "text/html":
+            html = part.get_payload(decode=True).decode("utf-8", errors="replace")
+    return text, html
+
+
+def bytes_parse(raw):
+    parsed = parse_email(raw)
+    return parsed.text, parsed.html
+
+
+def measure(name, func, corpus):
+    start = time.perf_counter()
+    results = [func(raw) for raw, _, _ in corpus]
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for raw, _, _ in corpus:
+        func(raw)
+        # Peak allocation per message, not for the whole corpus
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+    tracemalloc.stop()
+
+    wrong = sum(1 for (_, text, html), result in zip(corpus, results) if result != (text, html))
+    print(f"{name:<8} {elapsed * 1000:9.1f} ms   {len(corpus) / elapsed:8.1f} msg/s   "
+          f"last peak {peak / 1024:8.0f} KiB   wrong bodies {wrong}/{len(corpus)}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    body_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    corpus = build_corpus(count, body_kb)
+    size = sum(len(raw) for raw, _, _ in corpus) / len(corpus)
+    print(f"{count} messages, {size / 1024:.0f} KiB each on average")
+
+    measure("legacy", legacy_parse, corpus)
+    measure("bytes", bytes_parse, corpus)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for serving the API from several processes over one SQLite database.
+
+Starts run.py in production mode with the SQLite backend, once as a single
+process and once with API_PROCESSES set (one ingest process receiving mail
+plus that many API processes), then for each:
+
+- reports how long after the SMTP server accepts a message it is returned
+  by GET /api/accounts/<id>/emails and wakes long-polls spread over the API
+  processes (p50 and max over the messages sent),
+- issues GET /api/accounts/<id>/emails/summary from concurrent keep-alive
+  clients and reports requests per second with p50 and p99 latency.
+
+Usage: python benchmarks/bench_scale_out.py [API processes] [messages] [seconds]
+"""
+
+import http.client
+import json
+import os
+import smtplib
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HTTP_PORT = 8791
+SMTP_PORT = 2591
+WAITERS = 8
+CLIENTS = 32
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+
+def start_server(database, api_processes):
+    env = dict(
+        os.environ,
+        SERVER_MODE="production",
+        API_PROCESSES=str(api_processes),
+        STORAGE_BACKEND="sqlite",
+        SQLITE_PATH=database,
+        PORT=str(HTTP_PORT),
+        SMTP_PORT=str(SMTP_PORT),
+        SMTP_HOST="127.0.0.1"
+    )
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "run.py")], env=env, cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(SMTP_PORT)
+    wait_for_port(HTTP_PORT)
+    # Let every API process start accepting
+    time.sleep(2)
+    return process
+
+
+def get(path):
+    connection = http.client.HTTPConnection("127.0.0.1", HTTP_PORT, timeout=30)
+    connection.request("GET", path)
+    response = connection.getresponse()
+    data = response.read()
+    connection.close()
+    return response.status, data
+
+
+def account_id():
+    accounts = json.loads(get("/api/accounts")[1])
+    return next(account["id"] for account in accounts if account["email"] == "dev@openmail.org")
+
+
+def visibility(account, messages):
+    """Seconds from SMTP acceptance to being listed, and to waking long-polls, per message."""
+    listed, woken = [], []
+    smtp = smtplib.SMTP("127.0.0.1", SMTP_PORT)
+    for i in range(messages):
+        subject = f"Visibility {i}"
+        wakes = []
+
+        def wait():
+            status, _ = get(f"/api/accounts/{account}/emails/wait?timeout=10&subject={subject.replace(' ', '+')}")
+            if status == 200:
+                wakes.append(time.perf_counter())
+
+        # Fresh connections, so the waiters land on different API processes
+        waiters = [threading.Thread(target=wait) for _ in range(WAITERS)]
+        for waiter in waiters:
+            waiter.start()
+        time.sleep(0.2)
+
+        smtp.sendmail("noreply@shop.test", ["dev@openmail.org"], f"Subject: {subject}\r\n\r\nHello")
+        accepted = time.perf_counter()
+        while not any(email["subject"] == subject for email in json.loads(get(f"/api/accounts/{account}/emails")[1])):
+            time.sleep(0.002)
+        listed.append(time.perf_counter() - accepted)
+        for waiter in waiters:
+            waiter.join()
+        if len(wakes) == WAITERS:
+            woken.append(max(wakes) - accepted)
+    smtp.quit()
+    return sorted(listed), sorted(woken)
+
+
+def http_load(path, seconds):
+    latencies = [[] for _ in range(CLIENTS)]
+    deadline = time.perf_counter() + seconds
+
+    def client(samples):
+        connection = http.client.HTTPConnection("127.0.0.1", HTTP_PORT, timeout=30)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            connection.request("GET", path)
+            connection.getresponse().read()
+            samples.append(time.perf_counter() - start)
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(samples,)) for samples in latencies]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latency for samples in latencies for latency in samples)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+
+def main():
+    api_processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print(f"{os.cpu_count()} CPUs, {messages} messages, {WAITERS} long-polls each, {CLIENTS} HTTP clients")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for processes in (1, api_processes):
+            label = "1 process" if processes == 1 else f"1 + {processes} API"
+            server = start_server(os.path.join(directory, f"{processes}.db"), processes)
+            try:
+                account = account_id()
+                listed, woken = visibility(account, messages)
+                print(f"{label:<14} listed after    p50 {percentile(listed, 0.5):6.1f} ms   "
+                      f"max {listed[-1] * 1000:6.1f} ms")
+                if woken:
+                    print(f"{label:<14} all woken after p50 {percentile(woken, 0.5):6.1f} ms   "
+                          f"max {woken[-1] * 1000:6.1f} ms")
+                else:
+                    print(f"{label:<14} long-polls were not all woken")
+
+                latencies = http_load(f"/api/accounts/{account}/emails/summary?limit=20", seconds)
+                print(f"{label:<14} {len(latencies) / seconds:8,.0f} req/s   "
+                      f"p50 {percentile(latencies, 0.5):7.2f} ms   p99 {percentile(latencies, 0.99):7.2f} ms")
+            finally:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for full-text search over the in-memory Storage.
+
+Delivers synthetic mail (a Zipf-distributed vocabulary, a unique order
+number per message) spread over many accounts and reports:
+
+- ingest throughput with the search index maintained on every delivery,
+- heap size of the inverted index, traced with tracemalloc,
+- search latency for common, rare and two-word queries, against what
+  clients did before: fetch the whole inbox and filter it themselves,
+- the cost of evicting messages, which removes their postings.
+
+Usage: python benchmarks/bench_search.py [messages] [accounts]
+"""
+
+import gc
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_email_server.models import MessageRecord
+from python_email_server.retention import RetentionPolicy
+from python_email_server.search import SearchIndex, body_terms, message_terms, query_terms, tokenize
+from python_email_server.storage import Storage
+
+VOCABULARY = [f"word{i}" for i in range(5000)]
+CUMULATIVE_WEIGHTS = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(VOCABULARY))))
+SUBJECTS = ["Your order", "Invoice", "Sign in to your account", "Weekly digest", "Password reset"]
+QUERIES = 1000
+
+
+def generate(count, accounts):
+    rng = random.Random(42)
+    for i in range(count):
+        words = rng.choices(VOCABULARY, cum_weights=CUMULATIVE_WEIGHTS, k=40)
+        yield {
+            "account_id": 1 + i % accounts,
+            "sender": "Example Shop",
+            "sender_email": f"noreply@shop{i % 20}.test",
+            "recipient": "user@bench.test",
+            "subject": f"{SUBJECTS[i % len(SUBJECTS)]} {words[0]}",
+            "content": f"Order {100000 + i}: " + " ".join(words)
+        }
+
+
+def ingest(count, accounts):
+    storage = Storage()
+    for i in range(accounts):
+        storage.create_email_account({
+            "username": f"user{i}",
+            "domain": "bench.test",
+            "email": f"user{i}@bench.test",
+            "password": "password123"
+        })
+    start = time.perf_counter()
+    for data in generate(count, accounts):
+        storage.create_email_message(data)
+    elapsed = time.perf_counter() - start
+    print(f"ingest        {count / elapsed:10,.0f} messages/s with indexing ({elapsed:.1f} s)")
+    return storage
+
+
+def measure_index_memory(count, accounts):
+    gc.collect()
+    tracemalloc.start()
+    index = SearchIndex()
+    for i, data in enumerate(generate(count, accounts), start=1):
+        message = MessageRecord(id=i, **data)
+        index.add(message.account_id, i, message_terms(message, body_terms(message.content, None)))
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    stats = index.stats()
+    print(f"index         {used / 2 ** 20:10,.1f} MiB   {used / count:6.0f} bytes/message   "
+          f"{stats['terms']:,} terms   {stats['postings']:,} postings")
+
+
+def scan(storage, account_id, query, limit):
+    """The client-side search the endpoint replaces: fetch everything and filter."""
+    words = query_terms(query)
+    matches = []
+    for message in storage.get_email_messages(account_id):
+        tokens = set(tokenize(
+            f"{message.subject} {message.sender} {message.sender_email} {message.recipient} {message.content}"
+        ))
+        if all(word in tokens for word in words):
+            matches.append(message)
+    return len(matches), matches[:limit]
+
+
+def measure_queries(storage, accounts):
+    rng = random.Random(7)
+    workloads = {
+        "common word": lambda: VOCABULARY[rng.randrange(5)],
+        "rare word": lambda: VOCABULARY[rng.randrange(2000, 5000)],
+        "two words": lambda: f"{VOCABULARY[rng.randrange(50)]} {VOCABULARY[rng.randrange(50, 500)]}",
+        "subject + word": lambda: f"invoice {VOCABULARY[rng.randrange(100)]}",
+    }
+    for name, make_query in workloads.items():
+        cases = [(1 + rng.randrange(accounts), make_query()) for _ in range(QUERIES)]
+        for method, search in (("index", storage.search_email_messages), ("scan", lambda *args: scan(storage, *args))):
+            latencies = []
+            hits = 0
+            for account_id, query in cases[:QUERIES if method == "index" else QUERIES // 10]:
+                start = time.perf_counter()
+                total, _ = search(account_id, query, 20)
+                latencies.append((time.perf_counter() - start) * 1000)
+                hits += total
+            latencies.sort()
+            print(f"{name:<15} {method:<6} p50 {statistics.median(latencies):8.3f} ms   "
+                  f"p99 {latencies[int(len(latencies) * 0.99) - 1]:8.3f} ms   "
+                  f"{hits / len(latencies):8.1f} matches/query")
+
+
+def measure_eviction(storage, count):
+    keep = count // 2
+    start = time.perf_counter()
+    evicted = sum(storage.enforce_retention(RetentionPolicy(max_messages=keep), 1000).values())
+    elapsed = time.perf_counter() - start
+    print(f"evict         {evicted / elapsed:10,.0f} messages/s removing postings")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    accounts = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    print(f"{count:,} messages over {accounts:,} accounts ({count // accounts:,} per inbox)")
+
+    storage = ingest(count, accounts)
+    measure_queries(storage, accounts)
+    measure_eviction(storage, count)
+    del storage
+    measure_index_memory(count, accounts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for writing API responses as JSON.
+
+Serializes stored records the way the routes used to (validate each record
+into its pydantic model, model_dump() it, drop the password, then jsonify
+the result) and with the ResponseSchema the routes use now, for:
+
+- a listing of an account's messages (GET /api/accounts/<id>/emails),
+- a page of 500 message summaries (GET /api/accounts/<id>/emails/summary),
+- the list of accounts (GET /api/accounts),
+
+and reports the time per response and the peak memory allocated while
+writing the message listing whole and as a streamed array. The streamed
+listing's peak is also measured with bodies read back from the raw store,
+decompressed (with no body cache) and from SQLite, loading the whole inbox
+before streaming it and loading it chunk by chunk as the route does.
+
+Usage: python benchmarks/bench_serialization.py [messages] [accounts] [repeats]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify
+
+from python_email_server.api import ACCOUNT_JSON, MESSAGE_JSON, STREAM_CHUNK_SIZE, SUMMARY_JSON
+from python_email_server.models import EmailMessage, EmailMessageSummary
+from python_email_server.raw_store import RawMessageStore
+from python_email_server.sqlite_storage import SQLiteStorage
+from python_email_server.storage import Storage
+
+
+def populate(storage, messages, accounts):
+    storage.create_email_accounts([
+        {"username": f"user{i}", "domain": "bench.test", "email": f"user{i}@bench.test", "password": "password123"}
+        for i in range(accounts)
+    ])
+    account_id = storage.get_email_account_by_email("dev@openmail.org").id
+    storage.create_email_message_batch([
+        {
+            "account_id": account_id,
+            "sender": "Example Shop",
+            "sender_email": "noreply@shop.test",
+            "recipient": "dev@openmail.org",
+            "subject": f"Your order {i}",
+            "content": f"Order {i} has shipped. Sign in: https://shop.test/login?token={i}\n" * 20,
+            "html_content": f"<p>Order {i} has shipped. <a href='https://shop.test/login?token={i}'>Sign in</a></p>" * 20,
+            "headers": {"Message-ID": f"<{i}@shop.test>", "X-Mailer": "bench"}
+        }
+        for i in range(messages)
+    ])
+    return account_id
+
+
+def stream_peaks(messages, directory):
+    """Peak memory of streaming the message listing from each kind of storage."""
+    backends = (
+        ("memory", Storage()),
+        ("raw store", Storage(raw_store=RawMessageStore(os.path.join(directory, "raw")))),
+        ("compressed", Storage(compress_bodies=True, body_cache_size=0)),
+        ("sqlite", SQLiteStorage(os.path.join(directory, "bench.db")))
+    )
+    for label, storage in backends:
+        account_id = populate(storage, messages, 0)
+
+        def loaded_first():
+            emails = storage.get_email_messages(account_id)
+            for _ in MESSAGE_JSON.stream_many((MESSAGE_JSON.row(email) for email in emails), STREAM_CHUNK_SIZE):
+                pass
+
+        def chunk_by_chunk():
+            _, emails = storage.stream_email_messages(account_id)
+            for _ in MESSAGE_JSON.stream_many((MESSAGE_JSON.row(email) for email in emails), STREAM_CHUNK_SIZE):
+                pass
+
+        print(f"{'streamed':<14} {label:<10} inbox loaded first {peak_memory(loaded_first) / 2 ** 20:6.1f} MiB   "
+              f"loaded per chunk {peak_memory(chunk_by_chunk) / 2 ** 20:6.1f} MiB")
+        storage.close()
+
+
+def timed(function, repeats):
+    function()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    accounts = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    print(f"{messages:,} messages, {accounts:,} accounts, {repeats} repeats")
+
+    storage = Storage()
+    account_id = populate(storage, messages, accounts)
+    emails = storage.get_email_messages(account_id)
+    page = emails[:500]
+    account_list = storage.get_email_accounts()
+    app = Flask(__name__)
+
+    def model_dump_emails():
+        return jsonify([EmailMessage.model_validate(email).model_dump() for email in emails]).get_data()
+
+    def model_dump_page():
+        return jsonify({
+            "emails": [EmailMessageSummary.model_validate(email).model_dump() for email in page],
+            "has_more": True,
+            "next_cursor": page[-1].id
+        }).get_data()
+
+    def model_dump_accounts():
+        result = []
+        for account in account_list:
+            account_dict = account.model_dump()
+            account_dict["unread_count"] = storage.get_unread_count(account.id)
+            account_dict.pop("password", None)
+            result.append(account_dict)
+        return jsonify(result).get_data()
+
+    def schema_emails():
+        return MESSAGE_JSON.dumps_many([MESSAGE_JSON.row(email) for email in emails])
+
+    def schema_page():
+        return SUMMARY_JSON.dumps_page(page, has_more=True, next_cursor=page[-1].id)
+
+    def schema_accounts():
+        return ACCOUNT_JSON.dumps_many([
+            ACCOUNT_JSON.row(account, unread_count=storage.get_unread_count(account.id)) for account in account_list
+        ])
+
+    def stream_emails():
+        for _ in MESSAGE_JSON.stream_many((MESSAGE_JSON.row(email) for email in emails), STREAM_CHUNK_SIZE):
+            pass
+
+    with app.app_context():
+        for label, before, after in (
+            ("messages", model_dump_emails, schema_emails),
+            ("summary page", model_dump_page, schema_page),
+            ("accounts", model_dump_accounts, schema_accounts)
+        ):
+            old, new = timed(before, repeats), timed(after, repeats)
+            print(f"{label:<14} model_dump + jsonify {old * 1000:8.2f} ms   "
+                  f"ResponseSchema {new * 1000:8.2f} ms   {old / new:5.1f}x")
+
+        print(f"{'peak memory':<14} model_dump + jsonify {peak_memory(model_dump_emails) / 2 ** 20:6.1f} MiB   "
+              f"whole {peak_memory(schema_emails) / 2 ** 20:6.1f} MiB   "
+              f"streamed {peak_memory(stream_emails) / 2 ** 20:6.1f} MiB")
+
+    with tempfile.TemporaryDirectory() as directory:
+        stream_peaks(messages, directory)
+
+
+if __name__ == "__main__":
+    main()
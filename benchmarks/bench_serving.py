@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for the development and production server modes.
+
+Starts run.py in a subprocess with SERVER_MODE=development (Flask's threaded
+development server, SMTP on a thread of its own) and SERVER_MODE=production
+(SMTP and the API through Uvicorn on one event loop), then for each:
+
+- issues GET /api/accounts/<id>/emails/summary from a number of concurrent
+  keep-alive clients and reports requests per second with p50 and p99 latency,
+- delivers mail over SMTP while the heaviest HTTP load runs and reports
+  messages per second.
+
+Usage: python benchmarks/bench_serving.py [seconds per level] [concurrency ...]
+"""
+
+import http.client
+import json
+import os
+import smtplib
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HTTP_PORT = 8790
+SMTP_PORT = 2590
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port}")
+
+
+def start_server(mode):
+    env = dict(
+        os.environ,
+        SERVER_MODE=mode,
+        PORT=str(HTTP_PORT),
+        SMTP_PORT=str(SMTP_PORT),
+        SMTP_HOST="127.0.0.1",
+        STORAGE_BACKEND="memory"
+    )
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "run.py")], env=env, cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(HTTP_PORT)
+    wait_for_port(SMTP_PORT)
+    return process
+
+
+def seed(messages=200):
+    client = smtplib.SMTP("127.0.0.1", SMTP_PORT)
+    for i in range(messages):
+        client.sendmail("noreply@shop.test", ["dev@openmail.org"],
+                        f"Subject: Order {i}\r\n\r\nSign in: https://shop.test/login?token={i}")
+    client.quit()
+
+
+def account_id():
+    connection = http.client.HTTPConnection("127.0.0.1", HTTP_PORT)
+    connection.request("GET", "/api/accounts")
+    accounts = json.loads(connection.getresponse().read())
+    connection.close()
+    return next(account["id"] for account in accounts if account["email"] == "dev@openmail.org")
+
+
+def http_load(path, concurrency, seconds):
+    """Run `concurrency` keep-alive clients for `seconds`; returns request latencies."""
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0]
+    deadline = time.perf_counter() + seconds
+
+    def client(samples):
+        connection = http.client.HTTPConnection("127.0.0.1", HTTP_PORT, timeout=30)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors[0] += 1
+            except (OSError, http.client.HTTPException):
+                errors[0] += 1
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", HTTP_PORT, timeout=30)
+                continue
+            samples.append(time.perf_counter() - start)
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(samples,)) for samples in latencies]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latency for samples in latencies for latency in samples), errors[0]
+
+
+def smtp_load(seconds):
+    """Deliver mail over one SMTP connection for `seconds`; returns messages sent."""
+    client = smtplib.SMTP("127.0.0.1", SMTP_PORT)
+    sent = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        client.sendmail("noreply@shop.test", ["dev@openmail.org"], f"Subject: Load {sent}\r\n\r\nHello")
+        sent += 1
+    client.quit()
+    return sent
+
+
+def report(mode, label, latencies, errors, seconds):
+    if not latencies:
+        print(f"{mode:<12} {label:<16} no successful requests ({errors} errors)")
+        return
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"{mode:<12} {label:<16} {len(latencies) / seconds:8,.0f} req/s   "
+          f"p50 {p50:7.2f} ms   p99 {p99:7.2f} ms   errors {errors}")
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    levels = [int(level) for level in sys.argv[2:]] or [1, 16, 64]
+
+    for mode in ("development", "production"):
+        process = start_server(mode)
+        try:
+            seed()
+            path = f"/api/accounts/{account_id()}/emails/summary?limit=20"
+            for concurrency in levels:
+                latencies, errors = http_load(path, concurrency, seconds)
+                report(mode, f"{concurrency} clients", latencies, errors, seconds)
+
+            sent = [0]
+            smtp = threading.Thread(target=lambda: sent.__setitem__(0, smtp_load(seconds)))
+            smtp.start()
+            latencies, errors = http_load(path, max(levels), seconds)
+            smtp.join()
+            report(mode, f"{max(levels)} + SMTP", latencies, errors, seconds)
+            print(f"{mode:<12} {'SMTP under load':<16} {sent[0] / seconds:8,.0f} messages/s")
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark comparing the in-memory and SQLite storage backends.
+
+Measures message ingest throughput (SMTP-style single inserts, group
+committed for SQLite) from one thread and from `threads` threads at once,
+as SMTP sessions store mail, and listing throughput (first summary page and
+full inbox) for each backend.
+
+Usage: python benchmarks/bench_storage_backends.py [messages] [accounts] [threads]
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_email_server.storage import Storage
+from python_email_server.sqlite_storage import SQLiteStorage
+
+
+def run(name, storage, message_count, account_count, thread_count):
+    account_ids = [
+        storage.create_email_account({
+            "username": f"user{i}",
+            "domain": "bench.test",
+            "email": f"user{i}@bench.test",
+            "password": "password123"
+        }).id
+        for i in range(account_count)
+    ]
+
+    body = "Please confirm your address: https://bench.test/verify?token=abc\n" * 20
+
+    def ingest(messages):
+        for i in messages:
+            storage.create_email_message({
+                "account_id": account_ids[i % account_count],
+                "sender": "Bench",
+                "sender_email": "bench@bench.test",
+                "recipient": f"user{i % account_count}@bench.test",
+                "subject": f"Message {i}",
+                "content": body,
+                "headers": {"Subject": f"Message {i}"}
+            })
+
+    # Half the messages from one thread, half spread over the threads
+    half = message_count // 2
+    start = time.perf_counter()
+    ingest(range(half))
+    storage.flush()
+    serial = time.perf_counter() - start
+
+    threads = [
+        threading.Thread(target=ingest, args=(range(half + i, message_count, thread_count),))
+        for i in range(thread_count)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    storage.flush()
+    concurrent = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for account_id in account_ids:
+        storage.get_email_message_page(account_id, 20)
+    page = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for account_id in account_ids:
+        storage.get_email_messages(account_id)
+    full = time.perf_counter() - start
+
+    print(f"{name:<8} ingest {half / serial:8.0f} msg/s, "
+          f"{thread_count} threads {(message_count - half) / concurrent:8.0f} msg/s   "
+          f"page {account_count / page:8.0f} req/s   "
+          f"inbox {account_count / full:8.0f} req/s")
+
+
+def main():
+    message_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    account_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    thread_count = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+    run("memory", Storage(), message_count, account_count, thread_count)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SQLiteStorage(os.path.join(tmp, "bench.db"))
+        try:
+            run("sqlite", storage, message_count, account_count, thread_count)
+        finally:
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""
+Thread scaling benchmark for the in-memory Storage.
+
+Runs a fixed amount of mixed ingest/read work split over 1, 2, 4, ... threads
+and reports throughput. On a GIL build throughput stays roughly flat (the
+point there is that it does not collapse under lock contention); run it on a
+free-threaded build to see the striped locks scale:
+
+    python3.13t benchmarks/bench_storage_scaling.py
+
+Usage: python benchmarks/bench_storage_scaling.py [total operations] [max threads]
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_email_server.storage import Storage
+
+ACCOUNTS = 1_000
+
+
+def worker(storage, account_ids, operations, offset, barrier):
+    barrier.wait()
+    for i in range(operations):
+        account_id = account_ids[(offset + i) % len(account_ids)]
+        if i % 4:
+            storage.create_email_message({
+                "account_id": account_id,
+                "sender": "Bench",
+                "sender_email": "bench@bench.test",
+                "recipient": "user@bench.test",
+                "subject": f"Message {i}",
+                "content": "Hello"
+            })
+        else:
+            storage.get_email_message_page(account_id, 10)
+            storage.get_unread_count(account_id)
+
+
+def run(threads, total):
+    storage = Storage()
+    account_ids = [
+        storage.create_email_account({
+            "username": f"user{i}",
+            "domain": "bench.test",
+            "email": f"user{i}@bench.test",
+            "password": "password123"
+        }).id
+        for i in range(ACCOUNTS)
+    ]
+    per_thread = total // threads
+    barrier = threading.Barrier(threads + 1)
+    pool = [
+        threading.Thread(target=worker, args=(storage, account_ids, per_thread, n * 7919, barrier))
+        for n in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    max_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    gil = sys._is_gil_enabled() if hasattr(sys, "_is_gil_enabled") else True
+    print(f"Python {sys.version.split()[0]}, GIL {'enabled' if gil else 'disabled'}, "
+          f"{os.cpu_count()} CPUs")
+
+    baseline = None
+    threads = 1
+    while threads <= max_threads:
+        ops = run(threads, total)
+        baseline = baseline or ops
+        print(f"{threads:3d} threads {ops:12.0f} ops/s   x{ops / baseline:5.2f}")
+        threads *= 2
+
+
+if __name__ == "__main__":
+    main()
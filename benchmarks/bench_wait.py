@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for waiting on new mail with many concurrent waiters.
+
+Starts one thread per account blocked in a MessageWatch (what the long-poll
+and SSE endpoints of the Flask app do, one request thread each), then
+delivers one matching message to every account and reports wake-up latency;
+then does the same with one coroutine per account awaiting an
+AsyncMessageWatch on an event loop, as production mode serves them, with
+storage read on a pool of four threads. Ingest throughput is
+measured with no waiters, with every waiter blocked on an account that gets
+no mail, and with the same number of threads polling
+`get_email_messages` in a loop, as end-to-end tests did before.
+
+Usage: python benchmarks/bench_wait.py [waiters] [messages]
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_email_server.notifications import AsyncMessageWatch, MessageFilter, MessageWatch
+from python_email_server.storage import Storage
+
+MATCH = MessageFilter(sender="noreply@", magic_link=True)
+
+
+def make_storage(accounts):
+    storage = Storage()
+    account_ids = [
+        storage.create_email_account({
+            "username": f"user{i}",
+            "domain": "bench.test",
+            "email": f"user{i}@bench.test",
+            "password": "password123"
+        }).id
+        for i in range(accounts)
+    ]
+    return storage, account_ids
+
+
+def deliver(storage, account_id, i):
+    storage.create_email_message({
+        "account_id": account_id,
+        "sender": "Example",
+        "sender_email": "noreply@example.com",
+        "recipient": "user@bench.test",
+        "subject": f"Sign in #{i}",
+        "content": f"Click https://example.com/login?token={i} to sign in."
+    })
+
+
+def deliver_all(storage, account_ids):
+    """Deliver a message to each account; returns when each was sent and the time taken."""
+    sent = {}
+    start = time.perf_counter()
+    for i, account_id in enumerate(account_ids):
+        sent[account_id] = time.perf_counter()
+        deliver(storage, account_id, i)
+    return sent, start
+
+
+def report_wakeups(label, waiters, account_ids, sent, woken, start):
+    elapsed = time.perf_counter() - start
+    latencies = sorted((woken[a] - sent[a]) * 1000 for a in account_ids if a in woken)
+    print(f"{label:<11} woke {len(latencies)}/{waiters} in {elapsed * 1000:.0f} ms   "
+          f"latency p50 {statistics.median(latencies):.2f} ms   "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f} ms   max {latencies[-1]:.2f} ms")
+
+
+def measure_wakeups(waiters):
+    storage, account_ids = make_storage(waiters)
+    woken = {}
+    ready = threading.Barrier(waiters + 1)
+
+    def wait(account_id):
+        with MessageWatch(storage, account_id, MATCH, deadline=time.monotonic() + 60) as watch:
+            ready.wait()
+            if next(iter(watch), None) is not None:
+                woken[account_id] = time.perf_counter()
+
+    threads = [threading.Thread(target=wait, args=(account_id,)) for account_id in account_ids]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    print(f"{storage.notifier.waiter_count()} waiters subscribed")
+
+    sent, start = deliver_all(storage, account_ids)
+    for thread in threads:
+        thread.join()
+    report_wakeups("threads", waiters, account_ids, sent, woken, start)
+
+
+def measure_async_wakeups(waiters):
+    storage, account_ids = make_storage(waiters)
+    woken = {}
+    executor = ThreadPoolExecutor(4)
+
+    async def wait(account_id):
+        watch = AsyncMessageWatch(storage, account_id, MATCH, executor, deadline=time.monotonic() + 60)
+        try:
+            async for message in watch:
+                woken[account_id] = time.perf_counter()
+                break
+        finally:
+            await watch.aclose()
+
+    async def run():
+        tasks = [asyncio.create_task(wait(account_id)) for account_id in account_ids]
+        await asyncio.sleep(0.1)
+        # Mail arrives from another thread, as from SMTP workers
+        sent, start = await asyncio.get_running_loop().run_in_executor(None, deliver_all, storage, account_ids)
+        await asyncio.gather(*tasks)
+        return sent, start
+
+    sent, start = asyncio.run(run())
+    executor.shutdown()
+    report_wakeups("coroutines", waiters, account_ids, sent, woken, start)
+
+
+def measure_ingest(name, waiters, messages, mode):
+    storage, account_ids = make_storage(waiters + 1)
+    target = account_ids[-1]
+    stop = threading.Event()
+
+    def wait(account_id):
+        with MessageWatch(storage, account_id, MATCH, idle_timeout=0.5) as watch:
+            for _ in watch:
+                if stop.is_set():
+                    return
+
+    def poll(account_id):
+        while not stop.is_set():
+            storage.get_email_messages(account_id)
+
+    threads = []
+    if mode != "none":
+        target_func = wait if mode == "wait" else poll
+        threads = [threading.Thread(target=target_func, args=(a,)) for a in account_ids[:waiters]]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.5)
+
+    start = time.perf_counter()
+    for i in range(messages):
+        deliver(storage, target, i)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join()
+    print(f"{name:<24} {messages / elapsed:10,.0f} messages/s")
+
+
+def main():
+    waiters = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+
+    print("Wake-up latency")
+    measure_wakeups(waiters)
+    measure_async_wakeups(waiters)
+
+    print("\nIngest while other accounts wait")
+    measure_ingest("no waiters", waiters, messages, "none")
+    measure_ingest(f"{waiters} blocked waiters", waiters, messages, "wait")
+    measure_ingest(f"{waiters} polling threads", waiters, messages, "poll")
+
+
+if __name__ == "__main__":
+    main()
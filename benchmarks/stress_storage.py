@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+"""
+Multithreaded stress test for the in-memory Storage.
+
+Many threads create accounts, deliver messages, read, mark as read and
+delete concurrently, the way the SMTP thread and Flask request threads do,
+while a retention sweeper evicts mail beyond per-account limits.
+Afterwards every index is checked against the stored messages: ids must be
+unique, each mailbox sorted and complete, unread counters, mailbox sizes
+and interned body reference counts exact, the magic link index must list
+exactly the messages with links, and the search index must hold exactly the
+terms of the remaining messages. With --compress, bodies are stored
+compressed and the compressed byte count must match the stored bodies.
+
+Exits with status 1 if any invariant is violated.
+
+Usage: python benchmarks/stress_storage.py [threads] [operations per thread] [--compress]
+"""
+
+import os
+import random
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from python_email_server.retention import RetentionPolicy, RetentionSweeper
+from python_email_server.search import WEIGHT_BITS
+from python_email_server.storage import Storage
+
+
+def worker(storage, worker_id, operations, account_ids, created, errors, barrier):
+    rng = random.Random(worker_id)
+    barrier.wait()
+    try:
+        for i in range(operations):
+            op = rng.random()
+            if op < 0.02:
+                # Every thread races to create the same few addresses
+                try:
+                    account = storage.create_email_account({
+                        "username": f"user{i % 50}",
+                        "domain": "stress.test",
+                        "email": f"user{i % 50}@stress.test",
+                        "password": "password123"
+                    })
+                    account_ids.append(account.id)
+                except ValueError:
+                    pass
+            elif op < 0.6:
+                # Every tenth delivery is a batch spread over several accounts
+                batch = [
+                    {
+                        "account_id": rng.choice(account_ids),
+                        "sender": "Stress",
+                        "sender_email": "stress@stress.test",
+                        "recipient": "user@stress.test",
+                        "subject": f"{worker_id}-{i}-{j}",
+                        "content": f"Hello {i % 7}" if i % 4 else f"Sign in: https://stress.test/login?token={i % 7}",
+                        # A few distinct bodies, shared between many messages
+                        "html_content": f"<p>Hello {i % 5}</p>" if i % 3 else None
+                    }
+                    for j in range(5 if op < 0.1 else 1)
+                ]
+                if len(batch) == 1:
+                    created.append(storage.create_email_message(batch[0]).id)
+                else:
+                    created.extend(message.id for message in storage.create_email_message_batch(batch))
+            elif op < 0.75 and created:
+                try:
+                    storage.mark_email_as_read(rng.choice(created))
+                except ValueError:
+                    pass  # Deleted by another thread
+            elif op < 0.85 and created:
+                storage.delete_email_message(rng.choice(created))
+            elif op < 0.95:
+                account_id = rng.choice(account_ids)
+                storage.get_email_message_page(account_id, 20)
+                storage.get_unread_count(account_id)
+                storage.get_latest_magic_link_message(account_id)
+            else:
+                storage.get_email_messages(rng.choice(account_ids))
+                storage.get_email_accounts()
+    except Exception as e:
+        errors.append(f"worker {worker_id}: {e!r}")
+
+
+def check(storage, created, errors):
+    if len(created) != len(set(created)):
+        errors.append(f"duplicate message ids: {len(created) - len(set(created))}")
+
+    emails = [account.email for account in storage.get_email_accounts()]
+    if len(emails) != len(set(emails)):
+        errors.append("duplicate account email addresses")
+
+    seen = set()
+    for account_id, mailbox in storage.mailboxes.items():
+        ids = mailbox.message_ids
+        if ids != sorted(ids):
+            errors.append(f"mailbox {account_id} not sorted")
+        seen.update(ids)
+        for message_id in ids:
+            message = storage.email_messages.get(message_id)
+            if message is None or message.account_id != account_id:
+                errors.append(f"mailbox {account_id} has stale message {message_id}")
+        unread = sum(1 for message_id in ids if not storage.email_messages[message_id].read)
+        if unread != mailbox.unread:
+            errors.append(f"mailbox {account_id} unread {mailbox.unread}, expected {unread}")
+        size = sum(storage.email_messages[message_id].size for message_id in ids)
+        if size != mailbox.size:
+            errors.append(f"mailbox {account_id} size {mailbox.size}, expected {size}")
+        link_ids = [message_id for message_id in ids if storage.email_messages[message_id].magic_links]
+        if link_ids != mailbox.link_ids:
+            errors.append(f"mailbox {account_id} link index {mailbox.link_ids}, expected {link_ids}")
+
+    if seen != set(storage.email_messages):
+        errors.append("mailboxes and message table disagree")
+
+    # Every body of every remaining message holds exactly one reference
+    references = {}
+    for message in storage.email_messages.values():
+        if storage.bodies_by_digest:
+            bodies = storage.body_refs[message.id][1:]
+        else:
+            bodies = (message.content, message.html_content)
+        for body in bodies:
+            if body is not None:
+                references[body] = references.get(body, 0) + 1
+    interned = {body: entry.users for body, entry in storage.bodies.items()}
+    if references != interned:
+        errors.append(f"interned body references {interned}, expected {references}")
+    if storage.compress_bodies:
+        compressed = sum(len(entry.value.data) for entry in storage.bodies.values())
+        if compressed != storage.compressed_bytes:
+            errors.append(f"compressed bytes {storage.compressed_bytes}, expected {compressed}")
+
+    expected_postings = set()
+    for message in storage.email_messages.values():
+        for term in storage._indexed_terms(message):
+            expected_postings.add((message.account_id, term, message.id))
+    postings = {
+        (account_id, term, entry >> WEIGHT_BITS)
+        for account_id, postings_by_term in storage.search_index.accounts.items()
+        for term, entries in postings_by_term.items()
+        for entry in entries
+    }
+    if postings != expected_postings:
+        errors.append(f"search index has {len(postings - expected_postings)} stale and "
+                      f"{len(expected_postings - postings)} missing postings")
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != "--compress"]
+    threads = int(args[0]) if len(args) > 0 else 16
+    operations = int(args[1]) if len(args) > 1 else 20_000
+
+    # Switch threads often to shake out races on GIL builds
+    sys.setswitchinterval(1e-6)
+
+    storage = Storage(compress_bodies="--compress" in sys.argv, body_cache_size=64 * 1024)
+    account_ids = [account.id for account in storage.get_email_accounts()]
+    created, errors = [], []
+    barrier = threading.Barrier(threads)
+    pool = [
+        threading.Thread(target=worker, args=(storage, n, operations, account_ids, created, errors, barrier))
+        for n in range(threads)
+    ]
+    sweeper = RetentionSweeper(storage, RetentionPolicy(account_max_messages=200), interval=0.01, batch_size=50)
+    sweeper.start()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    sweeper.stop()
+
+    check(storage, created, errors)
+    print(f"{threads} threads x {operations} operations: "
+          f"{len(created)} messages created, {len(storage.email_messages)} remaining, "
+          f"{len(storage.email_accounts)} accounts, {sweeper.stats()['evicted_total']} evicted")
+    if errors:
+        for error in errors[:20]:
+            print(f"FAIL: {error}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
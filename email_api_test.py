@@ -4,7 +4,16 @@
 Test script for our Python email server
 """
 
-from python_email_server.storage import storage
+import os
+import tempfile
+import threading
+
+from python_email_server import sqlite_storage
+from python_email_server.main import create_app
+from python_email_server.raw_store import RawMessageStore
+from python_email_server.smtp_server import SMTPHandler
+from python_email_server.sqlite_storage import SQLiteStorage
+from python_email_server.storage import Storage, storage
 from python_email_server.models import EmailAccount, EmailMessage
 
 def test_storage():
@@ -21,5 +30,104 @@ def test_storage():
     
     print("\nTest completed successfully!")
 
+def test_bad_cursor():
+    """A cursor that is not an integer is rejected rather than ignored."""
+    backend = Storage()
+    account_id = backend.get_email_account_by_email("dev@openmail.org").id
+    client = create_app(backend).test_client()
+    
+    for path in (
+        f"/api/accounts/{account_id}/emails/summary?before_id=abc",
+        f"/api/accounts/{account_id}/emails/summary?after_id=",
+        f"/api/accounts/{account_id}/emails/wait?timeout=0&after_id=abc",
+        f"/api/accounts/{account_id}/emails/stream?timeout=abc"
+    ):
+        response = client.get(path)
+        assert response.status_code == 400, path
+    assert client.get(f"/api/accounts/{account_id}/emails/summary?before_id=1").status_code == 200
+
+def test_lazy_search():
+    """Mail whose parsing was deferred (SMTP_PARSE_MODE=lazy) is found by body search."""
+    raw = (b"From: Example Shop <orders@shop.test>\r\nTo: dev@openmail.org\r\n"
+           b"Subject: Your order\r\n\r\nYour parcel is on its way.\r\n")
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in (Storage(), SQLiteStorage(os.path.join(directory, "test.db"))):
+            account_id = backend.get_email_account_by_email("dev@openmail.org").id
+            SMTPHandler(backend, defer_parsing=True)._deliver([(account_id, "dev@openmail.org")], raw)
+            client = create_app(backend).test_client()
+            
+            response = client.get(f"/api/accounts/{account_id}/emails/search?q=parcel")
+            assert response.status_code == 200
+            assert response.get_json()["total"] == 1, type(backend).__name__
+            backend.close()
+
+def test_lookup_during_parse():
+    """Queries are not held up while a deferred message is being parsed."""
+    raw = b"From: orders@shop.test\r\nTo: dev@openmail.org\r\nSubject: Your order\r\n\r\nHello\r\n"
+    parse_email = sqlite_storage.parse_email
+    parsing, release = threading.Event(), threading.Event()
+    
+    def slow_parse(*args):
+        parsing.set()
+        release.wait(10)
+        return parse_email(*args)
+    
+    with tempfile.TemporaryDirectory() as directory:
+        backend = SQLiteStorage(os.path.join(directory, "test.db"))
+        account_id = backend.get_email_account_by_email("dev@openmail.org").id
+        SMTPHandler(backend, defer_parsing=True)._deliver([(account_id, "dev@openmail.org")], raw)
+        sqlite_storage.parse_email = slow_parse
+        try:
+            reader = threading.Thread(target=backend.search_email_messages, args=(account_id, "hello", 10))
+            reader.start()
+            assert parsing.wait(10)
+            
+            lookup = threading.Thread(target=backend.get_email_account_by_email, args=("dev@openmail.org",))
+            lookup.start()
+            lookup.join(2)
+            assert not lookup.is_alive(), "lookup waited for the parse"
+        finally:
+            release.set()
+            sqlite_storage.parse_email = parse_email
+        reader.join()
+        backend.close()
+
+def test_freed_body():
+    """A raw store body freed between its lookup and its read is not an error."""
+    raw = b"From: orders@shop.test\r\nTo: dev@openmail.org\r\nSubject: Your order\r\n\r\nHello\r\n"
+    with tempfile.TemporaryDirectory() as directory:
+        backend = Storage(raw_store=RawMessageStore(directory))
+        account_id = backend.get_email_account_by_email("dev@openmail.org").id
+        SMTPHandler(backend)._deliver([(account_id, "dev@openmail.org")], raw)
+        message_id = backend.get_email_messages(account_id)[0].id
+        
+        # Free each record just before it is read, as a racing DELETE would
+        read = backend.raw_store.read
+        def read_freed(record_id):
+            backend.raw_store.delete(record_id)
+            return read(record_id)
+        backend.raw_store.read = read_freed
+        
+        message = backend.get_email_message(message_id)
+        assert message is not None and message.id == message_id
+        backend.close()
+
+def test_weak_etag():
+    """A polling client's ETag gets a 304 even if a proxy weakened it."""
+    backend = Storage()
+    account_id = backend.get_email_account_by_email("dev@openmail.org").id
+    client = create_app(backend).test_client()
+    path = f"/api/accounts/{account_id}/emails"
+    
+    etag = client.get(path).headers["ETag"]
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(path, headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+    assert client.get(path, headers={"If-None-Match": 'W/"0"'}).status_code == 200
+
 if __name__ == "__main__":
-    test_storage()
\ No newline at end of file
+    test_storage()
+    test_bad_cursor()
+    test_lazy_search()
+    test_lookup_during_parse()
+    test_freed_body()
+    test_weak_etag()
\ No newline at end of file
@@ -0,0 +1,63 @@
+import hashlib
+import os
+import re
+import tempfile
+from typing import Iterable, Tuple
+
+DIGEST_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+class BlobStore:
+    """Content-addressed files on disk, named by the SHA-256 of their bytes.
+
+    Writing the same content twice stores it once. A blob is hashed while it
+    is written to a temporary file and then renamed into place, so it is
+    either complete or absent; this also lets parser processes write to the
+    same directory concurrently. The store only holds its directory path and
+    can be pickled into worker processes.
+
+    Blobs are kept across restarts, so a SQLite database's attachments stay
+    downloadable.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        """Get the file path of a blob. Raises ValueError for a malformed digest."""
+        if not DIGEST_PATTERN.fullmatch(digest):
+            raise ValueError(f"Invalid blob digest: {digest!r}")
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def write(self, chunks: Iterable[bytes]) -> Tuple[str, int]:
+        """Store a blob from an iterable of byte chunks.
+
+        Returns its hex SHA-256 digest and size.
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".incoming-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+
+            digest = hasher.hexdigest()
+            path = self.path(digest)
+            if os.path.exists(path):
+                # Already stored
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return digest, size
@@ -1,9 +1,28 @@
 import re
 import email
+import logging
+import binascii
+import hashlib
+from html import unescape
 from email.message import EmailMessage as StandardEmailMessage
+from email.parser import BytesFeedParser, BytesHeaderParser
 from email.policy import default
 from typing import Dict, List, Any, Optional, Tuple
 
+logger = logging.getLogger(__name__)
+
+# URLs containing any of these are treated as magic links. Stored messages
+# keep the links extracted at ingest, so after changing this list run
+# `python -m python_email_server.reprocess_links` (SQLite) or
+# POST /api/admin/reprocess-magic-links (running server).
+MAGIC_LINK_KEYWORDS = (
+    'token=', 'verify', 'confirm', 'reset',
+    'auth', 'magic', 'login'
+)
+
+# Raw messages are fed to the parser in chunks of this many bytes
+FEED_CHUNK_SIZE = 64 * 1024
+
 class ParsedEmail:
     """Simple class to hold parsed email data."""
     
@@ -18,14 +37,22 @@ class ParsedEmail:
         self.attachments: List[Dict[str, Any]] = []
 
 
-def parse_email(email_data) -> ParsedEmail:
-    """Parse an email message and extract key information."""
+def parse_email(email_data, blob_store=None) -> ParsedEmail:
+    """Parse an email message and extract key information.
+    
+    Prefer passing the raw bytes: they go straight to the feed parser and
+    each text part is decoded once, with its declared charset.
+    
+    Attachments are described in `attachments` (filename, content type, size
+    and SHA-256) rather than decoded into the body. With a `blob_store`, their
+    content is decoded chunk by chunk into it.
+    """
     parsed = ParsedEmail()
     
     try:
         # Parse the email message depending on the type of input
         if isinstance(email_data, bytes):
-            msg = email.message_from_bytes(email_data, policy=default)
+            msg = _feed_bytes(email_data)
         else:
             msg = email.message_from_string(str(email_data), policy=default)
         
@@ -45,7 +72,7 @@ def parse_email(email_data) -> ParsedEmail:
                 parsed.to.append(email_addr)
         
         # Extract body content
-        _extract_content(msg, parsed)
+        _extract_content(msg, parsed, blob_store)
         
     except Exception as e:
         print(f"Error parsing email: {e}")
@@ -53,6 +80,68 @@ def parse_email(email_data) -> ParsedEmail:
     return parsed
 
 
+def _feed_bytes(email_data: bytes):
+    """Parse raw message bytes incrementally with the feed parser."""
+    parser = BytesFeedParser(policy=default)
+    for start in range(0, len(email_data), FEED_CHUNK_SIZE):
+        parser.feed(email_data[start:start + FEED_CHUNK_SIZE])
+    return parser.close()
+
+
+def parse_email_headers(email_data: bytes) -> ParsedEmail:
+    """Cheaply parse just the From, Subject and Message-ID headers.
+    
+    Only the header block is handed to the parser; the body is never
+    decoded or walked. The remaining fields are left empty.
+    """
+    parsed = ParsedEmail()
+    
+    try:
+        # The header block ends at the first empty line
+        ends = [i for i in (email_data.find(b'\r\n\r\n'), email_data.find(b'\n\n')) if i >= 0]
+        header_block = email_data[:min(ends)] if ends else email_data
+        msg = BytesHeaderParser(policy=default).parsebytes(header_block)
+        
+        parsed.subject = msg.get('Subject', '')
+        parsed.from_name, parsed.from_address = _parse_address(msg.get('From', ''))
+        message_id = msg.get('Message-ID')
+        if message_id:
+            parsed.headers = {'Message-ID': message_id}
+    except Exception as e:
+        logger.warning(f"Error parsing email headers: {e}")
+        
+    return parsed
+
+
+def message_fields(parsed: ParsedEmail) -> Dict[str, Any]:
+    """Map a parsed email onto the EmailMessage fields it provides."""
+    return {
+        "sender": parsed.from_name or parsed.from_address,
+        "sender_email": parsed.from_address,
+        "subject": parsed.subject or "(No Subject)",
+        "content": parsed.text or "",
+        "html_content": parsed.html,
+        "headers": parsed.headers,
+        "attachments": parsed.attachments
+    }
+
+
+def parse_message_fields(email_data: bytes, headers_only: bool = False, blob_store=None) -> Dict[str, Any]:
+    """Parse raw message bytes into EmailMessage fields.
+    
+    Header values are converted to plain strings so the result can be
+    pickled back from a worker process.
+    """
+    if headers_only:
+        parsed = parse_email_headers(email_data)
+    else:
+        parsed = parse_email(email_data, blob_store)
+    
+    fields = message_fields(parsed)
+    fields["headers"] = {name: str(value) for name, value in fields["headers"].items()}
+    return fields
+
+
 def _parse_address(address: str) -> Tuple[str, str]:
     """Parse an email address into name and actual address."""
     name = ""
@@ -69,28 +158,107 @@ def _parse_address(address: str) -> Tuple[str, str]:
     return name, email_addr
 
 
-def _extract_content(msg, parsed: ParsedEmail) -> None:
-    """Extract text and HTML content from the email."""
-    # Check if the message is multipart
-    if msg.is_multipart():
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            if content_type == 'text/plain':
-                parsed.text = part.get_payload(decode=True).decode('utf-8', errors='replace')
-            elif content_type == 'text/html':
-                parsed.html = part.get_payload(decode=True).decode('utf-8', errors='replace')
-    else:
-        # Not multipart, just get the content
-        content_type = msg.get_content_type()
-        payload = msg.get_payload(decode=True)
-        if payload is not None:
-            content = payload.decode('utf-8', errors='replace')
-            if content_type == 'text/plain':
-                parsed.text = content
-            elif content_type == 'text/html':
-                parsed.html = content
-            else:
-                parsed.text = content
+def _decode_payload(part) -> Optional[str]:
+    """Undo a part's transfer encoding and decode it with its charset."""
+    payload = part.get_payload(decode=True)
+    if payload is None:
+        return None
+    charset = part.get_content_charset() or 'utf-8'
+    try:
+        return payload.decode(charset, errors='replace')
+    except LookupError:
+        # Unknown charset name
+        return payload.decode('utf-8', errors='replace')
+
+
+def _is_attachment(part) -> bool:
+    """Check whether a leaf part is an attachment rather than a message body."""
+    return part.get_content_disposition() == 'attachment' or part.get_content_maintype() != 'text'
+
+
+def _iter_payload(part):
+    """Yield a part's payload with its transfer encoding undone, in chunks."""
+    if part.get('Content-Transfer-Encoding', '').strip().lower() != 'base64':
+        payload = part.get_payload(decode=True)
+        if payload:
+            yield payload
+        return
+    
+    # Decode base64 a chunk at a time instead of materializing the whole file
+    encoded = part.get_payload()
+    carry = ''
+    for start in range(0, len(encoded), FEED_CHUNK_SIZE):
+        carry += ''.join(encoded[start:start + FEED_CHUNK_SIZE].split())
+        usable = len(carry) - len(carry) % 4
+        if usable:
+            yield binascii.a2b_base64(carry[:usable])
+            carry = carry[usable:]
+    if carry:
+        yield binascii.a2b_base64(carry + '=' * (-len(carry) % 4))
+
+
+def _save_attachment(part, blob_store=None) -> Dict[str, Any]:
+    """Describe an attachment part, writing its content to the blob store if given."""
+    write = blob_store.write if blob_store is not None else _hash_chunks
+    try:
+        digest, size = write(_iter_payload(part))
+    except binascii.Error:
+        # Malformed base64: fall back to the parser's lenient decoding
+        digest, size = write([part.get_payload(decode=True) or b''])
+    
+    return {
+        "filename": part.get_filename(),
+        "content_type": part.get_content_type(),
+        "size": size,
+        "sha256": digest
+    }
+
+
+def _hash_chunks(chunks) -> Tuple[str, int]:
+    """Get the SHA-256 digest and size of an attachment that is not stored."""
+    hasher = hashlib.sha256()
+    size = 0
+    for chunk in chunks:
+        hasher.update(chunk)
+        size += len(chunk)
+    return hasher.hexdigest(), size
+
+
+def _extract_content(msg, parsed: ParsedEmail, blob_store=None) -> None:
+    """Extract text and HTML content and attachments from the email."""
+    for part in msg.walk():
+        if part.is_multipart():
+            continue
+        if _is_attachment(part):
+            parsed.attachments.append(_save_attachment(part, blob_store))
+            continue
+        content_type = part.get_content_type()
+        if content_type == 'text/html':
+            parsed.html = _decode_payload(part)
+        elif content_type == 'text/plain' or not msg.is_multipart():
+            parsed.text = _decode_payload(part) or ''
+
+
+def html_to_text(html: str) -> str:
+    """Strip tags, scripts and styles from HTML and unescape entities."""
+    return unescape(re.sub(r'<(script|style)\b.*?</\1>|<[^>]+>', ' ', html, flags=re.S | re.I))
+
+
+def make_snippet(text: str, html: Optional[str] = None, length: int = 100) -> str:
+    """Build a short single-line preview of the email body."""
+    # Only the start of the body can end up in the snippet
+    body = text[:length * 20]
+    if not body.strip() and html:
+        body = html_to_text(html)
+    body = ' '.join(body.split())
+    if len(body) > length:
+        body = body[:length - 3].rstrip() + '...'
+    return body
+
+
+def extract_message_magic_links(text: str, html: Optional[str] = None) -> List[str]:
+    """Extract magic links from a message, preferring its HTML body."""
+    return extract_magic_links(html or text or "")
 
 
 def extract_magic_links(content: str) -> List[str]:
@@ -105,10 +273,7 @@ def extract_magic_links(content: str) -> List[str]:
     magic_links = []
     for url in urls:
         lower_url = url.lower()
-        if any(keyword in lower_url for keyword in [
-            'token=', 'verify', 'confirm', 'reset', 
-            'auth', 'magic', 'login'
-        ]):
+        if any(keyword in lower_url for keyword in MAGIC_LINK_KEYWORDS):
             magic_links.append(url)
             
     return magic_links
\ No newline at end of file
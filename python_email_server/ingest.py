@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .email_parser import parse_message_fields
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """Running count, total and maximum duration of one pipeline stage."""
+
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "avg_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "max_ms": self.max * 1000
+        }
+
+
+class IngestionPipeline:
+    """Bounded queue between the SMTP handler and parse/store workers.
+
+    `submit` is called from `handle_DATA` on the SMTP event loop and never
+    blocks: when the queue is full it returns False so the session can be
+    answered with a temporary failure. Worker tasks on the same loop take
+    messages off the queue, parse them in `parse_executor` (a process pool by
+    default) and store them through a single storage thread, so neither step
+    runs on the event loop.
+    """
+
+    def __init__(
+        self,
+        storage,
+        workers: int = 4,
+        queue_size: int = 1000,
+        parse_processes: Optional[int] = None,
+        defer_parsing: bool = False
+    ):
+        self.storage = storage
+        self.workers = workers
+        self.queue_size = queue_size
+        self.defer_parsing = defer_parsing
+
+        if parse_processes == 0:
+            self.parse_executor: Executor = ThreadPoolExecutor(workers, thread_name_prefix="ingest-parse")
+        else:
+            # Spawn rather than fork: the SMTP and API threads are already running
+            self.parse_executor = ProcessPoolExecutor(
+                parse_processes, mp_context=multiprocessing.get_context("spawn")
+            )
+        self.store_executor = ThreadPoolExecutor(1, thread_name_prefix="ingest-store")
+
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks = []
+        self.accepted = 0
+        self.rejected = 0
+        self.stored = 0
+        self.failed = 0
+        self.timers = {
+            "queue_wait": StageTimer(),
+            "parse": StageTimer(),
+            "store": StageTimer(),
+            "total": StageTimer()
+        }
+
+    def _start(self) -> None:
+        """Create the queue and workers on the running (SMTP) event loop."""
+        self.queue = asyncio.Queue(self.queue_size)
+        self.tasks = [
+            asyncio.get_running_loop().create_task(self._worker())
+            for _ in range(self.workers)
+        ]
+        logger.info(f"Ingestion pipeline started with {self.workers} workers")
+
+    def submit(self, recipients: List[Tuple[int, str]], raw: bytes) -> bool:
+        """Queue a message for parsing and delivery to (account id, address) recipients.
+
+        Returns False if the queue is full.
+        """
+        if self.queue is None:
+            self._start()
+        try:
+            self.queue.put_nowait((recipients, raw, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            recipients, raw, enqueued_at = await self.queue.get()
+            try:
+                started = time.perf_counter()
+                self.timers["queue_wait"].record(started - enqueued_at)
+
+                fields = await loop.run_in_executor(
+                    self.parse_executor, parse_message_fields, raw, self.defer_parsing,
+                    self.storage.blob_store
+                )
+                parsed = time.perf_counter()
+                self.timers["parse"].record(parsed - started)
+
+                message_data: Dict[str, Any] = {
+                    **fields,
+                    "raw": raw,
+                    "deferred_parse": self.defer_parsing
+                }
+                messages = await loop.run_in_executor(
+                    self.store_executor, self.storage.create_email_messages, message_data, recipients
+                )
+                stored = time.perf_counter()
+                self.timers["store"].record(stored - parsed)
+                self.timers["total"].record(stored - enqueued_at)
+                self.stored += 1
+                logger.info(f"Email stored with IDs: {[message.id for message in messages]}")
+            except Exception as e:
+                self.failed += 1
+                recipient_list = ', '.join(recipient for _, recipient in recipients)
+                logger.error(f"Error ingesting email for {recipient_list}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get queue depth, message counters and per-stage timings."""
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "queue_size": self.queue_size,
+            "workers": self.workers,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "stored": self.stored,
+            "failed": self.failed,
+            "stages": {name: timer.as_dict() for name, timer in self.timers.items()}
+        }
+
+    def stop(self) -> None:
+        """Stop the workers and shut down the executors."""
+        for task in self.tasks:
+            task.get_loop().call_soon_threadsafe(task.cancel)
+        self.parse_executor.shutdown(wait=False, cancel_futures=True)
+        self.store_executor.shutdown(wait=False, cancel_futures=True)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Sequence
 from pydantic import BaseModel, Field, validator
 
 class EmailAccount(BaseModel):
@@ -13,11 +13,10 @@ class EmailAccount(BaseModel):
     class Config:
         from_attributes = True
 
-class CreateAccountRequest(BaseModel):
+class ProvisionAccountRequest(BaseModel):
     username: str
     domain: str
     password: str
-    confirm_password: str
     
     @validator('username')
     def username_must_be_valid(cls, v):
@@ -28,6 +27,9 @@ class CreateAccountRequest(BaseModel):
         if not v.replace('.', '').replace('-', '').replace('_', '').isalnum():
             raise ValueError('Username can only contain letters, numbers, dots, hyphens, and underscores')
         return v
+
+class CreateAccountRequest(ProvisionAccountRequest):
+    confirm_password: str
     
     @validator('confirm_password')
     def passwords_match(cls, v, values):
@@ -35,6 +37,12 @@ class CreateAccountRequest(BaseModel):
             raise ValueError('Passwords do not match')
         return v
 
+class Attachment(BaseModel):
+    filename: Optional[str] = None
+    content_type: str
+    size: int
+    sha256: str
+
 class EmailMessage(BaseModel):
     id: int
     account_id: int
@@ -44,6 +52,9 @@ class EmailMessage(BaseModel):
     subject: str
     content: str
     html_content: Optional[str] = None
+    snippet: str = ""
+    magic_links: List[str] = []
+    attachments: List[Attachment] = []
     received_at: datetime = Field(default_factory=datetime.now)
     read: bool = False
     headers: Dict[str, Any] = {}
@@ -51,12 +62,86 @@ class EmailMessage(BaseModel):
     class Config:
         from_attributes = True
 
-class EmailMessageWithMagicLinks(EmailMessage):
-    magic_links: List[str] = []
+class MessageRecord:
+    """Compact internal form of an email message.
+    
+    Storage backends keep and return these instead of `EmailMessage` models;
+    `api.py` builds the models from them (through `from_attributes`) when it
+    serializes a response. Nothing is validated here: the fields come from
+    the parser or from an already validated request.
+    """
+    
+    __slots__ = (
+        "id", "account_id", "sender", "sender_email", "recipient", "subject",
+        "content", "html_content", "snippet", "magic_links", "attachments",
+        "received_at", "read", "headers", "size"
+    )
+    
+    def __init__(
+        self,
+        id: int,
+        account_id: int,
+        sender: str,
+        sender_email: str,
+        recipient: str,
+        subject: str,
+        content: str,
+        html_content: Optional[str] = None,
+        snippet: str = "",
+        magic_links: Sequence[str] = (),
+        attachments: Sequence[Dict[str, Any]] = (),
+        received_at: Optional[datetime] = None,
+        read: bool = False,
+        headers: Optional[Dict[str, Any]] = None,
+        size: int = 0
+    ):
+        self.id = id
+        self.account_id = account_id
+        self.sender = sender
+        self.sender_email = sender_email
+        self.recipient = recipient
+        self.subject = subject
+        self.content = content
+        self.html_content = html_content
+        self.snippet = snippet
+        self.magic_links = magic_links
+        self.attachments = attachments
+        self.received_at = received_at
+        self.read = read
+        self.headers = headers if headers is not None else {}
+        # Size counted against retention limits
+        self.size = size
+    
+    def copy(self, **changes: Any) -> "MessageRecord":
+        """Get a shallow copy with some fields replaced."""
+        record = MessageRecord.__new__(MessageRecord)
+        for name in MessageRecord.__slots__:
+            setattr(record, name, changes.get(name, getattr(self, name)))
+        return record
+
+class EmailMessageSummary(BaseModel):
+    id: int
+    sender: str
+    subject: str
+    snippet: str = ""
+    received_at: datetime
+    read: bool = False
+    
+    class Config:
+        from_attributes = True
 
 class EmailAccountWithUnread(EmailAccount):
     unread_count: int = 0
 
+class EmailAccountResponse(BaseModel):
+    """An account as the API returns it: without the password, with its unread count."""
+    id: int
+    username: str
+    domain: str
+    email: str
+    created_at: datetime
+    unread_count: int = 0
+
 class CreateEmailRequest(BaseModel):
     account_id: int
     sender: str
@@ -0,0 +1,300 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Executor
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .models import MessageRecord
+
+# Messages read per query while catching up on mail that arrived before a watch
+CATCH_UP_PAGE_SIZE = 100
+
+
+class Subscription:
+    """Ids of new messages for one account, queued for one waiter."""
+
+    __slots__ = ("account_id", "queue")
+
+    def __init__(self, account_id: int):
+        self.account_id = account_id
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    def deliver(self, message_id: int) -> None:
+        self.queue.put(message_id)
+
+    def get(self, timeout: Optional[float] = None) -> Optional[int]:
+        """Wait for the next message id, or None after `timeout` seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription(Subscription):
+    """A subscription waited on by a coroutine on `loop`, delivered to from any thread."""
+
+    __slots__ = ("loop",)
+
+    def __init__(self, account_id: int, loop: asyncio.AbstractEventLoop):
+        self.account_id = account_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def deliver(self, message_id: int) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, message_id)
+        except RuntimeError:
+            # The loop is closed, and with it the waiter
+            pass
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[int]:
+        """Wait for the next message id, or None after `timeout` seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class MessageNotifier:
+    """Wakes the waiters of an account when mail is delivered to it.
+
+    Storage backends call notify() after storing messages. Only the
+    subscriptions of the recipient accounts are touched, so a delivery costs
+    the same however many waiters other accounts have, and a waiter blocks on
+    its own queue instead of polling storage.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions: Dict[int, Set[Subscription]] = {}
+
+    def subscribe(self, account_id: int, loop: Optional[asyncio.AbstractEventLoop] = None) -> Subscription:
+        """Subscribe to an account's mail; with `loop`, for a coroutine on that loop."""
+        subscription = Subscription(account_id) if loop is None else AsyncSubscription(account_id, loop)
+        with self.lock:
+            self.subscriptions.setdefault(account_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.account_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.account_id]
+
+    def notify(self, messages: Iterable[MessageRecord]) -> None:
+        self.notify_ids((message.account_id, message.id) for message in messages)
+
+    def notify_ids(self, deliveries: Iterable[Tuple[int, int]]) -> None:
+        """Wake the waiters of each (account id, message id) delivery."""
+        if not self.subscriptions:
+            # Nobody is waiting; skip the lock on the ingest path
+            return
+        with self.lock:
+            targets = [
+                (subscription, message_id)
+                for account_id, message_id in deliveries
+                for subscription in self.subscriptions.get(account_id, ())
+            ]
+        for subscription, message_id in targets:
+            subscription.deliver(message_id)
+
+    def waiter_count(self) -> int:
+        with self.lock:
+            return sum(len(subscriptions) for subscriptions in self.subscriptions.values())
+
+
+class MessageFilter:
+    """Matches messages by sender, subject and the magic links they carry.
+
+    Sender and subject match case-insensitive substrings; `link_keyword`
+    requires a magic link containing it. An empty filter matches every
+    message.
+    """
+
+    __slots__ = ("sender", "subject", "magic_link", "link_keyword")
+
+    def __init__(
+        self,
+        sender: Optional[str] = None,
+        subject: Optional[str] = None,
+        magic_link: bool = False,
+        link_keyword: Optional[str] = None
+    ):
+        self.sender = sender.lower() if sender else None
+        self.subject = subject.lower() if subject else None
+        self.magic_link = magic_link or bool(link_keyword)
+        self.link_keyword = link_keyword or None
+
+    def links(self, message: MessageRecord) -> List[str]:
+        """Get the message's magic links that contain the link keyword, if any."""
+        if self.link_keyword is None:
+            return list(message.magic_links)
+        return [link for link in message.magic_links if self.link_keyword in link]
+
+    def __call__(self, message: MessageRecord) -> bool:
+        if self.sender is not None and self.sender not in message.sender_email.lower():
+            return False
+        if self.subject is not None and self.subject not in message.subject.lower():
+            return False
+        if self.magic_link and not self.links(message):
+            return False
+        return True
+
+
+class MessageWatch:
+    """An account's messages that match a filter, oldest first, as they arrive.
+
+    The subscription is made on construction, before any stored message is
+    read, so nothing delivered in between is missed. With `after_id`,
+    messages already stored after it come first. Iterating yields None after
+    `idle_timeout` seconds without a match, so callers can send keepalives,
+    and stops at `deadline` (a time.monotonic() value). Close the watch to
+    unsubscribe.
+    """
+
+    def __init__(
+        self,
+        storage,
+        account_id: int,
+        match: MessageFilter,
+        after_id: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        deadline: Optional[float] = None
+    ):
+        self.storage = storage
+        self.account_id = account_id
+        self.match = match
+        self.after_id = after_id
+        # The newest message seen, by catching up or delivered
+        self.last_id = after_id
+        self.idle_timeout = idle_timeout
+        self.deadline = deadline
+        self.keepalive_at: Optional[float] = None
+        self.subscription = self._subscribe()
+        self._messages = self._watch()
+
+    def _subscribe(self) -> Subscription:
+        return self.storage.notifier.subscribe(self.account_id)
+
+    def _catch_up_page(self) -> Tuple[List[MessageRecord], bool]:
+        """Read the next page of messages stored after `after_id`.
+
+        Returns those that match and whether another page may follow.
+        """
+        page = self.storage.get_email_message_page(self.account_id, CATCH_UP_PAGE_SIZE, after_id=self.last_id)
+        matches = []
+        for message in reversed(page):
+            self.last_id = message.id
+            if self.match(message):
+                matches.append(message)
+        return matches, len(page) == CATCH_UP_PAGE_SIZE
+
+    def _load(self, message_id: int) -> Optional[MessageRecord]:
+        """Get a delivered message if it is new and matches."""
+        # Ids at or before last_id were already seen while catching up
+        if self.last_id is not None and message_id <= self.last_id:
+            return None
+        # Loading the message completes a deferred parse, in this thread
+        # rather than on the ingest path
+        message = self.storage.get_email_message(message_id)
+        if message is None or not self.match(message):
+            return None
+        return message
+
+    def _reset_keepalive(self) -> None:
+        if self.idle_timeout is not None:
+            self.keepalive_at = time.monotonic() + self.idle_timeout
+
+    def _wait_time(self) -> Optional[float]:
+        """Seconds until the next keepalive or the deadline, None for neither."""
+        wake_at = min((at for at in (self.keepalive_at, self.deadline) if at is not None), default=None)
+        return None if wake_at is None else max(wake_at - time.monotonic(), 0)
+
+    def _expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def _keepalive_due(self) -> bool:
+        if self.keepalive_at is None or time.monotonic() < self.keepalive_at:
+            return False
+        self._reset_keepalive()
+        return True
+
+    def _watch(self) -> Iterator[Optional[MessageRecord]]:
+        more = self.after_id is not None
+        while more:
+            matches, more = self._catch_up_page()
+            yield from matches
+
+        self._reset_keepalive()
+        while True:
+            message_id = self.subscription.get(self._wait_time())
+            message = self._load(message_id) if message_id is not None else None
+            if message is not None:
+                yield message
+                self._reset_keepalive()
+            elif self._expired():
+                return
+            elif self._keepalive_due():
+                yield None
+
+    def __iter__(self) -> Iterator[Optional[MessageRecord]]:
+        return self._messages
+
+    def close(self) -> None:
+        self._messages.close()
+        self.storage.notifier.unsubscribe(self.subscription)
+
+    def __enter__(self) -> "MessageWatch":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class AsyncMessageWatch(MessageWatch):
+    """A MessageWatch iterated by a coroutine, which waits without a thread.
+
+    Must be created on the event loop that iterates it. Storage is read on
+    `executor`, since loading a message can complete its deferred parse;
+    between messages the watch only awaits its subscription, so any number
+    of them can wait at once. Close it with aclose().
+    """
+
+    def __init__(self, storage, account_id: int, match: MessageFilter, executor: Executor, **options):
+        self.executor = executor
+        super().__init__(storage, account_id, match, **options)
+
+    def _subscribe(self) -> Subscription:
+        return self.storage.notifier.subscribe(self.account_id, asyncio.get_running_loop())
+
+    async def _watch(self) -> AsyncIterator[Optional[MessageRecord]]:
+        loop = asyncio.get_running_loop()
+        more = self.after_id is not None
+        while more:
+            matches, more = await loop.run_in_executor(self.executor, self._catch_up_page)
+            for message in matches:
+                yield message
+
+        self._reset_keepalive()
+        while True:
+            message_id = await self.subscription.get(self._wait_time())
+            message = None
+            if message_id is not None:
+                message = await loop.run_in_executor(self.executor, self._load, message_id)
+            if message is not None:
+                yield message
+                self._reset_keepalive()
+            elif self._expired():
+                return
+            elif self._keepalive_due():
+                yield None
+
+    def __aiter__(self) -> AsyncIterator[Optional[MessageRecord]]:
+        return self._messages
+
+    async def aclose(self) -> None:
+        await self._messages.aclose()
+        self.storage.notifier.unsubscribe(self.subscription)
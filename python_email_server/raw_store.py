@@ -0,0 +1,183 @@
+import logging
+import mmap
+import os
+import threading
+from typing import Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".seg"
+
+
+class _Segment:
+    """One segment file and its memory map."""
+
+    __slots__ = ("id", "path", "fd", "map", "size", "used", "live", "live_bytes", "sealed")
+
+    def __init__(self, segment_id: int, path: str, size: int):
+        self.id = segment_id
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        # Preallocate (sparsely) so the whole segment is mapped once
+        os.ftruncate(self.fd, size)
+        self.map = mmap.mmap(self.fd, size)
+        self.size = size
+        self.used = 0
+        self.live: Set[int] = set()
+        self.live_bytes = 0
+        self.sealed = False
+
+    def seal(self) -> None:
+        """Shrink the file to the bytes actually written."""
+        self.map.close()
+        os.ftruncate(self.fd, self.used)
+        self.map = mmap.mmap(self.fd, self.used, access=mmap.ACCESS_READ) if self.used else None
+        self.size = self.used
+        self.sealed = True
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.map.close()
+        os.close(self.fd)
+
+
+class RawMessageStore:
+    """Append-only segment files holding message bytes, read back through mmap.
+
+    Each appended record gets an integer id that resolves, through an
+    in-memory offset index, to a (segment, offset, length) slice. When the
+    active segment is full it is sealed and a new one is started. Deleting a
+    record leaves dead bytes behind; once a sealed segment is mostly dead its
+    live records are copied forward and the file is removed.
+
+    Segment files only live as long as the store: files left in `directory`
+    by a previous run are removed when it is opened.
+    """
+
+    def __init__(self, directory: str, segment_size: int = 64 * 1024 * 1024,
+                 compact_ratio: float = 0.5):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.compact_ratio = compact_ratio
+
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                os.remove(os.path.join(directory, name))
+
+        self.lock = threading.Lock()
+        # Record id -> (segment id, offset, length)
+        self.index: Dict[int, Tuple[int, int, int]] = {}
+        self.segments: Dict[int, _Segment] = {}
+        self.next_record_id = 1
+        self.next_segment_id = 1
+        self.active = self._new_segment(segment_size)
+
+    def _new_segment(self, size: int) -> _Segment:
+        segment_id = self.next_segment_id
+        self.next_segment_id += 1
+        path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment_id:08d}{SEGMENT_SUFFIX}")
+        segment = _Segment(segment_id, path, size)
+        self.segments[segment_id] = segment
+        return segment
+
+    def _write(self, record_id: int, data: bytes) -> None:
+        """Write a record to the active segment, rotating it if it is full."""
+        length = len(data)
+        if self.active.used + length > self.active.size:
+            self.active.seal()
+            if not self.active.live:
+                self._drop(self.active)
+            self.active = self._new_segment(max(self.segment_size, length))
+
+        segment = self.active
+        offset = segment.used
+        segment.map[offset:offset + length] = data
+        segment.used += length
+        segment.live.add(record_id)
+        segment.live_bytes += length
+        self.index[record_id] = (segment.id, offset, length)
+
+    def _drop(self, segment: _Segment) -> None:
+        segment.close()
+        os.remove(segment.path)
+        del self.segments[segment.id]
+
+    def _compact_segment(self, segment: _Segment) -> int:
+        """Copy the live records of a sealed segment forward and remove it."""
+        reclaimed = segment.size - segment.live_bytes
+        for record_id in list(segment.live):
+            _, offset, length = self.index[record_id]
+            self._write(record_id, segment.map[offset:offset + length])
+        self._drop(segment)
+        return reclaimed
+
+    def append(self, data: bytes) -> int:
+        """Append a record and return its id."""
+        with self.lock:
+            record_id = self.next_record_id
+            self.next_record_id += 1
+            self._write(record_id, data)
+            return record_id
+
+    def read(self, record_id: int) -> Optional[bytes]:
+        """Read a record, or None if it does not exist."""
+        with self.lock:
+            location = self.index.get(record_id)
+            if location is None:
+                return None
+            segment_id, offset, length = location
+            return self.segments[segment_id].map[offset:offset + length]
+
+    def delete(self, record_id: int) -> None:
+        """Delete a record, compacting its segment once it is mostly dead."""
+        with self.lock:
+            location = self.index.pop(record_id, None)
+            if location is None:
+                return
+            segment_id, _, length = location
+            segment = self.segments[segment_id]
+            segment.live.discard(record_id)
+            segment.live_bytes -= length
+
+            if not segment.sealed:
+                return
+            if not segment.live:
+                self._drop(segment)
+            elif segment.size - segment.live_bytes >= segment.size * self.compact_ratio:
+                self._compact_segment(segment)
+
+    def compact(self, min_dead_ratio: Optional[float] = None) -> int:
+        """Compact every sealed segment with at least `min_dead_ratio` dead bytes.
+
+        Returns the number of bytes reclaimed.
+        """
+        if min_dead_ratio is None:
+            min_dead_ratio = self.compact_ratio
+        reclaimed = 0
+        with self.lock:
+            for segment in list(self.segments.values()):
+                if segment.sealed and segment.size - segment.live_bytes >= segment.size * min_dead_ratio:
+                    reclaimed += self._compact_segment(segment)
+        if reclaimed:
+            logger.info(f"Raw message store compaction reclaimed {reclaimed} bytes")
+        return reclaimed
+
+    def stats(self) -> Dict[str, int]:
+        """Get segment, record and byte counts."""
+        with self.lock:
+            return {
+                "segments": len(self.segments),
+                "records": len(self.index),
+                "total_bytes": sum(segment.used for segment in self.segments.values()),
+                "live_bytes": sum(segment.live_bytes for segment in self.segments.values())
+            }
+
+    def close(self) -> None:
+        """Close every segment file."""
+        with self.lock:
+            for segment in self.segments.values():
+                segment.close()
+            self.segments.clear()
+            self.index.clear()
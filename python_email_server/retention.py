@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Why a message was evicted, in the order the limits are enforced
+EVICTION_REASONS = ("age", "account_messages", "account_bytes", "global_messages", "global_bytes")
+
+
+class RetentionPolicy:
+    """Limits on how much mail is kept. A limit of None is not enforced.
+
+    Message sizes are their raw RFC 822 size, or the length of their text
+    and HTML bodies for messages that did not arrive over SMTP.
+    """
+
+    __slots__ = ("max_messages", "max_bytes", "max_age", "account_max_messages", "account_max_bytes")
+
+    def __init__(
+        self,
+        max_messages: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None,
+        account_max_messages: Optional[int] = None,
+        account_max_bytes: Optional[int] = None
+    ):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        # Seconds since the message was received
+        self.max_age = max_age
+        self.account_max_messages = account_max_messages
+        self.account_max_bytes = account_max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return any(getattr(self, name) is not None for name in self.__slots__)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class RetentionSweeper:
+    """Background thread that evicts mail beyond a retention policy.
+
+    Every `interval` seconds it asks the storage backend to enforce the
+    policy; the backend evicts oldest messages first, `batch_size` at a
+    time, until every limit is met.
+    """
+
+    def __init__(self, storage, policy: RetentionPolicy, interval: float = 1.0, batch_size: int = 1000):
+        self.storage = storage
+        self.policy = policy
+        self.interval = interval
+        self.batch_size = batch_size
+
+        self.evicted = dict.fromkeys(EVICTION_REASONS, 0)
+        self.sweeps = 0
+        self.last_sweep_ms = 0.0
+        self.errors = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sweep(self) -> Dict[str, int]:
+        """Enforce the policy once. Returns the messages evicted by reason."""
+        started = time.perf_counter()
+        evicted = self.storage.enforce_retention(self.policy, self.batch_size)
+        self.last_sweep_ms = (time.perf_counter() - started) * 1000
+        self.sweeps += 1
+        for reason, count in evicted.items():
+            self.evicted[reason] += count
+        total = sum(evicted.values())
+        if total:
+            logger.info(f"Retention sweep evicted {total} messages in {self.last_sweep_ms:.1f} ms")
+        return evicted
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Error enforcing retention policy: {e}")
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="retention-sweeper", daemon=True)
+        self._thread.start()
+        logger.info(f"Retention sweeper started every {self.interval}s with {self.policy.as_dict()}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the policy, eviction counters and sweep timing."""
+        return {
+            "policy": self.policy.as_dict(),
+            "interval": self.interval,
+            "batch_size": self.batch_size,
+            "sweeps": self.sweeps,
+            "errors": self.errors,
+            "last_sweep_ms": self.last_sweep_ms,
+            "evicted": dict(self.evicted),
+            "evicted_total": sum(self.evicted.values())
+        }
@@ -0,0 +1,202 @@
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from .email_parser import html_to_text
+
+# Runs of letters and digits, lowercased; everything else separates tokens,
+# as in SQLite FTS5's unicode61 tokenizer
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+MAX_TOKEN_LENGTH = 64
+# The same for ASCII text: a byte table turning separators into spaces,
+# several times faster than the regex
+ASCII_TOKEN_TABLE = bytes(c if chr(c).isascii() and chr(c).isalnum() else 0x20 for c in range(256))
+
+# How much a term counts in each field when ranking, relative to the body.
+# The SQLite backend passes the same weights to bm25().
+SUBJECT_WEIGHT = 3
+SENDER_WEIGHT = 2
+RECIPIENT_WEIGHT = 1
+
+# BM25 term frequency saturation
+K1 = 1.2
+
+# A posting packs a message id and the term's weighted frequency in that
+# message into one integer, so a posting list is a flat sorted array
+WEIGHT_BITS = 16
+MAX_WEIGHT = (1 << WEIGHT_BITS) - 1
+
+
+def _split(text: str) -> List[str]:
+    text = text.lower()
+    if text.isascii():
+        return text.encode("ascii").translate(ASCII_TOKEN_TABLE).decode("ascii").split()
+    return TOKEN_PATTERN.findall(text)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Split text into lowercase search tokens."""
+    if not text:
+        return []
+    return [token for token in _split(text) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+def query_terms(query: str) -> List[str]:
+    """Get the distinct tokens of a search query; a message must contain all of them."""
+    return list(dict.fromkeys(tokenize(query)))
+
+
+def fts_query(terms: List[str]) -> str:
+    """Build an SQLite FTS5 MATCH expression requiring every term."""
+    # Tokens are letters and digits only, so quoting them is enough
+    return " ".join(f'"{term}"' for term in terms)
+
+
+def search_body(content: Optional[str], html_content: Optional[str]) -> str:
+    """Get the body text that is indexed: the text part, or the HTML part without markup."""
+    if content and content.strip():
+        return content
+    return html_to_text(html_content) if html_content else ""
+
+
+def body_terms(content: Optional[str], html_content: Optional[str]) -> Dict[str, int]:
+    """Get the terms of a message body, weighted by how often they occur."""
+    text = search_body(content, html_content)
+    if not text:
+        return {}
+    # Counting every token and then dropping the few overlong distinct ones is
+    # cheaper than filtering each token, which matters on the ingest path
+    terms = Counter(_split(text))
+    for token in [token for token in terms if len(token) > MAX_TOKEN_LENGTH]:
+        del terms[token]
+    return terms
+
+
+def message_terms(message, body: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """Get the weighted terms of a message's subject, sender and recipient, plus `body`."""
+    terms = dict(body) if body else {}
+    for text, weight in (
+        (message.subject, SUBJECT_WEIGHT),
+        (message.sender, SENDER_WEIGHT),
+        (message.sender_email, SENDER_WEIGHT),
+        (message.recipient, RECIPIENT_WEIGHT)
+    ):
+        for token in tokenize(text):
+            terms[token] = terms.get(token, 0) + weight
+    return terms
+
+
+def _idf(document_frequency: int, message_count: int) -> float:
+    message_count = max(message_count, document_frequency)
+    return math.log(1 + (message_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+def _saturate(weight: int) -> float:
+    return weight * (K1 + 1) / (weight + K1)
+
+
+class SearchIndex:
+    """Inverted index from terms to the messages containing them, per account.
+
+    Each account has its own term dictionary, so a search only touches the
+    postings of the account searched. Posting lists are sorted by message id;
+    ids are allocated in arrival order, so indexing a new message appends.
+
+    The index does no locking of its own: the memory backend updates and
+    searches an account's postings under that account's lock.
+    """
+
+    def __init__(self):
+        self.accounts: Dict[int, Dict[str, array]] = {}
+
+    def add(self, account_id: int, message_id: int, terms: Dict[str, int]) -> None:
+        """Index a message under weighted terms, adding to terms it already has."""
+        postings_by_term = self.accounts.setdefault(account_id, {})
+        key = message_id << WEIGHT_BITS
+        for term, weight in terms.items():
+            postings = postings_by_term.get(term)
+            if postings is None:
+                postings_by_term[term] = array("Q", (key | min(weight, MAX_WEIGHT),))
+            elif postings[-1] < key:
+                # The common case: the newest message of the account
+                postings.append(key | (weight if weight < MAX_WEIGHT else MAX_WEIGHT))
+            else:
+                i = bisect_left(postings, key)
+                if i < len(postings) and postings[i] >> WEIGHT_BITS == message_id:
+                    postings[i] = key | min((postings[i] & MAX_WEIGHT) + weight, MAX_WEIGHT)
+                else:
+                    postings.insert(i, key | min(weight, MAX_WEIGHT))
+
+    def remove(self, account_id: int, message_id: int, terms) -> None:
+        """Remove a message from the postings of `terms`; terms it is not indexed under are skipped."""
+        postings_by_term = self.accounts.get(account_id)
+        if postings_by_term is None:
+            return
+        key = message_id << WEIGHT_BITS
+        for term in terms:
+            postings = postings_by_term.get(term)
+            if postings is None:
+                continue
+            i = bisect_left(postings, key)
+            if i < len(postings) and postings[i] >> WEIGHT_BITS == message_id:
+                if len(postings) == 1:
+                    del postings_by_term[term]
+                else:
+                    del postings[i]
+        if not postings_by_term:
+            del self.accounts[account_id]
+
+    def search(
+        self,
+        account_id: int,
+        terms: List[str],
+        message_count: int,
+        limit: int,
+        offset: int = 0
+    ) -> Tuple[int, List[int]]:
+        """Rank an account's messages that contain every term with BM25.
+
+        `message_count` is the number of messages in the account. Returns the
+        number of matches and the ids of the requested page, best first;
+        equal scores are ordered newest first.
+        """
+        postings_by_term = self.accounts.get(account_id)
+        if not postings_by_term or not terms:
+            return 0, []
+        lists = []
+        for term in terms:
+            postings = postings_by_term.get(term)
+            if postings is None:
+                return 0, []
+            lists.append(postings)
+
+        # Start from the rarest term and look the candidates up in the others
+        lists.sort(key=len)
+        idf = _idf(len(lists[0]), message_count)
+        scores = {entry >> WEIGHT_BITS: idf * _saturate(entry & MAX_WEIGHT) for entry in lists[0]}
+        for postings in lists[1:]:
+            idf = _idf(len(postings), message_count)
+            matched = {}
+            for message_id, score in scores.items():
+                i = bisect_left(postings, message_id << WEIGHT_BITS)
+                if i < len(postings) and postings[i] >> WEIGHT_BITS == message_id:
+                    matched[message_id] = score + idf * _saturate(postings[i] & MAX_WEIGHT)
+            scores = matched
+            if not scores:
+                return 0, []
+
+        ranked = heapq.nlargest(offset + limit, scores.items(), key=lambda item: (item[1], item[0]))
+        return len(scores), [message_id for message_id, _ in ranked[offset:]]
+
+    def stats(self) -> Dict[str, int]:
+        """Get the number of distinct terms and postings across accounts."""
+        terms = postings = 0
+        for postings_by_term in list(self.accounts.values()):
+            for term_postings in list(postings_by_term.values()):
+                terms += 1
+                postings += len(term_postings)
+        return {"terms": terms, "postings": postings}
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.process import BaseProcess
+from typing import Callable, List, Optional
+
+import uvicorn
+
+from .asgi import ASGIApp
+from .smtp_server import SMTPServer
+from .watch_api import WatchApp
+
+logger = logging.getLogger(__name__)
+
+
+async def serve(
+    app,
+    smtp_server: Optional[SMTPServer] = None,
+    storage=None,
+    host: str = "0.0.0.0",
+    port: int = 8000,
+    workers: Optional[int] = None,
+    max_connections: Optional[int] = None,
+    backlog: int = 2048,
+    keepalive_timeout: float = 5,
+    sock: Optional[socket.socket] = None
+) -> None:
+    """Serve the HTTP API and the SMTP listener, if any, from the running event loop.
+
+    Uvicorn serves `app` through ASGIApp, with requests handled on a pool of
+    `workers` threads (by default the CPU count plus four, as for
+    ThreadPoolExecutor). Every worker that is running Python competes with
+    the event loop for the GIL, so more workers than the CPUs can keep busy
+    only slow down SMTP sessions. Given the `storage` the app serves,
+    long-polls and event streams wait on the event loop through WatchApp
+    instead of holding a worker each. Beyond
+    `max_connections` concurrent HTTP connections and requests Uvicorn
+    answers 503. The SMTP server listens on the same loop. With `sock`,
+    the API is served on that listening socket instead of `host` and `port`.
+    Returns when Uvicorn is asked to exit (SIGINT or SIGTERM).
+    """
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) + 4)
+    executor = ThreadPoolExecutor(workers, thread_name_prefix="http")
+    watch_app = WatchApp(storage, executor) if storage is not None else None
+    server = uvicorn.Server(uvicorn.Config(
+        ASGIApp(app, executor, watch_app),
+        host=host,
+        port=port,
+        limit_concurrency=max_connections,
+        backlog=backlog,
+        timeout_keep_alive=keepalive_timeout,
+        lifespan="off",
+        # Logging is configured by main; request lines at INFO would cost
+        # more than serving the requests
+        log_config=None,
+        access_log=False
+    ))
+
+    if smtp_server is not None:
+        await smtp_server.start_async()
+    logger.info(f"Serving the API on {host}:{port} with {workers} workers")
+    try:
+        await server.serve(sockets=[sock] if sock is not None else None)
+    finally:
+        if smtp_server is not None:
+            smtp_server.stop()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run(app, smtp_server: Optional[SMTPServer] = None, **options) -> None:
+    """Run `serve` on a new event loop until the server exits."""
+    asyncio.run(serve(app, smtp_server, **options))
+
+
+def start_api_process(target: Callable[[socket.socket], None], sock: socket.socket, index: int) -> BaseProcess:
+    # Spawned rather than forked: the child must not inherit this process's
+    # database connection and threads
+    process = multiprocessing.get_context("spawn").Process(target=target, args=(sock,), name=f"api-{index}")
+    process.start()
+    return process
+
+
+async def serve_ingest(
+    smtp_server: SMTPServer,
+    api_target: Optional[Callable[[socket.socket], None]] = None,
+    api_processes: int = 0,
+    host: str = "0.0.0.0",
+    port: int = 8000,
+    backlog: int = 2048
+) -> None:
+    """Receive mail on the running event loop, with the API served by other processes.
+
+    Starts `api_processes` processes running api_target(sock) on one
+    listening socket, so each connection goes to whichever process accepts
+    it first, and restarts any that exits. Returns on SIGINT or SIGTERM,
+    after stopping them.
+    """
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    sock = None
+    processes: List[BaseProcess] = []
+    if api_processes:
+        sock = socket.create_server((host, port), backlog=backlog)
+        processes = [start_api_process(api_target, sock, i) for i in range(api_processes)]
+        logger.info(f"Serving the API on {host}:{port} from {api_processes} processes")
+    await smtp_server.start_async()
+    try:
+        while not stopping.is_set():
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+            for i, process in enumerate(processes):
+                if not process.is_alive() and not stopping.is_set():
+                    logger.warning(f"API process {process.name} exited with code {process.exitcode}, restarting it")
+                    processes[i] = start_api_process(api_target, sock, i)
+    finally:
+        smtp_server.stop()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        if sock is not None:
+            sock.close()
+
+
+def run_ingest(smtp_server: SMTPServer, **options) -> None:
+    """Run `serve_ingest` on a new event loop until interrupted."""
+    asyncio.run(serve_ingest(smtp_server, **options))
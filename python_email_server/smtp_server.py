@@ -1,70 +1,139 @@
 import asyncio
 import logging
+import socket
+from concurrent.futures import Executor
+from typing import List, Optional, Tuple
 from aiosmtpd.controller import Controller
 from aiosmtpd.smtp import SMTP, Envelope, Session
 
-from .email_parser import parse_email
-from .storage import storage
+from .email_parser import parse_message_fields
+from .storage import storage as default_storage
 
 logger = logging.getLogger(__name__)
 
 class SMTPHandler:
-    """Handler for incoming SMTP connections."""
+    """Handler for incoming SMTP connections.
+    
+    With `defer_parsing`, only the From/Subject/Message-ID headers are parsed
+    before replying; the storage backend completes the parse later. With a
+    `pipeline`, parsing and storage are handed off to its workers and the
+    message is accepted as soon as it is queued. Otherwise, with an
+    `executor`, they run on it and the session waits for the result, which
+    keeps them off an event loop shared with other servers.
+    """
+    
+    def __init__(self, storage=default_storage, defer_parsing=False, pipeline=None,
+                 executor: Optional[Executor] = None):
+        self.storage = storage
+        self.defer_parsing = defer_parsing
+        self.pipeline = pipeline
+        self.executor = executor
+    
+    async def handle_RCPT(self, server: SMTP, session: Session, envelope: Envelope,
+                          address: str, rcpt_options: list) -> str:
+        """Reject unknown recipients before the message is transferred."""
+        if not self.storage.get_email_account_by_email(address):
+            logger.warning(f"Recipient not found: {address}")
+            return '550 Recipient address rejected: User unknown'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
     
     async def handle_DATA(self, server: SMTP, session: Session, envelope: Envelope) -> str:
         """Handle incoming email data."""
         try:
-            recipient = envelope.rcpt_tos[0]
-            # Handle both string and bytes content
-            if isinstance(envelope.content, bytes):
-                email_data = envelope.content.decode('utf-8', errors='replace')
-            else:
-                email_data = envelope.content
-            
-            logger.info(f"Received email for: {recipient}")
+            logger.info(f"Received email for: {', '.join(envelope.rcpt_tos)}")
             
-            # Find the account for this recipient
-            account = storage.get_email_account_by_email(recipient)
-            if not account:
-                logger.warning(f"Recipient not found: {recipient}")
+            # Find the account of every recipient, delivering once per account
+            recipients = []
+            account_ids = set()
+            for recipient in envelope.rcpt_tos:
+                account = self.storage.get_email_account_by_email(recipient)
+                if not account:
+                    logger.warning(f"Recipient not found: {recipient}")
+                elif account.id not in account_ids:
+                    account_ids.add(account.id)
+                    recipients.append((account.id, recipient))
+            if not recipients:
                 return '550 Recipient address rejected: User unknown'
             
-            # Parse the email
-            parsed_email = parse_email(email_data)
+            # Handle both string and bytes content
+            raw = envelope.original_content
+            if raw is None:
+                content = envelope.content
+                raw = content if isinstance(content, bytes) else content.encode('utf-8')
             
-            # Store the email
-            message_data = {
-                "account_id": account.id,
-                "sender": parsed_email.from_name or parsed_email.from_address,
-                "sender_email": parsed_email.from_address,
-                "recipient": recipient,
-                "subject": parsed_email.subject or "(No Subject)",
-                "content": parsed_email.text or "",
-                "html_content": parsed_email.html,
-                "headers": parsed_email.headers
-            }
+            if self.pipeline is not None:
+                if not self.pipeline.submit(recipients, raw):
+                    logger.warning(f"Ingestion queue full, deferring email for: {', '.join(envelope.rcpt_tos)}")
+                    return '451 Requested action aborted: server busy, try again later'
+                return '250 Message accepted for delivery'
             
-            message = storage.create_email_message(message_data)
-            logger.info(f"Email stored with ID: {message.id}")
+            if self.executor is not None:
+                await asyncio.get_running_loop().run_in_executor(self.executor, self._deliver, recipients, raw)
+            else:
+                self._deliver(recipients, raw)
             
             return '250 Message accepted for delivery'
         except Exception as e:
             logger.error(f"Error processing email: {e}")
             return '554 Transaction failed'
+    
+    def _deliver(self, recipients: List[Tuple[int, str]], raw: bytes) -> None:
+        # Parse the email once for all recipients, or just its key
+        # headers when deferring
+        message_data = {
+            **parse_message_fields(
+                raw, headers_only=self.defer_parsing, blob_store=self.storage.blob_store
+            ),
+            "raw": raw,
+            "deferred_parse": self.defer_parsing
+        }
+        
+        # Store a copy for each recipient, sharing the body
+        messages = self.storage.create_email_messages(message_data, recipients)
+        logger.info(f"Email stored with IDs: {[message.id for message in messages]}")
+
+
+class BoundedSMTP(SMTP):
+    """An SMTP session that counts itself against its server's connection limit."""
+    
+    def __init__(self, server: "SMTPServer", handler: SMTPHandler, **kwargs):
+        super().__init__(handler, **kwargs)
+        self.server = server
+    
+    def connection_lost(self, error: Optional[Exception]) -> None:
+        self.server.connections -= 1
+        super().connection_lost(error)
+
+
+class TooManyConnections(asyncio.Protocol):
+    """Answers a connection beyond the limit with a temporary failure and closes it."""
+    
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        transport.write(b"421 Too many connections, try again later\r\n")
+        transport.close()
 
 
 class SMTPServer:
     """Simple SMTP server to receive emails."""
     
-    def __init__(self, host='0.0.0.0', port=25):
+    def __init__(self, host='0.0.0.0', port=25, storage=default_storage, defer_parsing=False, pipeline=None,
+                 executor: Optional[Executor] = None, max_connections: Optional[int] = None):
         self.host = host
         self.port = port
+        self.storage = storage
+        self.defer_parsing = defer_parsing
+        self.pipeline = pipeline
+        self.executor = executor
+        self.max_connections = max_connections
+        self.connections = 0
         self.controller = None
+        self.server: Optional[asyncio.AbstractServer] = None
         
     def start(self):
         """Start the SMTP server."""
         try:
-            handler = SMTPHandler()
+            handler = SMTPHandler(self.storage, defer_parsing=self.defer_parsing, pipeline=self.pipeline)
             self.controller = Controller(handler, hostname=self.host, port=self.port)
             self.controller.start()
             logger.info(f"SMTP server started on {self.host}:{self.port}")
@@ -73,9 +142,39 @@ class SMTPServer:
             logger.warning("This is normal in restricted environments.")
             logger.warning("The application will continue, but won't be able to receive emails directly.")
             logger.warning("For testing, use the API endpoints to simulate incoming emails.")
+    
+    async def start_async(self):
+        """Start the SMTP server on the running event loop instead of in a thread of its own.
+        
+        Sessions beyond `max_connections` are answered with a 421.
+        """
+        loop = asyncio.get_running_loop()
+        handler = SMTPHandler(
+            self.storage, defer_parsing=self.defer_parsing, pipeline=self.pipeline, executor=self.executor
+        )
+        # Look the name up once rather than in every session's greeting
+        hostname = socket.getfqdn()
+        
+        def create_protocol():
+            if self.max_connections is not None and self.connections >= self.max_connections:
+                return TooManyConnections()
+            self.connections += 1
+            return BoundedSMTP(self, handler, hostname=hostname, loop=loop)
+        
+        try:
+            self.server = await loop.create_server(create_protocol, self.host, self.port)
+            logger.info(f"SMTP server started on {self.host}:{self.port}")
+        except (PermissionError, OSError) as e:
+            logger.warning(f"Could not start SMTP server on port {self.port}: {e}")
+            logger.warning("The application will continue, but won't be able to receive emails directly.")
             
     def stop(self):
         """Stop the SMTP server."""
+        if self.pipeline:
+            self.pipeline.stop()
         if self.controller:
             self.controller.stop()
+            logger.info("SMTP server stopped")
+        if self.server:
+            self.server.close()
             logger.info("SMTP server stopped")
\ No newline at end of file
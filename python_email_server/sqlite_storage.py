@@ -0,0 +1,981 @@
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Any, Tuple
+
+from .models import EmailAccount, MessageRecord
+from .email_parser import make_snippet, parse_email, message_fields, extract_message_magic_links
+from .storage import StorageBackend, _normalize_email
+from .blob_store import BlobStore
+from .notifications import MessageFilter, MessageNotifier
+from .retention import EVICTION_REASONS, RetentionPolicy
+from .search import RECIPIENT_WEIGHT, SENDER_WEIGHT, SUBJECT_WEIGHT, fts_query, query_terms, search_body
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS email_accounts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    email TEXT NOT NULL,
+    password TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_email_accounts_email
+    ON email_accounts (lower(email));
+CREATE INDEX IF NOT EXISTS idx_email_accounts_domain
+    ON email_accounts (lower(domain));
+
+CREATE TABLE IF NOT EXISTS email_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_id INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    sender_email TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    content TEXT NOT NULL,
+    html_content TEXT,
+    snippet TEXT NOT NULL DEFAULT '',
+    received_at TEXT NOT NULL,
+    read INTEGER NOT NULL DEFAULT 0,
+    headers TEXT NOT NULL DEFAULT '{}'
+);
+"""
+
+# Columns added after the initial schema: (table, column, definition)
+COLUMN_MIGRATIONS = [
+    ("email_messages", "raw", "BLOB"),
+    ("email_messages", "parsed", "INTEGER NOT NULL DEFAULT 1"),
+    ("email_messages", "magic_links", "TEXT NOT NULL DEFAULT '[]'"),
+    ("email_messages", "attachments", "TEXT NOT NULL DEFAULT '[]'"),
+    # Id of the first copy of a deferred multi-recipient delivery, on the others
+    ("email_messages", "delivery_id", "INTEGER"),
+    ("email_messages", "size", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_email_messages_account_received
+    ON email_messages (account_id, received_at);
+CREATE INDEX IF NOT EXISTS idx_email_messages_received
+    ON email_messages (received_at);
+CREATE INDEX IF NOT EXISTS idx_email_messages_account_unread
+    ON email_messages (account_id) WHERE read = 0;
+CREATE INDEX IF NOT EXISTS idx_email_messages_unparsed
+    ON email_messages (id) WHERE parsed = 0;
+CREATE INDEX IF NOT EXISTS idx_email_messages_delivery
+    ON email_messages (delivery_id) WHERE delivery_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_email_messages_account_unparsed
+    ON email_messages (account_id) WHERE parsed = 0;
+CREATE INDEX IF NOT EXISTS idx_email_messages_account_links
+    ON email_messages (account_id, id) WHERE magic_links != '[]';
+"""
+
+# Full-text index over messages. It is contentless (the text lives in
+# email_messages only) and kept in sync by triggers; search_body() is a
+# Python function registered on the connection.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS email_search USING fts5(
+    subject, sender, recipient, body,
+    content='', tokenize='unicode61 remove_diacritics 0'
+);
+CREATE TRIGGER IF NOT EXISTS email_search_insert AFTER INSERT ON email_messages BEGIN
+    INSERT INTO email_search (rowid, subject, sender, recipient, body)
+    VALUES (new.id, new.subject, new.sender || ' ' || new.sender_email, new.recipient,
+            search_body(new.content, new.html_content));
+END;
+CREATE TRIGGER IF NOT EXISTS email_search_delete AFTER DELETE ON email_messages BEGIN
+    INSERT INTO email_search (email_search, rowid, subject, sender, recipient, body)
+    VALUES ('delete', old.id, old.subject, old.sender || ' ' || old.sender_email, old.recipient,
+            search_body(old.content, old.html_content));
+END;
+CREATE TRIGGER IF NOT EXISTS email_search_update
+AFTER UPDATE OF subject, sender, sender_email, recipient, content, html_content ON email_messages BEGIN
+    INSERT INTO email_search (email_search, rowid, subject, sender, recipient, body)
+    VALUES ('delete', old.id, old.subject, old.sender || ' ' || old.sender_email, old.recipient,
+            search_body(old.content, old.html_content));
+    INSERT INTO email_search (rowid, subject, sender, recipient, body)
+    VALUES (new.id, new.subject, new.sender || ' ' || new.sender_email, new.recipient,
+            search_body(new.content, new.html_content));
+END;
+"""
+
+# Versions of each account's messages (keyed by account id) and of the
+# account list (key 0), kept by triggers so that every process writing to
+# the database advances them. Each change takes the next value of the
+# account list's version, which starts at the time the table is created.
+VERSION_SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    key INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS versions_account_insert AFTER INSERT ON email_accounts BEGIN
+    UPDATE versions SET version = version + 1 WHERE key = 0;
+    INSERT OR REPLACE INTO versions (key, version) SELECT new.id, version FROM versions WHERE key = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS versions_message_insert AFTER INSERT ON email_messages BEGIN
+    UPDATE versions SET version = version + 1 WHERE key = 0;
+    INSERT OR REPLACE INTO versions (key, version) SELECT new.account_id, version FROM versions WHERE key = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS versions_message_delete AFTER DELETE ON email_messages BEGIN
+    UPDATE versions SET version = version + 1 WHERE key = 0;
+    INSERT OR REPLACE INTO versions (key, version) SELECT old.account_id, version FROM versions WHERE key = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS versions_message_update AFTER UPDATE OF read, magic_links ON email_messages
+WHEN old.read != new.read OR (old.parsed AND old.magic_links != new.magic_links) BEGIN
+    UPDATE versions SET version = version + 1 WHERE key = 0;
+    INSERT OR REPLACE INTO versions (key, version) SELECT new.account_id, version FROM versions WHERE key = 0;
+END;
+"""
+
+SEARCH_RANK = f"bm25(email_search, {SUBJECT_WEIGHT}, {SENDER_WEIGHT}, {RECIPIENT_WEIGHT}, 1)"
+
+MESSAGE_COLUMNS = (
+    "id, account_id, sender, sender_email, recipient, subject, content, "
+    "html_content, snippet, magic_links, attachments, received_at, read, headers, size, parsed"
+)
+
+# Host parameters per statement, below SQLite's lowest default limit of 999
+SQLITE_MAX_PARAMETERS = 500
+
+# Messages read per query by stream_email_messages
+STREAM_PAGE_SIZE = 200
+
+INSERT_MESSAGE = (
+    "INSERT INTO email_messages (account_id, sender, sender_email, recipient, subject, "
+    "content, html_content, snippet, magic_links, attachments, received_at, read, headers, "
+    "size, raw, parsed, delivery_id) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?)"
+)
+
+
+class PendingCommit:
+    """The writes of one group-commit transaction, done once it is committed."""
+
+    __slots__ = ("done", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        # Set if the transaction was rolled back instead
+        self.error: Optional[Exception] = None
+        self.waiters = 0
+
+
+class SQLiteStorage(StorageBackend):
+    """Durable storage backed by a SQLite database in WAL mode.
+
+    Writes are group-committed: they join an open transaction instead of
+    committing one by one. Storing a message returns only once its
+    transaction is committed, so mail acknowledged over SMTP is never lost;
+    the flusher thread commits a transaction as soon as a writer waits on
+    it, and messages stored by other threads while it commits the previous
+    one share the next commit. Other writes (read flags, deletions, parse
+    results) are committed once `commit_batch_size` writes are pending, or
+    at the latest `commit_interval` seconds after the first one. Reads go
+    through the same connection, so they always see pending writes. Account
+    creation commits immediately.
+
+    A message delivered to several recipients is validated and serialized
+    once and inserted as one row per recipient in the same transaction.
+
+    Several processes can share the database: one receiving mail and others
+    serving the API. Their writes take the database's write lock up front
+    (BEGIN IMMEDIATE), and a process serving the API should commit each one
+    at once (`commit_batch_size` 1) so that it never holds the lock while
+    the ingest process waits for it. Mail stored by another process is read
+    as soon as it is committed, but only that process's notifier hears of
+    it; with `watch_interval`, a watcher thread looks for newly committed
+    messages every `watch_interval` seconds and wakes this process's waiters
+    instead, for messages stored by any process, in commit order.
+    """
+
+    def __init__(self, path: str, commit_interval: float = 0.05, commit_batch_size: int = 100,
+                 blob_store: Optional[BlobStore] = None, watch_interval: Optional[float] = None):
+        self.path = path
+        self.blob_store = blob_store
+        self.commit_interval = commit_interval
+        self.commit_batch_size = commit_batch_size
+        self.watch_interval = watch_interval
+        self.notifier = MessageNotifier()
+
+        # A single connection shared by the SMTP and API threads
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.create_function("search_body", 2, search_body, deterministic=True)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        added_columns = self._migrate()
+        self.conn.executescript(INDEXES)
+        new_search_index = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'email_search'"
+        ).fetchone() is None
+        self.conn.executescript(SEARCH_SCHEMA)
+        self.conn.executescript(VERSION_SCHEMA)
+        # Start where a previous database at this path could not have got
+        # to, so versions clients cached from it are not handed out again
+        self.conn.execute(
+            "INSERT OR IGNORE INTO versions (key, version) VALUES (0, ?)", (time.time_ns() // 1000,)
+        )
+        # Accounts created before versions were kept
+        self.conn.execute(
+            "INSERT OR IGNORE INTO versions (key, version) "
+            "SELECT id, (SELECT version FROM versions WHERE key = 0) FROM email_accounts"
+        )
+
+        self.pending_writes = 0
+        self.first_pending_at = 0.0
+        # The open transaction's writes, and the flusher's wake-up call
+        self.batch: Optional[PendingCommit] = None
+        self.commit_ready = threading.Condition(self.lock)
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="sqlite-flusher", daemon=True)
+        self._flusher.start()
+
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM email_accounts LIMIT 1").fetchone() is None:
+                try:
+                    self._seed_data()
+                except ValueError:
+                    # Another process sharing the database seeded it first
+                    pass
+            if "magic_links" in added_columns:
+                # Messages stored before links were extracted at ingest
+                self.reprocess_magic_links()
+            if "size" in added_columns:
+                # Same size rule as create_email_messages
+                self.conn.execute(
+                    "UPDATE email_messages SET size = "
+                    "coalesce(length(raw), length(content) + coalesce(length(html_content), 0))"
+                )
+            if new_search_index:
+                # Index messages stored before search was added
+                self.conn.execute(
+                    "INSERT INTO email_search (rowid, subject, sender, recipient, body) "
+                    "SELECT id, subject, sender || ' ' || sender_email, recipient, "
+                    "search_body(content, html_content) FROM email_messages"
+                )
+
+        self._watcher = None
+        if watch_interval is not None:
+            self.last_seen_id = self.conn.execute("SELECT coalesce(max(id), 0) FROM email_messages").fetchone()[0]
+            self._watcher = threading.Thread(target=self._watch_loop, name="sqlite-watcher", daemon=True)
+            self._watcher.start()
+
+    def _migrate(self) -> set:
+        """Add columns missing from databases created by older versions.
+
+        Returns the names of the columns added.
+        """
+        added = set()
+        for table, column, definition in COLUMN_MIGRATIONS:
+            columns = {row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                added.add(column)
+        return added
+
+    # Transactions
+    def _begin(self) -> None:
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.first_pending_at = time.monotonic()
+            self.batch = PendingCommit()
+
+    def _write(self, sql: str, params=()) -> sqlite3.Cursor:
+        """Run a write inside the current group-commit transaction."""
+        with self.lock:
+            self._begin()
+            cursor = self.conn.execute(sql, params)
+            self.pending_writes += 1
+            if self.pending_writes >= self.commit_batch_size:
+                self._commit()
+            return cursor
+
+    def _write_many(self, sql: str, params_list: List[tuple]) -> List[int]:
+        """Run a write per parameter tuple in one transaction; returns their row ids."""
+        with self.lock:
+            self._begin()
+            row_ids = [self.conn.execute(sql, params).lastrowid for params in params_list]
+            self.pending_writes += len(row_ids)
+            if self.pending_writes >= self.commit_batch_size:
+                self._commit()
+            return row_ids
+
+    def _commit(self) -> None:
+        try:
+            if self.conn.in_transaction:
+                self.conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            # A transaction still open (the database was busy) is committed
+            # by a later try; one SQLite rolled back fails its writers
+            if not self.conn.in_transaction:
+                self._end_batch(e)
+            raise
+        self._end_batch()
+
+    def _end_batch(self, error: Optional[Exception] = None) -> None:
+        self.pending_writes = 0
+        batch, self.batch = self.batch, None
+        if batch is not None:
+            batch.error = error
+            batch.done.set()
+
+    def _request_commit(self) -> Optional[PendingCommit]:
+        """Have the open transaction committed now; returns it to wait on.
+
+        Called with the lock held, after a write. Returns None if the write
+        was committed already.
+        """
+        batch = self.batch
+        if batch is not None:
+            batch.waiters += 1
+            self.commit_ready.notify()
+        return batch
+
+    @staticmethod
+    def _wait_for_commit(batch: Optional[PendingCommit]) -> None:
+        """Wait, without the lock, until a transaction is committed.
+
+        Raises the error it failed with if it was rolled back.
+        """
+        if batch is not None:
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+
+    def _flush_loop(self) -> None:
+        """Commit transactions writers wait on at once, others after `commit_interval`."""
+        with self.commit_ready:
+            while not self._stop.is_set():
+                timeout = self.commit_interval
+                if self.batch is not None:
+                    timeout -= time.monotonic() - self.first_pending_at
+                    if self.batch.waiters or timeout <= 0:
+                        try:
+                            self._commit()
+                            continue
+                        except sqlite3.Error as e:
+                            logger.error(f"Error committing pending writes: {e}")
+                            timeout = self.commit_interval
+                self.commit_ready.wait(timeout)
+
+    def flush(self) -> None:
+        """Commit all pending writes now."""
+        with self.lock:
+            self._commit()
+
+    def _watch_loop(self) -> None:
+        """Wake waiters for messages committed since the last look, by any process."""
+        while not self._stop.wait(self.watch_interval):
+            try:
+                with self.lock:
+                    rows = self.conn.execute(
+                        "SELECT id, account_id FROM email_messages WHERE id > ? ORDER BY id",
+                        (self.last_seen_id,)
+                    ).fetchall()
+            except sqlite3.Error as e:
+                logger.error(f"Error looking for new messages: {e}")
+                continue
+            if rows:
+                # Writers hold the write lock from id allocation to commit, so
+                # ids become visible in order and none is skipped
+                self.last_seen_id = rows[-1]["id"]
+                self.notifier.notify_ids((row["account_id"], row["id"]) for row in rows)
+
+    def _notify(self, messages: List[MessageRecord]) -> None:
+        # With a watcher, it announces these too, once and in order with the
+        # messages of other processes
+        if self._watcher is None:
+            self.notifier.notify(messages)
+
+    def close(self) -> None:
+        """Stop the background threads, commit pending writes and close the database."""
+        self._stop.set()
+        with self.commit_ready:
+            self.commit_ready.notify()
+        self._flusher.join()
+        if self._watcher is not None:
+            self._watcher.join()
+        with self.lock:
+            self._commit()
+            self.conn.close()
+
+    # Row conversion
+    @staticmethod
+    def _row_to_account(row: sqlite3.Row) -> EmailAccount:
+        return EmailAccount(
+            id=row["id"],
+            username=row["username"],
+            domain=row["domain"],
+            email=row["email"],
+            password=row["password"],
+            created_at=datetime.fromisoformat(row["created_at"])
+        )
+
+    @staticmethod
+    def _row_to_message(row: sqlite3.Row) -> MessageRecord:
+        return MessageRecord(
+            id=row["id"],
+            account_id=row["account_id"],
+            sender=row["sender"],
+            sender_email=row["sender_email"],
+            recipient=row["recipient"],
+            subject=row["subject"],
+            content=row["content"],
+            html_content=row["html_content"],
+            snippet=row["snippet"],
+            magic_links=json.loads(row["magic_links"]),
+            attachments=json.loads(row["attachments"]),
+            received_at=datetime.fromisoformat(row["received_at"]),
+            read=bool(row["read"]),
+            headers=json.loads(row["headers"]),
+            size=row["size"]
+        )
+
+    def _query(self, sql: str, params=()) -> List[sqlite3.Row]:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _messages(self, rows: List[sqlite3.Row]) -> List[MessageRecord]:
+        """Convert message rows, completing the parse of deferred ones.
+
+        Deferred messages deleted since their rows were read are left out.
+        """
+        messages = []
+        for row in rows:
+            message = self._row_to_message(row) if row["parsed"] else self._complete_parse(row["id"])
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    def _complete_parse(self, message_id: int) -> Optional[MessageRecord]:
+        """Fully parse a deferred message and store the result.
+
+        The other copies of a multi-recipient delivery get the same result.
+        Returns None if the message no longer exists.
+        """
+        rows = self._query("SELECT raw, parsed, delivery_id FROM email_messages WHERE id = ?", (message_id,))
+        if not rows:
+            # Deleted or evicted since the caller read its id
+            return None
+        row = rows[0]
+        if row["parsed"]:
+            return self.get_email_message(message_id)
+
+        # Parse without holding the lock, so other queries are not held up;
+        # if another thread parses it meanwhile, `parsed = 0` skips our update
+        fields = message_fields(parse_email(row["raw"], self.blob_store))
+        fields["snippet"] = make_snippet(fields["content"], fields["html_content"])
+        magic_links = extract_message_magic_links(fields["content"], fields["html_content"])
+        self._write(
+            "UPDATE email_messages SET sender = ?, sender_email = ?, subject = ?, content = ?, "
+            "html_content = ?, snippet = ?, magic_links = ?, attachments = ?, headers = ?, "
+            "parsed = 1 WHERE parsed = 0 AND (id = ? OR delivery_id = ?)",
+            (fields["sender"], fields["sender_email"], fields["subject"], fields["content"],
+             fields["html_content"], fields["snippet"], json.dumps(magic_links),
+             json.dumps(fields["attachments"]), json.dumps(fields["headers"], default=str),
+             row["delivery_id"] or message_id, row["delivery_id"] or message_id)
+        )
+        return self.get_email_message(message_id)
+
+    # Email Account Methods
+    def get_email_accounts(self) -> List[EmailAccount]:
+        """Get all email accounts."""
+        rows = self._query("SELECT * FROM email_accounts ORDER BY id")
+        return [self._row_to_account(row) for row in rows]
+
+    def get_email_account(self, account_id: int) -> Optional[EmailAccount]:
+        """Get an email account by ID."""
+        rows = self._query("SELECT * FROM email_accounts WHERE id = ?", (account_id,))
+        return self._row_to_account(rows[0]) if rows else None
+
+    def get_email_account_by_email(self, email: str) -> Optional[EmailAccount]:
+        """Get an email account by email address."""
+        rows = self._query(
+            "SELECT * FROM email_accounts WHERE lower(email) = ?",
+            (_normalize_email(email),)
+        )
+        return self._row_to_account(rows[0]) if rows else None
+
+    def get_email_accounts_by_domain(self, domain: str) -> List[EmailAccount]:
+        """Get all email accounts for a domain."""
+        rows = self._query(
+            "SELECT * FROM email_accounts WHERE lower(domain) = ? ORDER BY id",
+            (domain.strip().lower(),)
+        )
+        return [self._row_to_account(row) for row in rows]
+
+    def create_email_account(self, account_data: Dict[str, Any]) -> EmailAccount:
+        """Create a new email account.
+
+        Raises ValueError if the email address is already taken.
+        """
+        created_at = datetime.now()
+        with self.lock:
+            try:
+                cursor = self._write(
+                    "INSERT INTO email_accounts (username, domain, email, password, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (account_data["username"], account_data["domain"], account_data["email"],
+                     account_data["password"], created_at.isoformat(timespec='microseconds'))
+                )
+            except sqlite3.IntegrityError:
+                raise ValueError(f"Email address {account_data['email']} already exists")
+            finally:
+                self._commit()
+
+        return EmailAccount(
+            id=cursor.lastrowid,
+            username=account_data["username"],
+            domain=account_data["domain"],
+            email=account_data["email"],
+            password=account_data["password"],
+            created_at=created_at
+        )
+
+    def create_email_accounts(self, accounts_data: List[Dict[str, Any]]) -> List[Optional[EmailAccount]]:
+        """Create several accounts under one lock acquisition, in one transaction.
+
+        Addresses already taken are found with one IN query per
+        `SQLITE_MAX_PARAMETERS` addresses rather than a lookup per account.
+        """
+        created_at = datetime.now()
+        emails = [_normalize_email(account_data["email"]) for account_data in accounts_data]
+        with self.lock:
+            taken = set()
+            for start in range(0, len(emails), SQLITE_MAX_PARAMETERS):
+                chunk = emails[start:start + SQLITE_MAX_PARAMETERS]
+                taken.update(row[0] for row in self.conn.execute(
+                    "SELECT lower(email) FROM email_accounts "
+                    f"WHERE lower(email) IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ))
+
+            new = []
+            for i, (account_data, email) in enumerate(zip(accounts_data, emails)):
+                if email not in taken:
+                    taken.add(email)
+                    new.append(i)
+            try:
+                row_ids = self._write_many(
+                    "INSERT INTO email_accounts (username, domain, email, password, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(accounts_data[i]["username"], accounts_data[i]["domain"], accounts_data[i]["email"],
+                      accounts_data[i]["password"], created_at.isoformat(timespec='microseconds'))
+                     for i in new]
+                )
+            finally:
+                self._commit()
+
+        results: List[Optional[EmailAccount]] = [None] * len(accounts_data)
+        for i, account_id in zip(new, row_ids):
+            account_data = accounts_data[i]
+            # Skip revalidating plain values, the main cost of a large batch
+            results[i] = EmailAccount.model_construct(
+                id=account_id,
+                username=account_data["username"],
+                domain=account_data["domain"],
+                email=account_data["email"],
+                password=account_data["password"],
+                created_at=created_at
+            )
+        return results
+
+    # Email Message Methods
+    def get_email_messages(self, account_id: int) -> List[MessageRecord]:
+        """Get all email messages for an account."""
+        rows = self._query(
+            f"SELECT {MESSAGE_COLUMNS} FROM email_messages WHERE account_id = ? "
+            "ORDER BY received_at DESC, id DESC",
+            (account_id,)
+        )
+        return self._messages(rows)
+
+    def stream_email_messages(self, account_id: int) -> Tuple[int, Iterable[MessageRecord]]:
+        """Get the number of an account's messages and the messages, newest first.
+
+        The messages are read a page of `STREAM_PAGE_SIZE` at a time as the
+        iterable is read, without holding the lock in between.
+        """
+        count = self._query("SELECT COUNT(*) FROM email_messages WHERE account_id = ?", (account_id,))[0][0]
+        return count, self._iter_pages(account_id)
+
+    def _iter_pages(self, account_id: int) -> Iterator[MessageRecord]:
+        before_id = None
+        while True:
+            page = self.get_email_message_page(account_id, STREAM_PAGE_SIZE, before_id=before_id)
+            yield from page
+            if len(page) < STREAM_PAGE_SIZE:
+                return
+            before_id = page[-1].id
+
+    def get_email_message_page(
+        self,
+        account_id: int,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None
+    ) -> List[MessageRecord]:
+        """Get up to `limit` messages for an account, newest first."""
+        cursor_id = before_id if before_id is not None else after_id
+        with self.lock:
+            cursor_row = None
+            if cursor_id is not None:
+                cursor_row = self.conn.execute(
+                    "SELECT received_at FROM email_messages WHERE id = ?", (cursor_id,)
+                ).fetchone()
+
+            # Seek through the (account_id, received_at) index from the cursor
+            # message; fall back to a plain id filter if it no longer exists.
+            if after_id is not None:
+                if cursor_row is not None:
+                    where = "AND (received_at, id) > (?, ?)"
+                    params = (cursor_row["received_at"], after_id)
+                else:
+                    where, params = "AND id > ?", (after_id,)
+                rows = self.conn.execute(
+                    f"SELECT {MESSAGE_COLUMNS} FROM email_messages WHERE account_id = ? {where} "
+                    "ORDER BY received_at, id LIMIT ?",
+                    (account_id, *params, limit)
+                ).fetchall()
+                rows.reverse()
+            else:
+                where, params = "", ()
+                if before_id is not None:
+                    if cursor_row is not None:
+                        where = "AND (received_at, id) < (?, ?)"
+                        params = (cursor_row["received_at"], before_id)
+                    else:
+                        where, params = "AND id < ?", (before_id,)
+                rows = self.conn.execute(
+                    f"SELECT {MESSAGE_COLUMNS} FROM email_messages WHERE account_id = ? {where} "
+                    "ORDER BY received_at DESC, id DESC LIMIT ?",
+                    (account_id, *params, limit)
+                ).fetchall()
+            return self._messages(rows)
+
+    def get_email_message(self, message_id: int) -> Optional[MessageRecord]:
+        """Get an email message by ID."""
+        rows = self._query(
+            f"SELECT {MESSAGE_COLUMNS} FROM email_messages WHERE id = ?", (message_id,)
+        )
+        messages = self._messages(rows)
+        return messages[0] if messages else None
+
+    def _complete_account_parses(self, account_id: int) -> None:
+        """Fully parse an account's deferred messages."""
+        pending = self._query(
+            "SELECT id FROM email_messages WHERE parsed = 0 AND account_id = ?", (account_id,)
+        )
+        for row in pending:
+            self._complete_parse(row["id"])
+
+    def get_latest_magic_link_message(
+        self,
+        account_id: int,
+        match: Optional[MessageFilter] = None
+    ) -> Optional[MessageRecord]:
+        """Get an account's newest message with magic links, optionally filtered.
+
+        Walks the partial (account_id, id) index of messages with links from
+        the newest entry.
+        """
+        # Links of deferred messages are only known once they are parsed
+        self._complete_account_parses(account_id)
+
+        with self.lock:
+            cursor = self.conn.execute(
+                f"SELECT {MESSAGE_COLUMNS} FROM email_messages "
+                "WHERE account_id = ? AND magic_links != '[]' ORDER BY id DESC",
+                (account_id,)
+            )
+            try:
+                for row in cursor:
+                    message = self._row_to_message(row)
+                    if match is None or match(message):
+                        return message
+            finally:
+                cursor.close()
+        return None
+
+    def search_email_messages(
+        self,
+        account_id: int,
+        query: str,
+        limit: int,
+        offset: int = 0
+    ) -> Tuple[int, List[MessageRecord]]:
+        """Search an account's messages through the FTS5 index, best match first.
+
+        Deferred messages are indexed with the bodies they get once parsed,
+        so the account's are parsed first.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return 0, []
+        self._complete_account_parses(account_id)
+        match = fts_query(terms)
+        with self.lock:
+            total = self.conn.execute(
+                "SELECT COUNT(*) FROM email_messages JOIN "
+                "(SELECT rowid AS match_id FROM email_search WHERE email_search MATCH ?) "
+                "ON id = match_id WHERE account_id = ?",
+                (match, account_id)
+            ).fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT {MESSAGE_COLUMNS} FROM email_messages JOIN "
+                f"(SELECT rowid AS match_id, {SEARCH_RANK} AS score FROM email_search "
+                "WHERE email_search MATCH ?) "
+                "ON id = match_id WHERE account_id = ? ORDER BY score, id DESC LIMIT ? OFFSET ?",
+                (match, account_id, limit, offset)
+            ).fetchall()
+            return total, self._messages(rows)
+
+    def create_email_message(self, message_data: Dict[str, Any]) -> MessageRecord:
+        """Create a new email message."""
+        recipient = (message_data["account_id"], message_data["recipient"])
+        return self.create_email_messages(message_data, [recipient])[0]
+
+    @staticmethod
+    def _new_message(
+        message_data: Dict[str, Any],
+        account_id: int,
+        recipient: str
+    ) -> Tuple[MessageRecord, tuple, bool]:
+        """Build a message record, the column values its copies share and whether parsing is deferred."""
+        html_content = message_data.get("html_content")
+        message = MessageRecord(
+            id=0,
+            account_id=account_id,
+            sender=message_data["sender"],
+            sender_email=message_data["sender_email"],
+            recipient=recipient,
+            subject=message_data["subject"],
+            content=message_data["content"],
+            html_content=html_content,
+            snippet=make_snippet(message_data["content"], html_content),
+            magic_links=extract_message_magic_links(message_data["content"], html_content),
+            attachments=message_data.get("attachments", ()),
+            headers=message_data.get("headers", {}),
+            received_at=datetime.now(),
+            read=False
+        )
+
+        raw = message_data.get("raw")
+        deferred = bool(message_data.get("deferred_parse")) and raw is not None
+        if raw is not None:
+            message.size = len(raw)
+        else:
+            message.size = len(message.content) + len(html_content or "")
+        shared = (
+            message.subject, message.content, message.html_content, message.snippet,
+            json.dumps(message.magic_links),
+            json.dumps(list(message.attachments)),
+            message.received_at.isoformat(timespec='microseconds'),
+            json.dumps(message.headers, default=str), message.size, raw, 0 if deferred else 1
+        )
+        return message, shared, deferred
+
+    def create_email_messages(
+        self,
+        message_data: Dict[str, Any],
+        recipients: List[Tuple[int, str]]
+    ) -> List[MessageRecord]:
+        """Deliver one message to several accounts in one transaction."""
+        account_id, recipient = recipients[0]
+        message, shared, deferred = self._new_message(message_data, account_id, recipient)
+
+        messages = []
+        delivery_id = None
+        with self.lock:
+            for account_id, recipient in recipients:
+                cursor = self._write(
+                    INSERT_MESSAGE,
+                    (account_id, message.sender, message.sender_email, recipient, *shared, delivery_id)
+                )
+                copy = message
+                if messages:
+                    copy = message.copy(account_id=account_id, recipient=recipient)
+                copy.id = cursor.lastrowid
+                if deferred and len(recipients) > 1 and delivery_id is None:
+                    delivery_id = copy.id
+                messages.append(copy)
+            batch = self._request_commit()
+        self._wait_for_commit(batch)
+        self._notify(messages)
+        return messages
+
+    def create_email_message_batch(self, messages_data: List[Dict[str, Any]]) -> List[MessageRecord]:
+        """Create several messages with one lock acquisition, in one transaction.
+
+        Returns once they are committed.
+        """
+        messages = []
+        params_list = []
+        for message_data in messages_data:
+            message, shared, _ = self._new_message(
+                message_data, message_data["account_id"], message_data["recipient"]
+            )
+            messages.append(message)
+            params_list.append(
+                (message.account_id, message.sender, message.sender_email, message.recipient, *shared, None)
+            )
+        with self.lock:
+            message_ids = self._write_many(INSERT_MESSAGE, params_list)
+            batch = self._request_commit()
+        self._wait_for_commit(batch)
+        for message, message_id in zip(messages, message_ids):
+            message.id = message_id
+        self._notify(messages)
+        return messages
+
+    def mark_email_as_read(self, message_id: int) -> MessageRecord:
+        """Mark an email message as read."""
+        with self.lock:
+            message = self.get_email_message(message_id)
+            if not message:
+                raise ValueError(f"Email message with id {message_id} not found")
+
+            if not message.read:
+                self._write("UPDATE email_messages SET read = 1 WHERE id = ?", (message_id,))
+                message.read = True
+        return message
+
+    def delete_email_message(self, message_id: int) -> bool:
+        """Delete an email message."""
+        cursor = self._write("DELETE FROM email_messages WHERE id = ?", (message_id,))
+        return cursor.rowcount > 0
+
+    def get_raw_message(self, message_id: int) -> Optional[bytes]:
+        """Get the original RFC 822 bytes of a message, if they were kept."""
+        rows = self._query("SELECT raw FROM email_messages WHERE id = ?", (message_id,))
+        return rows[0]["raw"] if rows else None
+
+    def parse_pending_messages(self, limit: int = 100) -> int:
+        """Fully parse up to `limit` deferred messages, oldest first."""
+        rows = self._query("SELECT id FROM email_messages WHERE parsed = 0 ORDER BY id LIMIT ?", (limit,))
+        for row in rows:
+            self._complete_parse(row["id"])
+        return len(rows)
+
+    def reprocess_magic_links(self, batch_size: int = 500) -> int:
+        """Re-extract the stored magic links of every parsed message."""
+        count = 0
+        last_id = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT id, content, html_content FROM email_messages "
+                    "WHERE id > ? AND parsed = 1 ORDER BY id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+                for row in rows:
+                    magic_links = extract_message_magic_links(row["content"], row["html_content"])
+                    self._write(
+                        "UPDATE email_messages SET magic_links = ? WHERE id = ?",
+                        (json.dumps(magic_links), row["id"])
+                    )
+                self._commit()
+            if not rows:
+                return count
+            count += len(rows)
+            last_id = rows[-1]["id"]
+
+    def get_version(self, account_id: Optional[int] = None) -> Optional[int]:
+        """Get the version of an account's messages, or of the account list."""
+        rows = self._query("SELECT version FROM versions WHERE key = ?", (account_id or 0,))
+        return rows[0][0] if rows else None
+
+    def get_unread_count(self, account_id: int) -> int:
+        """Get the number of unread email messages for an account."""
+        rows = self._query(
+            "SELECT COUNT(*) FROM email_messages WHERE account_id = ? AND read = 0",
+            (account_id,)
+        )
+        return rows[0][0]
+
+    def _evict_oldest(self, where: str, params, batch_size: int,
+                      excess_count: float = 0, excess_size: int = 0) -> int:
+        """Delete the oldest messages matching `where`, one batch per transaction.
+
+        Deletes at least `excess_count` of them, and enough to free at least
+        `excess_size` bytes. Returns how many were deleted.
+        """
+        evicted = 0
+        freed = 0
+        while evicted < excess_count or freed < excess_size:
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT id, size FROM email_messages WHERE {where} "
+                    "ORDER BY received_at, id LIMIT ?",
+                    (*params, batch_size)
+                ).fetchall()
+                batch = []
+                for row in rows:
+                    if evicted + len(batch) >= excess_count and freed >= excess_size:
+                        break
+                    batch.append(row["id"])
+                    freed += row["size"]
+                if not batch:
+                    break
+                self._write(
+                    f"DELETE FROM email_messages WHERE id IN ({', '.join('?' * len(batch))})", batch
+                )
+                self._commit()
+            evicted += len(batch)
+        return evicted
+
+    def enforce_retention(self, policy: RetentionPolicy, batch_size: int = 1000) -> Dict[str, int]:
+        """Evict messages beyond the policy's limits, oldest first."""
+        evicted = dict.fromkeys(EVICTION_REASONS, 0)
+        if policy.max_age is not None:
+            cutoff = datetime.now() - timedelta(seconds=policy.max_age)
+            evicted["age"] = self._evict_oldest(
+                "received_at < ?", (cutoff.isoformat(timespec='microseconds'),), batch_size,
+                excess_count=math.inf
+            )
+
+        if policy.account_max_messages is not None or policy.account_max_bytes is not None:
+            max_messages = policy.account_max_messages
+            max_bytes = policy.account_max_bytes
+            conditions = []
+            params = []
+            if max_messages is not None:
+                conditions.append("message_count > ?")
+                params.append(max_messages)
+            if max_bytes is not None:
+                conditions.append("total_size > ?")
+                params.append(max_bytes)
+            rows = self._query(
+                "SELECT account_id, COUNT(*) AS message_count, SUM(size) AS total_size FROM email_messages "
+                f"GROUP BY account_id HAVING {' OR '.join(conditions)}",
+                params
+            )
+            for row in rows:
+                excess_count = max(row["message_count"] - max_messages, 0) if max_messages is not None else 0
+                excess_size = max(row["total_size"] - max_bytes, 0) if max_bytes is not None else 0
+                removed = self._evict_oldest(
+                    "account_id = ?", (row["account_id"],), batch_size, excess_count, excess_size
+                )
+                counted = min(removed, excess_count)
+                evicted["account_messages"] += counted
+                evicted["account_bytes"] += removed - counted
+
+        if policy.max_messages is not None:
+            total = self._query("SELECT COUNT(*) FROM email_messages")[0][0]
+            evicted["global_messages"] = self._evict_oldest(
+                "1", (), batch_size, excess_count=max(total - policy.max_messages, 0)
+            )
+
+        if policy.max_bytes is not None:
+            total = self._query("SELECT COALESCE(SUM(size), 0) FROM email_messages")[0][0]
+            evicted["global_bytes"] = self._evict_oldest(
+                "1", (), batch_size, excess_size=max(total - policy.max_bytes, 0)
+            )
+        return evicted
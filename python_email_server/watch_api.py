@@ -0,0 +1,139 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+
+from .api import (MESSAGE_JSON, SSE_KEEPALIVE_INTERVAL, WATCH_PATH, message_filter_from_args, sse_event,
+                  stream_args, wait_args)
+from .notifications import AsyncMessageWatch
+
+logger = logging.getLogger(__name__)
+
+
+class WatchApp:
+    """Serves the long-poll and event-stream routes on the event loop, for ASGIApp.
+
+    The Flask routes of init_routes hold a thread for as long as they wait.
+    Here each waiter is a coroutine awaiting its notifier subscription, so
+    any number of clients can wait at once and each is subscribed as soon
+    as its request is read. Storage is read on `executor`, the workers
+    serving the other routes. Parameters, responses and errors are those of
+    the Flask routes.
+    """
+
+    def __init__(self, storage, executor: Executor):
+        self.storage = storage
+        self.executor = executor
+
+    def handles(self, scope: Dict[str, Any]) -> bool:
+        return scope["method"] == "GET" and WATCH_PATH.fullmatch(scope["path"]) is not None
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        route = WATCH_PATH.fullmatch(scope["path"])
+        account_id = int(route.group(1))
+        args = MultiDict(parse_qsl(scope["query_string"].decode("utf-8", "replace"), keep_blank_values=True))
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        if route.group(2) == "wait":
+            handler = self._wait(account_id, args, send)
+        else:
+            handler = self._stream(account_id, args, headers.get("last-event-id"), send)
+
+        # Stop waiting as soon as the client goes away
+        loop = asyncio.get_running_loop()
+        tasks = (loop.create_task(handler), loop.create_task(wait_for_disconnect(receive)))
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _account_exists(self, account_id: int) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.storage.get_email_account, account_id) is not None
+
+    async def _wait(self, account_id: int, args: MultiDict, send: Callable) -> None:
+        """Long-poll for the next email matching the filter; see the Flask route."""
+        try:
+            if not await self._account_exists(account_id):
+                return await send_json(send, 404, {"error": "Account not found"})
+            try:
+                timeout, after_id = wait_args(args)
+            except ValueError as e:
+                return await send_json(send, 400, {"error": str(e)})
+
+            watch = AsyncMessageWatch(
+                self.storage, account_id, message_filter_from_args(args), self.executor,
+                after_id=after_id, deadline=time.monotonic() + timeout
+            )
+            try:
+                email = await anext(aiter(watch), None)
+            finally:
+                await watch.aclose()
+            if email is None:
+                return await send_response(send, 204, [], b"")
+            return await send_json(send, 200, MESSAGE_JSON.dumps(email))
+        except Exception as e:
+            logger.error(f"Error waiting for emails for account {account_id}: {e}")
+            return await send_json(send, 500, {"error": "Failed to wait for emails"})
+
+    async def _stream(self, account_id: int, args: MultiDict, last_event_id: Optional[str], send: Callable) -> None:
+        """Stream emails matching the filter as Server-Sent Events; see the Flask route."""
+        try:
+            if not await self._account_exists(account_id):
+                return await send_json(send, 404, {"error": "Account not found"})
+            try:
+                timeout, after_id = stream_args(args, last_event_id)
+            except ValueError as e:
+                return await send_json(send, 400, {"error": str(e)})
+
+            watch = AsyncMessageWatch(
+                self.storage, account_id, message_filter_from_args(args), self.executor,
+                after_id=after_id,
+                idle_timeout=SSE_KEEPALIVE_INTERVAL,
+                deadline=time.monotonic() + timeout if timeout is not None else None
+            )
+        except Exception as e:
+            logger.error(f"Error streaming emails for account {account_id}: {e}")
+            return await send_json(send, 500, {"error": "Failed to stream emails"})
+
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    (b"cache-control", b"no-cache"),
+                    # Ask nginx not to buffer the stream
+                    (b"x-accel-buffering", b"no")
+                ]
+            })
+            async for email in watch:
+                await send({"type": "http.response.body", "body": sse_event(email).encode(), "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await watch.aclose()
+
+
+async def wait_for_disconnect(receive: Callable) -> None:
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def send_response(send: Callable, status: int, headers: list, body: bytes) -> None:
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body, "more_body": False})
+
+
+async def send_json(send: Callable, status: int, data: Any) -> None:
+    """Send a JSON response: `data` as it is if bytes, else encoded as JSON."""
+    body = data if isinstance(data, bytes) else json.dumps(data).encode()
+    await send_response(send, status, [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode())
+    ], body)
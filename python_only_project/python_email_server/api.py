@@ -1,32 +1,190 @@
-from flask import Flask, request, jsonify
-from pydantic import ValidationError
+from flask import Flask, Response, request, jsonify, send_file
+from pydantic import TypeAdapter, ValidationError
+from typing import List
+import itertools
+import json
 import logging
+import os
+import re
+import time
 
-from .storage import storage
-from .models import CreateAccountRequest, CreateEmailRequest, EmailMessageWithMagicLinks
-from .email_parser import extract_magic_links
+from .storage import storage as default_storage
+from .models import CreateAccountRequest, CreateEmailRequest, EmailAccountResponse, EmailMessage, EmailMessageSummary
+from .notifications import MessageFilter, MessageWatch
+from .import_accounts import ACCOUNT_BATCH_SIZE, provision_accounts
+from .compression import gzip_concat
+from .serialization import ResponseSchema
 
 app = Flask(__name__)
 logger = logging.getLogger(__name__)
 
-def init_routes(app):
-    """Initialize API routes."""
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Seconds a long-poll waits for mail by default and at most
+DEFAULT_WAIT_TIMEOUT = 30
+MAX_WAIT_TIMEOUT = 300
+# Seconds between comments sent to keep an idle event stream open
+SSE_KEEPALIVE_INTERVAL = 15
+SSE_KEEPALIVE = ": keepalive\n\n"
+# Paths of the routes above, which hold a request open while they wait: the
+# account id and which route
+WATCH_PATH = re.compile(r'/api/accounts/(\d+)/emails/(wait|stream)')
+
+# Messages validated and stored together by the batch endpoint
+BATCH_CHUNK_SIZE = 1000
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+NDJSON_READ_SIZE = 64 * 1024
+
+# Items serialized per chunk of a streamed JSON array; shorter arrays are sent whole
+STREAM_CHUNK_SIZE = 200
+
+create_email_requests = TypeAdapter(List[CreateEmailRequest])
+
+# Responses are written from storage records by these, not through jsonify
+ACCOUNT_JSON = ResponseSchema(EmailAccountResponse, computed=("unread_count",))
+MESSAGE_JSON = ResponseSchema(EmailMessage)
+SUMMARY_JSON = ResponseSchema(EmailMessageSummary)
+
+def json_response(data, status=200):
+    """Send a body that is already JSON: bytes, or an iterable of byte chunks."""
+    return Response(data, status=status, mimetype='application/json')
+
+def json_array_response(schema, rows, count):
+    """Send `count` rows as a JSON array, streamed in chunks if it is long."""
+    if count <= STREAM_CHUNK_SIZE:
+        return json_response(schema.dumps_many(list(rows)))
+    return json_response(schema.stream_many(rows, STREAM_CHUNK_SIZE))
+
+def message_filter_from_args(args):
+    """Build a MessageFilter from the sender, subject, magic_link and keyword query parameters."""
+    return MessageFilter(
+        sender=args.get('sender'),
+        subject=args.get('subject'),
+        magic_link=args.get('magic_link', 'false').lower() == 'true',
+        link_keyword=args.get('keyword')
+    )
+
+def optional_arg(args, name, cast=int):
+    """Get a query parameter converted by `cast`, or None if it is not given.
+    
+    Raises ValueError if it cannot be converted; args.get(name, type=cast)
+    would return None, as if it had not been given.
+    """
+    value = args.get(name)
+    return cast(value) if value is not None else None
+
+def wait_args(args):
+    """Get the timeout and after_id of a long-poll.
+    
+    Raises ValueError with the error to send if they are not valid.
+    """
+    try:
+        timeout = float(args.get('timeout', DEFAULT_WAIT_TIMEOUT))
+        after_id = optional_arg(args, 'after_id')
+    except ValueError:
+        raise ValueError("timeout must be a number and after_id an integer")
+    if not 0 <= timeout <= MAX_WAIT_TIMEOUT:
+        raise ValueError(f"timeout must be between 0 and {MAX_WAIT_TIMEOUT}")
+    return timeout, after_id
+
+def stream_args(args, last_event_id):
+    """Get the timeout (or None) and after_id of an event stream.
+    
+    A reconnecting EventSource sends the id of the last event it received
+    as `last_event_id`, the Last-Event-ID header. Raises ValueError with the
+    error to send if they are not valid.
+    """
+    try:
+        timeout = optional_arg(args, 'timeout', float)
+        after_id = optional_arg(args, 'after_id')
+        if after_id is None and last_event_id:
+            after_id = int(last_event_id)
+    except ValueError:
+        raise ValueError("timeout must be a number and after_id and Last-Event-ID email ids")
+    return timeout, after_id
+
+def sse_event(email):
+    """Format an email as a Server-Sent Event, or a keepalive comment for None."""
+    if email is None:
+        return SSE_KEEPALIVE
+    return f"id: {email.id}\nevent: message\ndata: {MESSAGE_JSON.dumps(email).decode()}\n\n"
+
+def not_modified(version):
+    """Get a 304 response if the client's copy has this version, else None.
+    
+    Routes read the version before their data: a change made in between
+    leaves the response tagged older than it is, so it is fetched again,
+    never newer. Tags are compared weakly, as RFC 9110 has it for
+    If-None-Match, since proxies that compress responses weaken them.
+    """
+    if version is not None and request.if_none_match.contains_weak(str(version)):
+        return with_version(Response(status=304), version)
+    return None
+
+def with_version(response, version):
+    """Send a version as the response's ETag, revalidated on every use."""
+    if version is not None:
+        response.set_etag(str(version))
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def read_batch_items(req):
+    """Yield the items of a JSON array body, or of an NDJSON body line by line.
+    
+    Lines that are not valid JSON are yielded as ValueError instances so
+    they fail on their own. Raises ValueError if a JSON body is not an array.
+    """
+    if req.mimetype in NDJSON_MIMETYPES:
+        # Read the stream in blocks so a large body is never held in memory;
+        # reading it line by line is several times slower
+        pending = b""
+        while True:
+            block = req.stream.read(NDJSON_READ_SIZE)
+            lines = (pending + block).split(b"\n")
+            pending = lines.pop() if block else b""
+            for line in lines:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as e:
+                        yield ValueError(f"Invalid JSON: {e}")
+            if not block:
+                return
+    items = req.get_json(silent=True)
+    if not isinstance(items, list):
+        raise ValueError("Body must be a JSON array or NDJSON")
+    yield from items
+
+def validation_details(errors):
+    """Describe pydantic errors of one batch item, without the item's index."""
+    return "; ".join(
+        ".".join(str(part) for part in error['loc'][1:]) + ": " + error['msg'] if len(error['loc']) > 1 else error['msg']
+        for error in errors
+    )
+
+def init_routes(app, storage=default_storage, pipeline=None, sweeper=None):
+    """Initialize API routes backed by the given storage backend."""
     
     @app.route('/api/accounts', methods=['GET'])
     def get_accounts():
-        """Get all email accounts with unread counts."""
+        """Get all email accounts with unread counts, optionally filtered by domain."""
         try:
-            accounts = storage.get_email_accounts()
-            result = []
+            version = storage.get_version()
+            cached = not_modified(version)
+            if cached is not None:
+                return cached
             
-            for account in accounts:
-                account_dict = account.model_dump()
-                account_dict["unread_count"] = storage.get_unread_count(account.id)
-                # Don't send the password back to the client
-                account_dict.pop("password", None)
-                result.append(account_dict)
-                
-            return jsonify(result)
+            domain = request.args.get('domain')
+            if domain:
+                accounts = storage.get_email_accounts_by_domain(domain)
+            else:
+                accounts = storage.get_email_accounts()
+            rows = (
+                ACCOUNT_JSON.row(account, unread_count=storage.get_unread_count(account.id))
+                for account in accounts
+            )
+            return with_version(json_array_response(ACCOUNT_JSON, rows, len(accounts)), version)
         except Exception as e:
             logger.error(f"Error fetching accounts: {e}")
             return jsonify({"error": "Failed to fetch email accounts"}), 500
@@ -35,16 +193,17 @@ def init_routes(app):
     def get_account(account_id):
         """Get a specific email account."""
         try:
+            version = storage.get_version(account_id)
+            cached = not_modified(version)
+            if cached is not None:
+                return cached
+            
             account = storage.get_email_account(account_id)
             if not account:
                 return jsonify({"error": "Account not found"}), 404
                 
-            account_dict = account.model_dump()
-            account_dict["unread_count"] = storage.get_unread_count(account.id)
-            # Don't send the password back to the client
-            account_dict.pop("password", None)
-            
-            return jsonify(account_dict)
+            data = ACCOUNT_JSON.dumps(account, unread_count=storage.get_unread_count(account.id))
+            return with_version(json_response(data), version)
         except Exception as e:
             logger.error(f"Error fetching account {account_id}: {e}")
             return jsonify({"error": "Failed to fetch email account"}), 500
@@ -69,38 +228,273 @@ def init_routes(app):
                 "email": email,
                 "password": create_request.password
             }
-            account = storage.create_email_account(account_data)
-            
-            account_dict = account.model_dump()
-            account_dict["unread_count"] = 0
-            # Don't send the password back to the client
-            account_dict.pop("password", None)
+            try:
+                account = storage.create_email_account(account_data)
+            except ValueError:
+                # Created concurrently since the check above
+                return jsonify({"error": "Email address already exists"}), 409
             
-            return jsonify(account_dict), 201
+            return json_response(ACCOUNT_JSON.dumps(account, unread_count=0), 201)
         except ValidationError as e:
             return jsonify({"error": "Validation error", "details": str(e)}), 400
         except Exception as e:
             logger.error(f"Error creating account: {e}")
             return jsonify({"error": "Failed to create email account"}), 500
 
+    @app.route('/api/accounts/bulk', methods=['POST'])
+    def create_accounts():
+        """Create many email accounts from a JSON array or an NDJSON stream.
+        
+        Items are validated like a single account, without confirm_password,
+        and created a batch at a time. Returns a result per item, in order.
+        """
+        try:
+            results = []
+            items = read_batch_items(request)
+            while True:
+                batch = list(itertools.islice(items, ACCOUNT_BATCH_SIZE))
+                if not batch:
+                    break
+                for result in provision_accounts(storage, batch):
+                    item_result = {"index": len(results), "status": result["status"]}
+                    if result["status"] == 201:
+                        item_result["id"] = result["account"].id
+                        item_result["email"] = result["account"].email
+                    else:
+                        item_result["error"] = result["error"]
+                        if result.get("errors"):
+                            item_result["details"] = validation_details(result["errors"])
+                    results.append(item_result)
+            
+            created = sum(1 for result in results if result["status"] == 201)
+            return jsonify({"created": created, "failed": len(results) - created, "results": results})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error creating accounts in bulk: {e}")
+            return jsonify({"error": "Failed to create email accounts"}), 500
+
     @app.route('/api/accounts/<int:account_id>/emails', methods=['GET'])
     def get_emails(account_id):
         """Get all emails for an account."""
         try:
+            version = storage.get_version(account_id)
+            cached = not_modified(version)
+            if cached is not None:
+                return cached
+            
             account = storage.get_email_account(account_id)
             if not account:
                 return jsonify({"error": "Account not found"}), 404
                 
-            emails = storage.get_email_messages(account_id)
-            return jsonify([email.model_dump() for email in emails])
+            # Long listings are loaded chunk by chunk as they are sent
+            count, emails = storage.stream_email_messages(account_id)
+            rows = (MESSAGE_JSON.row(email) for email in emails)
+            return with_version(json_array_response(MESSAGE_JSON, rows, count), version)
         except Exception as e:
             logger.error(f"Error fetching emails for account {account_id}: {e}")
             return jsonify({"error": "Failed to fetch emails"}), 500
 
+    @app.route('/api/accounts/<int:account_id>/emails/summary', methods=['GET'])
+    def get_email_summaries(account_id):
+        """Get a page of email summaries for an account, newest first."""
+        try:
+            version = storage.get_version(account_id)
+            cached = not_modified(version)
+            if cached is not None:
+                return cached
+            
+            account = storage.get_email_account(account_id)
+            if not account:
+                return jsonify({"error": "Account not found"}), 404
+            
+            try:
+                limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+                before_id = optional_arg(request.args, 'before_id')
+                after_id = optional_arg(request.args, 'after_id')
+            except ValueError:
+                return jsonify({"error": "limit, before_id and after_id must be integers"}), 400
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+            if before_id is not None and after_id is not None:
+                return jsonify({"error": "Use either before_id or after_id, not both"}), 400
+            
+            # Fetch one extra message to know whether another page follows
+            emails = storage.get_email_message_page(account_id, limit + 1, before_id, after_id)
+            has_more = len(emails) > limit
+            if has_more:
+                emails = emails[1:] if after_id is not None else emails[:limit]
+            
+            # The cursor continues in the direction that was requested
+            if not emails:
+                next_cursor = after_id if after_id is not None else before_id
+            else:
+                next_cursor = emails[0].id if after_id is not None else emails[-1].id
+            
+            return with_version(json_response(SUMMARY_JSON.dumps_page(
+                emails,
+                has_more=has_more,
+                next_cursor=next_cursor
+            )), version)
+        except Exception as e:
+            logger.error(f"Error fetching email summaries for account {account_id}: {e}")
+            return jsonify({"error": "Failed to fetch emails"}), 500
+
+    @app.route('/api/accounts/<int:account_id>/emails/search', methods=['GET'])
+    def search_emails(account_id):
+        """Search an account's emails by subject, sender, recipient and body, best match first."""
+        try:
+            version = storage.get_version(account_id)
+            cached = not_modified(version)
+            if cached is not None:
+                return cached
+            
+            account = storage.get_email_account(account_id)
+            if not account:
+                return jsonify({"error": "Account not found"}), 404
+            
+            query = request.args.get('q', '').strip()
+            if not query:
+                return jsonify({"error": "q is required"}), 400
+            try:
+                limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+                offset = int(request.args.get('offset', 0))
+            except ValueError:
+                return jsonify({"error": "limit and offset must be integers"}), 400
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                return jsonify({"error": f"limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+            if offset < 0:
+                return jsonify({"error": "offset must not be negative"}), 400
+            
+            total, emails = storage.search_email_messages(account_id, query, limit, offset)
+            return with_version(json_response(SUMMARY_JSON.dumps_page(
+                emails,
+                total=total,
+                has_more=offset + len(emails) < total
+            )), version)
+        except Exception as e:
+            logger.error(f"Error searching emails for account {account_id}: {e}")
+            return jsonify({"error": "Failed to search emails"}), 500
+
+    @app.route('/api/accounts/<int:account_id>/emails/wait', methods=['GET'])
+    def wait_for_email(account_id):
+        """Long-poll for the next email matching the filter.
+        
+        Returns it as soon as it is delivered (or the first match stored after
+        `after_id`), or 204 No Content after `timeout` seconds.
+        """
+        try:
+            account = storage.get_email_account(account_id)
+            if not account:
+                return jsonify({"error": "Account not found"}), 404
+            
+            try:
+                timeout, after_id = wait_args(request.args)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            
+            with MessageWatch(
+                storage, account_id, message_filter_from_args(request.args),
+                after_id=after_id, deadline=time.monotonic() + timeout
+            ) as watch:
+                email = next(iter(watch), None)
+            if email is None:
+                return "", 204
+            return json_response(MESSAGE_JSON.dumps(email))
+        except Exception as e:
+            logger.error(f"Error waiting for emails for account {account_id}: {e}")
+            return jsonify({"error": "Failed to wait for emails"}), 500
+
+    @app.route('/api/accounts/<int:account_id>/emails/stream', methods=['GET'])
+    def stream_emails(account_id):
+        """Stream emails matching the filter as Server-Sent Events as they arrive.
+        
+        Each email is a `message` event whose id is the email id, so a
+        reconnecting EventSource resumes after the last one it received. The
+        stream ends after `timeout` seconds, if given.
+        """
+        try:
+            account = storage.get_email_account(account_id)
+            if not account:
+                return jsonify({"error": "Account not found"}), 404
+            
+            try:
+                timeout, after_id = stream_args(request.args, request.headers.get('Last-Event-ID'))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            
+            watch = MessageWatch(
+                storage, account_id, message_filter_from_args(request.args),
+                after_id=after_id,
+                idle_timeout=SSE_KEEPALIVE_INTERVAL,
+                deadline=time.monotonic() + timeout if timeout is not None else None
+            )
+        except Exception as e:
+            logger.error(f"Error streaming emails for account {account_id}: {e}")
+            return jsonify({"error": "Failed to stream emails"}), 500
+        
+        def events():
+            for email in watch:
+                yield sse_event(email)
+        
+        response = Response(events(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # Ask nginx not to buffer the stream
+        response.headers['X-Accel-Buffering'] = 'no'
+        # Unsubscribe when the client goes away, even before the first event
+        response.call_on_close(watch.close)
+        return response
+
+    @app.route('/api/addresses/<address>/magic-link', methods=['GET'])
+    def get_latest_magic_link(address):
+        """Get the magic links of the newest email to an address that has any.
+        
+        Optionally filtered by sender and by a keyword the link must contain.
+        The email is not marked as read.
+        """
+        try:
+            account = storage.get_email_account_by_email(address)
+            if not account:
+                return jsonify({"error": "Account not found"}), 404
+            
+            match = MessageFilter(sender=request.args.get('sender'), link_keyword=request.args.get('keyword'))
+            message = storage.get_latest_magic_link_message(account.id, match)
+            if message is None:
+                return jsonify({"error": "No magic link found"}), 404
+            
+            return jsonify({
+                "address": account.email,
+                "account_id": account.id,
+                "email_id": message.id,
+                "links": match.links(message),
+                "sender_email": message.sender_email,
+                "subject": message.subject,
+                "received_at": message.received_at
+            })
+        except Exception as e:
+            logger.error(f"Error fetching latest magic link for {address}: {e}")
+            return jsonify({"error": "Failed to fetch magic link"}), 500
+
     @app.route('/api/emails/<int:email_id>', methods=['GET'])
     def get_email(email_id):
-        """Get a specific email with magic links extracted."""
+        """Get a specific email with the magic links extracted at ingest.
+        
+        When the bodies are stored compressed and the client accepts gzip,
+        they are copied into a gzip response without being decompressed.
+        """
         try:
+            if request.accept_encodings['gzip']:
+                # Marks the email as read
+                stored = storage.get_compressed_message(email_id, mark_read=True)
+                if stored is not None:
+                    email, content, html_content = stored
+                    response = json_response(gzip_concat(
+                        MESSAGE_JSON.dumps_parts(email, content=content, html_content=html_content)
+                    ))
+                    response.headers['Content-Encoding'] = 'gzip'
+                    response.vary.add('Accept-Encoding')
+                    return response
+            
             email = storage.get_email_message(email_id)
             if not email:
                 return jsonify({"error": "Email not found"}), 404
@@ -108,20 +502,67 @@ def init_routes(app):
             # Mark email as read
             email = storage.mark_email_as_read(email_id)
             
-            # Extract magic links
-            content_to_check = email.html_content or email.content
-            magic_links = extract_magic_links(content_to_check)
-            
-            # Create EmailMessageWithMagicLinks
-            email_dict = email.model_dump()
-            email_dict["magic_links"] = magic_links
-            result = EmailMessageWithMagicLinks(**email_dict)
-            
-            return jsonify(result.model_dump())
+            response = json_response(MESSAGE_JSON.dumps(email))
+            response.vary.add('Accept-Encoding')
+            return response
         except Exception as e:
             logger.error(f"Error fetching email {email_id}: {e}")
             return jsonify({"error": "Failed to fetch email"}), 500
 
+    @app.route('/api/emails/<int:email_id>', methods=['DELETE'])
+    def delete_email(email_id):
+        """Delete an email."""
+        try:
+            if not storage.delete_email_message(email_id):
+                return jsonify({"error": "Email not found"}), 404
+            return '', 204
+        except Exception as e:
+            logger.error(f"Error deleting email {email_id}: {e}")
+            return jsonify({"error": "Failed to delete email"}), 500
+
+    @app.route('/api/emails/<int:email_id>/raw', methods=['GET'])
+    def get_raw_email(email_id):
+        """Get the original RFC 822 source of an email received over SMTP."""
+        try:
+            raw = storage.get_raw_message(email_id)
+            if raw is None:
+                return jsonify({"error": "Raw message not available"}), 404
+            return Response(raw, mimetype='message/rfc822')
+        except Exception as e:
+            logger.error(f"Error fetching raw email {email_id}: {e}")
+            return jsonify({"error": "Failed to fetch raw email"}), 500
+
+    @app.route('/api/emails/<int:email_id>/attachments/<int:index>', methods=['GET'])
+    def get_attachment(email_id, index):
+        """Download an attachment from the blob store."""
+        try:
+            if storage.blob_store is None:
+                return jsonify({"error": "Attachment storage is not enabled"}), 404
+            
+            email = storage.get_email_message(email_id)
+            if not email:
+                return jsonify({"error": "Email not found"}), 404
+            if not 0 <= index < len(email.attachments):
+                return jsonify({"error": "Attachment not found"}), 404
+            
+            attachment = email.attachments[index]
+            path = storage.blob_store.path(attachment["sha256"])
+            if not os.path.exists(path):
+                return jsonify({"error": "Attachment content not available"}), 404
+            
+            # Served from the file itself: the WSGI server's file wrapper (or
+            # X-Sendfile when USE_X_SENDFILE is set) can use sendfile
+            return send_file(
+                path,
+                mimetype=attachment["content_type"],
+                as_attachment=True,
+                download_name=attachment["filename"] or attachment["sha256"],
+                etag=attachment["sha256"]
+            )
+        except Exception as e:
+            logger.error(f"Error fetching attachment {index} of email {email_id}: {e}")
+            return jsonify({"error": "Failed to fetch attachment"}), 500
+
     @app.route('/api/simulate/receive-email', methods=['POST'])
     def simulate_receive_email():
         """Simulate receiving an email (for testing)."""
@@ -138,13 +579,118 @@ def init_routes(app):
             message_data = create_request.model_dump()
             message = storage.create_email_message(message_data)
             
-            return jsonify(message.model_dump()), 201
+            return json_response(MESSAGE_JSON.dumps(message), 201)
         except ValidationError as e:
             return jsonify({"error": "Validation error", "details": str(e)}), 400
         except Exception as e:
             logger.error(f"Error simulating email receipt: {e}")
             return jsonify({"error": "Failed to simulate email receipt"}), 500
             
+    def receive_email_chunk(items, first_index, accounts):
+        """Validate and store a chunk of batch items; returns one result per item.
+        
+        `accounts` caches whether each account id seen in the batch exists.
+        """
+        results = [None] * len(items)
+        errors = {}
+        for i, item in enumerate(items):
+            if isinstance(item, ValueError):
+                results[i] = {"index": first_index + i, "status": 400, "error": str(item)}
+        
+        # Validate the chunk in one call; only if some items fail are the
+        # rest validated again without them
+        candidates = [i for i, result in enumerate(results) if result is None]
+        try:
+            create_requests = create_email_requests.validate_python([items[i] for i in candidates])
+        except ValidationError as e:
+            for error in e.errors():
+                errors.setdefault(candidates[error['loc'][0]], []).append(error)
+            for i, item_errors in errors.items():
+                results[i] = {
+                    "index": first_index + i,
+                    "status": 400,
+                    "error": "Validation error",
+                    "details": validation_details(item_errors)
+                }
+            candidates = [i for i in candidates if i not in errors]
+            create_requests = create_email_requests.validate_python([items[i] for i in candidates])
+        
+        valid = []
+        messages_data = []
+        for i, create_request in zip(candidates, create_requests):
+            account_id = create_request.account_id
+            if account_id not in accounts:
+                accounts[account_id] = storage.get_email_account(account_id) is not None
+            if not accounts[account_id]:
+                results[i] = {"index": first_index + i, "status": 404, "error": "Account not found"}
+                continue
+            valid.append(i)
+            messages_data.append(create_request.model_dump())
+        
+        if messages_data:
+            for i, message in zip(valid, storage.create_email_message_batch(messages_data)):
+                results[i] = {"index": first_index + i, "status": 201, "id": message.id}
+        return results
+
+    @app.route('/api/simulate/receive-emails', methods=['POST'])
+    def simulate_receive_emails():
+        """Simulate receiving a batch of emails from a JSON array or an NDJSON stream.
+        
+        Each item is validated like a single simulated email; valid ones are
+        stored a chunk at a time. Returns a result per item, in order.
+        """
+        try:
+            results = []
+            accounts = {}
+            chunk = []
+            for item in read_batch_items(request):
+                chunk.append(item)
+                if len(chunk) == BATCH_CHUNK_SIZE:
+                    results.extend(receive_email_chunk(chunk, len(results), accounts))
+                    chunk = []
+            if chunk:
+                results.extend(receive_email_chunk(chunk, len(results), accounts))
+            
+            received = sum(1 for result in results if result["status"] == 201)
+            return jsonify({"received": received, "failed": len(results) - received, "results": results})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error simulating batch email receipt: {e}")
+            return jsonify({"error": "Failed to simulate email receipt"}), 500
+
+    @app.route('/api/admin/reprocess-magic-links', methods=['POST'])
+    def reprocess_magic_links():
+        """Re-extract the stored magic links of every email with the current rules."""
+        try:
+            count = storage.reprocess_magic_links()
+            return jsonify({"reprocessed": count})
+        except Exception as e:
+            logger.error(f"Error reprocessing magic links: {e}")
+            return jsonify({"error": "Failed to reprocess magic links"}), 500
+
+    @app.route('/api/storage/stats', methods=['GET'])
+    def get_storage_stats():
+        """Get message body deduplication statistics."""
+        stats = storage.get_body_stats()
+        if stats is None:
+            return jsonify({"enabled": False})
+        return jsonify({"enabled": True, **stats})
+
+    @app.route('/api/ingest/stats', methods=['GET'])
+    def get_ingest_stats():
+        """Get SMTP ingestion pipeline queue depth, counters and stage timings."""
+        if pipeline is None:
+            return jsonify({"enabled": False})
+        return jsonify({"enabled": True, **pipeline.stats()})
+
+    @app.route('/api/retention/stats', methods=['GET'])
+    def get_retention_stats():
+        """Get the retention policy, eviction counters and sweep timing."""
+        if sweeper is None:
+            return jsonify({"enabled": False})
+        return jsonify({"enabled": True, **sweeper.stats()})
+            
     # Add a simple static HTML page endpoint for testing
     @app.route('/static-email')
     def static_email():
@@ -0,0 +1,207 @@
+import asyncio
+import io
+import sys
+import threading
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional
+
+# Request body read on the event loop before the request is handed to a
+# worker thread; larger bodies stream to the app as it reads them
+PREFETCH_SIZE = 64 * 1024
+
+
+class RequestBody(io.RawIOBase):
+    """An ASGI request body as the WSGI input stream, read from a worker thread.
+
+    Starts with what was prefetched on the event loop; the rest is received
+    on demand, so a large upload (an NDJSON batch) streams through instead
+    of being buffered. `on_complete` is called once the whole body, or a
+    disconnect, has been received.
+    """
+
+    def __init__(self, receive: Callable, loop: asyncio.AbstractEventLoop, prefetched: bytes,
+                 more_body: bool, on_complete: Callable[[], None]):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = prefetched
+        self._offset = 0
+        self._more_body = more_body
+        self._on_complete = on_complete
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while self._offset == len(self._buffer) and self._more_body:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            self._buffer = message.get("body", b"")
+            self._offset = 0
+            self._more_body = message["type"] == "http.request" and message.get("more_body", False)
+            if not self._more_body:
+                self._loop.call_soon_threadsafe(self._on_complete)
+        count = min(len(b), len(self._buffer) - self._offset)
+        b[:count] = self._buffer[self._offset:self._offset + count]
+        self._offset += count
+        return count
+
+
+class ASGIApp:
+    """Serves a WSGI application, the Flask API, to an ASGI server.
+
+    Requests run on `executor`, whose size bounds how many are handled at
+    once, so the routes of init_routes are served unchanged while the event
+    loop only moves bytes. Requests that mostly sleep until mail arrives,
+    long-polls and event streams, would hold a worker each; `watch_app`, an
+    ASGI app with a handles(scope) method such as WatchApp, serves those it
+    handles on the loop instead. Response bodies are sent as the app yields
+    them, which keeps Server-Sent Events streaming; when the client
+    disconnects, the app's iterable is closed at its next chunk.
+    """
+
+    def __init__(self, wsgi_app: Callable, executor: Executor, watch_app: Optional[Any] = None):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+        self.watch_app = watch_app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+        if self.watch_app is not None and self.watch_app.handles(scope):
+            return await self.watch_app(scope, receive, send)
+
+        loop = asyncio.get_running_loop()
+        disconnected = threading.Event()
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher: List[asyncio.Task] = []
+
+        def body_complete():
+            watcher.append(loop.create_task(watch_disconnect()))
+
+        # Most bodies arrive whole with the request; read them here rather
+        # than with a round trip to the loop per chunk from the worker
+        prefetched = b""
+        more_body = True
+        while more_body and len(prefetched) < PREFETCH_SIZE:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            prefetched += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        body = RequestBody(receive, loop, prefetched, more_body, body_complete)
+        if not more_body:
+            body_complete()
+
+        try:
+            await loop.run_in_executor(
+                self.executor, self._run, environ_from_scope(scope, body), send, loop, disconnected
+            )
+        finally:
+            # Also stops a stream that outlives a server shutdown
+            disconnected.set()
+            for task in watcher:
+                task.cancel()
+
+    def _run(self, environ: Dict[str, Any], send: Callable, loop: asyncio.AbstractEventLoop,
+             disconnected: threading.Event) -> None:
+        """Call the WSGI app on a worker thread and send its response."""
+        response: List[Any] = []
+        started = False
+        remaining: Optional[int] = None
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info is not None and started:
+                raise exc_info[1].with_traceback(exc_info[2])
+            response[:] = [status, headers]
+            return write
+
+        def write(data: bytes, final: bool = False) -> None:
+            nonlocal started, remaining
+            messages = []
+            if not started:
+                started = True
+                status, headers = response
+                encoded = []
+                for name, value in headers:
+                    if name.lower() == "content-length":
+                        remaining = int(value)
+                    encoded.append((name.lower().encode("latin-1"), value.encode("latin-1")))
+                messages.append({
+                    "type": "http.response.start",
+                    "status": int(status.split(" ", 1)[0]),
+                    "headers": encoded
+                })
+            if remaining is not None:
+                remaining -= len(data)
+            # A body of known length is complete with its last byte, which
+            # saves another round trip to the loop to end it
+            more_body = not final and (remaining is None or remaining > 0)
+            messages.append({"type": "http.response.body", "body": data, "more_body": more_body})
+            asyncio.run_coroutine_threadsafe(send_all(send, messages), loop).result()
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            for data in result:
+                if disconnected.is_set():
+                    return
+                if data:
+                    write(data)
+            if not started or remaining is None or remaining > 0:
+                write(b"", final=True)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+
+async def send_all(send: Callable, messages: List[Dict[str, Any]]) -> None:
+    for message in messages:
+        await send(message)
+
+
+def environ_from_scope(scope: Dict[str, Any], body: RequestBody) -> Dict[str, Any]:
+    """Build the WSGI environ of an ASGI HTTP request."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BufferedReader(body),
+        # The body ends where the ASGI server says it does, chunked or not
+        "wsgi.input_terminated": True,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1")
+        if name == "content-type":
+            key = "CONTENT_TYPE"
+        elif name == "content-length":
+            key = "CONTENT_LENGTH"
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
@@ -0,0 +1,165 @@
+"""
+Create email accounts in bulk from a CSV or NDJSON file.
+
+CSV files need a header row with `username` and `domain` columns, or an
+`email` column, plus `password`; NDJSON files hold one object per line
+with the same keys. Addresses that already exist are skipped.
+
+Uses the storage backend configured by STORAGE_BACKEND. The in-memory
+backend only lives inside the running server, so for it set
+ACCOUNTS_IMPORT_FILE to import on startup, or use POST /api/accounts/bulk.
+
+Usage: python -m python_email_server.import_accounts FILE [--format csv|ndjson]
+       [--password DEFAULT] [--batch-size N]
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from pydantic import TypeAdapter, ValidationError
+
+from .models import ProvisionAccountRequest
+
+logger = logging.getLogger(__name__)
+
+# Accounts validated and created together
+ACCOUNT_BATCH_SIZE = 10_000
+
+provision_account_requests = TypeAdapter(List[ProvisionAccountRequest])
+
+
+def provision_accounts(storage, items: List[Any]) -> List[Dict[str, Any]]:
+    """Validate and create a batch of accounts; returns one result per item.
+
+    Items are account dicts as for ProvisionAccountRequest, or exceptions
+    for input that could not be read. A result has "status" 201 with the
+    "account", 400 with an "error" and pydantic "errors" if any, or 409 if
+    the address is already taken.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    for i, item in enumerate(items):
+        if isinstance(item, Exception):
+            results[i] = {"status": 400, "error": str(item), "errors": []}
+
+    # Validate the batch in one call; only if some items fail are the rest
+    # validated again without them
+    candidates = [i for i, result in enumerate(results) if result is None]
+    try:
+        create_requests = provision_account_requests.validate_python([items[i] for i in candidates])
+    except ValidationError as e:
+        errors: Dict[int, List[Dict[str, Any]]] = {}
+        for error in e.errors():
+            errors.setdefault(candidates[error["loc"][0]], []).append(error)
+        for i, item_errors in errors.items():
+            results[i] = {"status": 400, "error": "Validation error", "errors": item_errors}
+        candidates = [i for i in candidates if i not in errors]
+        create_requests = provision_account_requests.validate_python([items[i] for i in candidates])
+
+    accounts = storage.create_email_accounts([
+        {
+            "username": create_request.username,
+            "domain": create_request.domain,
+            "email": f"{create_request.username}@{create_request.domain}",
+            "password": create_request.password
+        }
+        for create_request in create_requests
+    ])
+    for i, account in zip(candidates, accounts):
+        if account is None:
+            results[i] = {"status": 409, "error": "Email address already exists"}
+        else:
+            results[i] = {"status": 201, "account": account}
+    return results
+
+
+def read_account_file(path: str, file_format: Optional[str] = None,
+                      default_password: Optional[str] = None) -> Iterator[Any]:
+    """Yield account dicts from a CSV or NDJSON file, as ProvisionAccountRequest takes them.
+
+    The format is taken from the file extension unless given. Lines that
+    are not valid JSON are yielded as ValueError instances.
+    """
+    if file_format is None:
+        file_format = "csv" if path.lower().endswith(".csv") else "ndjson"
+
+    with open(path, newline="" if file_format == "csv" else None, encoding="utf-8") as f:
+        if file_format == "csv":
+            rows: Iterable[Any] = csv.DictReader(f)
+        else:
+            rows = (_parse_line(line) for line in f if line.strip())
+        for row in rows:
+            if isinstance(row, dict):
+                if "email" in row and "username" not in row:
+                    row["username"], _, row["domain"] = row.pop("email").partition("@")
+                if not row.get("password") and default_password is not None:
+                    row["password"] = default_password
+            yield row
+
+
+def _parse_line(line: str) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return ValueError(f"Invalid JSON: {e}")
+
+
+def import_account_file(storage, path: str, file_format: Optional[str] = None,
+                        default_password: Optional[str] = None,
+                        batch_size: int = ACCOUNT_BATCH_SIZE) -> Dict[str, int]:
+    """Create the accounts of a CSV or NDJSON file. Returns counts by outcome."""
+    counts = {"created": 0, "duplicates": 0, "invalid": 0}
+    rows = read_account_file(path, file_format, default_password)
+    row = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return counts
+        for result in provision_accounts(storage, batch):
+            row += 1
+            if result["status"] == 201:
+                counts["created"] += 1
+            elif result["status"] == 409:
+                counts["duplicates"] += 1
+            else:
+                counts["invalid"] += 1
+                details = "; ".join(error["msg"] for error in result["errors"]) or result["error"]
+                logger.warning(f"Skipping invalid account in row {row} of {path}: {details}")
+
+
+def main():
+    """Import accounts into the configured storage backend."""
+    parser = argparse.ArgumentParser(description="Create email accounts in bulk from a CSV or NDJSON file.")
+    parser.add_argument("path", help="CSV or NDJSON file of accounts")
+    parser.add_argument("--format", choices=("csv", "ndjson"), help="file format (default: from the extension)")
+    parser.add_argument("--password", help="password for accounts that have none")
+    parser.add_argument("--batch-size", type=int, default=ACCOUNT_BATCH_SIZE, help="accounts created per batch")
+    args = parser.parse_args()
+
+    if os.getenv('STORAGE_BACKEND', 'memory').lower() == 'memory':
+        logger.error("The memory backend has no stored accounts outside the running server; "
+                     "set ACCOUNTS_IMPORT_FILE or use POST /api/accounts/bulk instead")
+        return 1
+
+    # Imported here so the API can use provision_accounts without a cycle
+    from .main import create_storage
+
+    storage = create_storage()
+    started = time.perf_counter()
+    try:
+        counts = import_account_file(storage, args.path, args.format, args.password, args.batch_size)
+    finally:
+        storage.close()
+    logger.info(f"Imported {counts['created']} accounts in {time.perf_counter() - started:.2f}s "
+                f"({counts['duplicates']} already existed, {counts['invalid']} invalid)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,19 @@
 import os
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask
 from dotenv import load_dotenv
 
 from .api import init_routes
 from .smtp_server import SMTPServer
+from .storage import Storage, storage as default_storage
+from .raw_store import RawMessageStore
+from .blob_store import BlobStore
+from .ingest import IngestionPipeline
+from .retention import RetentionPolicy, RetentionSweeper
+from .import_accounts import import_account_file
 
 # Configure logging
 logging.basicConfig(
@@ -16,38 +25,323 @@ logger = logging.getLogger(__name__)
 # Load environment variables
 load_dotenv()
 
-def create_app():
+def get_server_role():
+    """Get SERVER_ROLE: which part of the server this process runs.
+    
+    'all' (default) receives mail and serves the API. To serve the API from
+    several processes sharing a SQLite database, run one 'ingest' process,
+    which receives mail and runs the background parser and retention
+    sweeper, and any number of 'api' processes.
+    """
+    server_role = os.getenv('SERVER_ROLE', 'all').lower()
+    if server_role not in ('all', 'ingest', 'api'):
+        raise ValueError(f"Unknown SERVER_ROLE: {server_role}")
+    return server_role
+
+def create_storage(role=None):
+    """Create the storage backend selected by STORAGE_BACKEND (memory or sqlite).
+    
+    `role` is the server role of this process, by default SERVER_ROLE.
+    """
+    backend = os.getenv('STORAGE_BACKEND', 'memory').lower()
+    role = role or get_server_role()
+    
+    blob_store = None
+    attachment_dir = os.getenv('ATTACHMENT_STORE_DIR')
+    if attachment_dir:
+        logger.info(f"Storing attachments in {attachment_dir}")
+        blob_store = BlobStore(attachment_dir)
+    
+    if backend == 'memory':
+        if role != 'all':
+            raise ValueError(f"SERVER_ROLE={role} needs STORAGE_BACKEND=sqlite: "
+                             "in-memory storage cannot be shared between processes")
+        raw_store_dir = os.getenv('RAW_STORE_DIR')
+        compress_bodies = os.getenv('COMPRESS_BODIES', 'false').lower() == 'true'
+        if not raw_store_dir and blob_store is None and not compress_bodies:
+            return default_storage
+        
+        raw_store = None
+        if raw_store_dir:
+            logger.info(f"Keeping message bodies in raw store at {raw_store_dir}")
+            raw_store = RawMessageStore(
+                raw_store_dir,
+                segment_size=int(os.getenv('RAW_STORE_SEGMENT_MB', '64')) * 1024 * 1024
+            )
+        if compress_bodies:
+            logger.info("Keeping message bodies compressed")
+        return Storage(
+            raw_store=raw_store,
+            blob_store=blob_store,
+            compress_bodies=compress_bodies,
+            body_cache_size=int(os.getenv('BODY_CACHE_MB', '16')) * 1024 * 1024
+        )
+    if backend == 'sqlite':
+        from .sqlite_storage import SQLiteStorage
+        
+        path = os.getenv('SQLITE_PATH', 'openmail.db')
+        logger.info(f"Using SQLite storage at {path}")
+        if role == 'api':
+            # Commit each write at once rather than hold the write lock the
+            # ingest process needs, and watch for the mail it stores
+            return SQLiteStorage(
+                path,
+                commit_batch_size=1,
+                blob_store=blob_store,
+                watch_interval=float(os.getenv('SQLITE_WATCH_INTERVAL', '0.05'))
+            )
+        return SQLiteStorage(
+            path,
+            commit_interval=float(os.getenv('SQLITE_COMMIT_INTERVAL', '0.05')),
+            commit_batch_size=int(os.getenv('SQLITE_COMMIT_BATCH_SIZE', '100')),
+            blob_store=blob_store
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+def import_startup_accounts(storage):
+    """Create the accounts listed in ACCOUNTS_IMPORT_FILE (CSV or NDJSON), if set."""
+    path = os.getenv('ACCOUNTS_IMPORT_FILE')
+    if not path:
+        return None
+    
+    started = time.perf_counter()
+    counts = import_account_file(storage, path, default_password=os.getenv('ACCOUNTS_IMPORT_PASSWORD'))
+    logger.info(f"Imported {counts['created']} accounts from {path} in {time.perf_counter() - started:.2f}s "
+                f"({counts['duplicates']} already existed, {counts['invalid']} invalid)")
+    return counts
+
+def get_parse_mode():
+    """Get SMTP_PARSE_MODE: when incoming mail is fully parsed.
+    
+    'eager' (default) parses before accepting, 'lazy' defers it to the first
+    API access and 'background' also parses deferred messages in a
+    background thread.
+    """
+    parse_mode = os.getenv('SMTP_PARSE_MODE', 'eager').lower()
+    if parse_mode not in ('eager', 'lazy', 'background'):
+        raise ValueError(f"Unknown SMTP_PARSE_MODE: {parse_mode}")
+    return parse_mode
+
+def create_ingestion_pipeline(storage=None):
+    """Create the SMTP ingestion pipeline, or None if INGEST_WORKERS is 0."""
+    workers = int(os.getenv('INGEST_WORKERS', '0'))
+    if workers <= 0:
+        return None
+    
+    parse_processes = os.getenv('INGEST_PARSE_PROCESSES')
+    return IngestionPipeline(
+        storage or default_storage,
+        workers=workers,
+        queue_size=int(os.getenv('INGEST_QUEUE_SIZE', '1000')),
+        parse_processes=int(parse_processes) if parse_processes else None,
+        defer_parsing=get_parse_mode() != 'eager'
+    )
+
+def _optional_number(name, cast=int):
+    value = os.getenv(name)
+    return cast(value) if value else None
+
+def create_retention_sweeper(storage=None):
+    """Start the retention sweeper, or return None if no RETENTION_* limit is set."""
+    policy = RetentionPolicy(
+        max_messages=_optional_number('RETENTION_MAX_MESSAGES'),
+        max_bytes=_optional_number('RETENTION_MAX_BYTES'),
+        max_age=_optional_number('RETENTION_MAX_AGE', float),
+        account_max_messages=_optional_number('RETENTION_ACCOUNT_MAX_MESSAGES'),
+        account_max_bytes=_optional_number('RETENTION_ACCOUNT_MAX_BYTES')
+    )
+    if not policy.enabled:
+        return None
+    
+    sweeper = RetentionSweeper(
+        storage or default_storage,
+        policy,
+        interval=float(os.getenv('RETENTION_SWEEP_INTERVAL', '1.0')),
+        batch_size=int(os.getenv('RETENTION_SWEEP_BATCH_SIZE', '1000'))
+    )
+    sweeper.start()
+    return sweeper
+
+def create_app(storage=None, pipeline=None, sweeper=None):
     """Create and configure the Flask application."""
     app = Flask(__name__, static_folder='static')
+    # Let a fronting proxy (nginx, Apache) send attachment files itself
+    app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
     
     # Initialize API routes
-    init_routes(app)
+    init_routes(app, storage or default_storage, pipeline, sweeper)
     
     return app
 
-def start_smtp_server():
-    """Start the SMTP server."""
+def start_background_parser(storage, interval=0.5):
+    """Fully parse deferred messages in a background thread."""
+    def run():
+        while True:
+            try:
+                if not storage.parse_pending_messages():
+                    time.sleep(interval)
+            except Exception as e:
+                logger.error(f"Error parsing deferred messages: {e}")
+                time.sleep(interval)
+    
+    thread = threading.Thread(target=run, name="deferred-parser", daemon=True)
+    thread.start()
+    return thread
+
+def create_smtp_server(storage=None, pipeline=None, executor=None):
+    """Create the SMTP server configured by the SMTP_* variables, without starting it."""
     smtp_port = int(os.getenv('SMTP_PORT', '2525'))  # Use port 2525 instead of 25
     smtp_host = os.getenv('SMTP_HOST', '0.0.0.0')
     
-    smtp_server = SMTPServer(host=smtp_host, port=smtp_port)
+    return SMTPServer(
+        host=smtp_host,
+        port=smtp_port,
+        storage=storage or default_storage,
+        defer_parsing=get_parse_mode() != 'eager',
+        pipeline=pipeline,
+        executor=executor,
+        max_connections=_optional_number('SMTP_MAX_CONNECTIONS')
+    )
+
+def start_smtp_server(storage=None, pipeline=None):
+    """Start the SMTP server."""
+    storage = storage or default_storage
+    smtp_server = create_smtp_server(storage, pipeline)
     smtp_server.start()
     
+    if get_parse_mode() == 'background':
+        start_background_parser(storage)
+    
     return smtp_server
 
+def get_server_mode():
+    """Get SERVER_MODE: how the API and SMTP server are run.
+    
+    'development' (default) runs Flask's development server, with SMTP on
+    an event loop in a thread of its own. 'production' serves both from one
+    asyncio event loop, the API through Uvicorn.
+    """
+    server_mode = os.getenv('SERVER_MODE', 'development').lower()
+    if server_mode not in ('development', 'production'):
+        raise ValueError(f"Unknown SERVER_MODE: {server_mode}")
+    return server_mode
+
+def _http_options():
+    """Production mode settings for Uvicorn, from PORT and the HTTP_* variables."""
+    return {
+        "host": '0.0.0.0',
+        "port": int(os.getenv('PORT', '8000')),
+        "workers": _optional_number('HTTP_WORKERS'),
+        "max_connections": _optional_number('HTTP_MAX_CONNECTIONS'),
+        "backlog": int(os.getenv('HTTP_BACKLOG', '2048')),
+        "keepalive_timeout": float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '5'))
+    }
+
+def _create_production_smtp_server(storage, pipeline=None):
+    # SMTP sessions parse and store mail on these threads, or on the loop
+    # itself with SMTP_WORKERS=0
+    smtp_workers = int(os.getenv('SMTP_WORKERS', '4'))
+    smtp_executor = ThreadPoolExecutor(smtp_workers, thread_name_prefix="smtp") if smtp_workers > 0 else None
+    smtp_server = create_smtp_server(storage, pipeline, executor=smtp_executor)
+    if get_parse_mode() == 'background':
+        start_background_parser(storage)
+    return smtp_server
+
+def run_production_server(app, storage, pipeline=None):
+    """Serve the API and SMTP from one event loop until interrupted."""
+    # Uvicorn is only needed in production mode
+    from .serve import run
+    
+    smtp_server = _create_production_smtp_server(storage, pipeline)
+    run(app, smtp_server, storage=storage, **_http_options())
+    return smtp_server
+
+def run_ingest_server(storage, pipeline=None, api_processes=0):
+    """Receive mail until interrupted, with the API served by `api_processes` child processes."""
+    from .serve import run_ingest
+    
+    smtp_server = _create_production_smtp_server(storage, pipeline)
+    options = _http_options()
+    run_ingest(
+        smtp_server,
+        api_target=run_api_process,
+        api_processes=api_processes,
+        host=options["host"],
+        port=options["port"],
+        backlog=options["backlog"]
+    )
+    return smtp_server
+
+def run_api_process(sock=None):
+    """Serve the API from a database shared with an ingest process, until interrupted.
+    
+    The processes started for API_PROCESSES run this with the listening
+    socket they share.
+    """
+    storage = create_storage('api')
+    app = create_app(storage)
+    try:
+        if sock is not None or get_server_mode() == 'production':
+            from .serve import run
+            run(app, storage=storage, sock=sock, **_http_options())
+        else:
+            app.run(host='0.0.0.0', port=int(os.getenv('PORT', '8000')))
+    finally:
+        storage.close()
+    return app
+
 def main():
     """Main entry point for the application."""
+    role = get_server_role()
+    if role == 'api':
+        return run_api_process(), None
+    
+    # Serve the API from processes of its own, if configured
+    api_processes = int(os.getenv('API_PROCESSES', '1')) if role == 'all' else 0
+    if api_processes > 1 and get_server_mode() != 'production':
+        raise ValueError("API_PROCESSES needs SERVER_MODE=production")
+    ingest_only = role == 'ingest' or api_processes > 1
+    
+    # Select the storage backend
+    storage = create_storage('ingest' if ingest_only else role)
+    
+    # Create the accounts test environments expect, if configured
+    import_startup_accounts(storage)
+    
+    # Hand SMTP parsing and storage to worker pools, if configured
+    pipeline = create_ingestion_pipeline(storage)
+    
+    # Evict mail beyond the retention limits, if configured
+    sweeper = create_retention_sweeper(storage)
+    
+    if ingest_only:
+        try:
+            smtp_server = run_ingest_server(storage, pipeline, api_processes if api_processes > 1 else 0)
+        finally:
+            storage.close()
+        return None, smtp_server
+    
     # Create the Flask app
-    app = create_app()
+    app = create_app(storage, pipeline, sweeper)
+    
+    if get_server_mode() == 'production':
+        try:
+            smtp_server = run_production_server(app, storage, pipeline)
+        finally:
+            storage.close()
+        return app, smtp_server
     
     # Start the SMTP server
-    smtp_server = start_smtp_server()
+    smtp_server = start_smtp_server(storage, pipeline)
     
     # Get port from environment or use default
     port = int(os.getenv('PORT', '8000'))  # Use port 8000 which is less likely to be in use
     
     # Run the Flask app
-    app.run(host='0.0.0.0', port=port)
+    try:
+        app.run(host='0.0.0.0', port=port)
+    finally:
+        storage.close()
     
     return app, smtp_server
 
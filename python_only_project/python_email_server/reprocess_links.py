@@ -0,0 +1,38 @@
+"""
+Re-extract the stored magic links of every email after the keyword rules in
+email_parser.MAGIC_LINK_KEYWORDS change.
+
+Uses the storage backend configured by STORAGE_BACKEND. The in-memory
+backend only lives inside the running server, so for it use
+POST /api/admin/reprocess-magic-links instead.
+
+Usage: python -m python_email_server.reprocess_links
+"""
+
+import logging
+import os
+import sys
+
+from .main import create_storage
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    """Reprocess magic links in the configured storage backend."""
+    if os.getenv('STORAGE_BACKEND', 'memory').lower() == 'memory':
+        logger.error("The memory backend has no stored mail outside the running server; "
+                     "use POST /api/admin/reprocess-magic-links instead")
+        return 1
+    
+    storage = create_storage()
+    try:
+        count = storage.reprocess_magic_links()
+    finally:
+        storage.close()
+    logger.info(f"Reprocessed magic links of {count} emails")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,21 +1,36 @@
-from typing import Dict, List, Optional, Any
-from datetime import datetime
+import hashlib
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, Optional, Any, Tuple
+from datetime import datetime, timedelta
 
-from .models import EmailAccount, EmailMessage
+from .models import EmailAccount, MessageRecord
+from .email_parser import make_snippet, parse_email, message_fields, extract_message_magic_links
+from .raw_store import RawMessageStore
+from .compression import CompressedText, TextCache, compress_text
+from .blob_store import BlobStore
+from .notifications import MessageFilter, MessageNotifier
+from .retention import EVICTION_REASONS, RetentionPolicy
+from .search import SearchIndex, body_terms, message_terms, query_terms
 
 
-class Storage:
-    """In-memory storage for the email server."""
+def _normalize_email(email: str) -> str:
+    """Normalize an email address for case-insensitive lookups."""
+    return email.strip().lower()
+
+
+class StorageBackend(ABC):
+    """Interface implemented by every storage backend."""
+    
+    # Where attachment content is kept, if anywhere; messages only carry
+    # attachment metadata
+    blob_store: Optional[BlobStore] = None
+    # Wakes waiters when mail is delivered; every backend creates its own
+    notifier: MessageNotifier
     
-    def __init__(self):
-        self.email_accounts: Dict[int, EmailAccount] = {}
-        self.email_messages: Dict[int, EmailMessage] = {}
-        self.account_current_id = 1
-        self.message_current_id = 1
-        
-        # Create some initial accounts for demo purposes
-        self._seed_data()
-        
     def _seed_data(self):
         """Add some example email accounts."""
         accounts = [
@@ -42,6 +57,359 @@ class Storage:
         for account_data in accounts:
             self.create_email_account(account_data)
             
+    # Email Account Methods
+    @abstractmethod
+    def get_email_accounts(self) -> List[EmailAccount]:
+        """Get all email accounts."""
+    
+    @abstractmethod
+    def get_email_account(self, account_id: int) -> Optional[EmailAccount]:
+        """Get an email account by ID."""
+    
+    @abstractmethod
+    def get_email_account_by_email(self, email: str) -> Optional[EmailAccount]:
+        """Get an email account by email address (case-insensitive)."""
+    
+    @abstractmethod
+    def get_email_accounts_by_domain(self, domain: str) -> List[EmailAccount]:
+        """Get all email accounts for a domain."""
+    
+    @abstractmethod
+    def create_email_account(self, account_data: Dict[str, Any]) -> EmailAccount:
+        """Create a new email account.
+        
+        Raises ValueError if the email address is already taken.
+        """
+    
+    def create_email_accounts(self, accounts_data: List[Dict[str, Any]]) -> List[Optional[EmailAccount]]:
+        """Create several accounts, each as for `create_email_account`.
+        
+        Returns the new accounts in input order, with None for each address
+        that is already taken, including by an earlier item of the batch.
+        """
+        accounts = []
+        for account_data in accounts_data:
+            try:
+                accounts.append(self.create_email_account(account_data))
+            except ValueError:
+                accounts.append(None)
+        return accounts
+    
+    # Email Message Methods
+    @abstractmethod
+    def get_email_messages(self, account_id: int) -> List[MessageRecord]:
+        """Get all email messages for an account, newest first."""
+    
+    def stream_email_messages(self, account_id: int) -> Tuple[int, Iterable[MessageRecord]]:
+        """Get the number of an account's messages and the messages, newest first.
+        
+        Backends load them as the iterable is read, so a long listing can be
+        sent without holding every message, bodies included, at once.
+        Messages removed in the meantime are skipped, so the number is an
+        upper bound. By default they are all loaded with get_email_messages().
+        """
+        messages = self.get_email_messages(account_id)
+        return len(messages), messages
+    
+    @abstractmethod
+    def get_email_message_page(
+        self,
+        account_id: int,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None
+    ) -> List[MessageRecord]:
+        """Get up to `limit` messages for an account, newest first.
+        
+        With `before_id`, returns the messages immediately older than it; with
+        `after_id`, the messages immediately newer than it; otherwise the newest.
+        """
+    
+    @abstractmethod
+    def get_email_message(self, message_id: int) -> Optional[MessageRecord]:
+        """Get an email message by ID."""
+    
+    @abstractmethod
+    def get_latest_magic_link_message(
+        self,
+        account_id: int,
+        match: Optional[MessageFilter] = None
+    ) -> Optional[MessageRecord]:
+        """Get an account's newest message with magic links, optionally filtered.
+        
+        Served from an index maintained at ingest. Does not mark the message
+        as read.
+        """
+    
+    @abstractmethod
+    def search_email_messages(
+        self,
+        account_id: int,
+        query: str,
+        limit: int,
+        offset: int = 0
+    ) -> Tuple[int, List[MessageRecord]]:
+        """Search an account's messages by subject, sender, recipient and body.
+        
+        Messages must contain every word of the query. Returns the number of
+        matches and the requested page of them, best match first.
+        """
+    
+    @abstractmethod
+    def create_email_message(self, message_data: Dict[str, Any]) -> MessageRecord:
+        """Create a new email message.
+        
+        `message_data` may carry the original bytes under "raw". With
+        "deferred_parse" set, only the envelope and header fields are filled
+        in; the raw bytes are parsed on first access or by
+        `parse_pending_messages`, and the result is kept.
+        """
+    
+    def create_email_messages(
+        self,
+        message_data: Dict[str, Any],
+        recipients: List[Tuple[int, str]]
+    ) -> List[MessageRecord]:
+        """Deliver one message to several (account id, recipient address) pairs.
+        
+        `message_data` is as for `create_email_message`, without the account
+        and recipient. Returns the created messages in recipient order.
+        """
+        return [
+            self.create_email_message({**message_data, "account_id": account_id, "recipient": recipient})
+            for account_id, recipient in recipients
+        ]
+    
+    def create_email_message_batch(self, messages_data: List[Dict[str, Any]]) -> List[MessageRecord]:
+        """Create several messages, each as for `create_email_message`.
+        
+        Backends store a batch under one lock acquisition or transaction
+        where they can. Returns the created messages in input order.
+        """
+        return [self.create_email_message(message_data) for message_data in messages_data]
+    
+    @abstractmethod
+    def mark_email_as_read(self, message_id: int) -> MessageRecord:
+        """Mark an email message as read."""
+    
+    @abstractmethod
+    def delete_email_message(self, message_id: int) -> bool:
+        """Delete an email message. Returns False if it did not exist."""
+    
+    @abstractmethod
+    def get_unread_count(self, account_id: int) -> int:
+        """Get the number of unread email messages for an account."""
+    
+    def get_version(self, account_id: Optional[int] = None) -> Optional[int]:
+        """Get the version of an account's messages, or of the account list.
+        
+        Versions only increase: an account's changes when a message is
+        delivered to it, read or removed, and the account list's with any
+        change to any account (their unread counts are part of it). None if
+        the account does not exist or the backend keeps no versions.
+        """
+        return None
+    
+    @abstractmethod
+    def enforce_retention(self, policy: RetentionPolicy, batch_size: int = 1000) -> Dict[str, int]:
+        """Evict messages beyond the policy's limits, oldest first.
+        
+        Messages are evicted `batch_size` at a time until every limit is met.
+        Returns the number evicted for each of `EVICTION_REASONS`.
+        """
+    
+    def get_raw_message(self, message_id: int) -> Optional[bytes]:
+        """Get the original RFC 822 bytes of a message, if they were kept."""
+        return None
+    
+    def get_compressed_message(
+        self,
+        message_id: int,
+        mark_read: bool = False
+    ) -> Optional[Tuple[MessageRecord, CompressedText, Optional[CompressedText]]]:
+        """Get a message without its bodies, and its text and HTML bodies as stored compressed.
+        
+        With `mark_read` the message is marked as read first. None if the
+        message does not exist or its bodies are not stored compressed.
+        """
+        return None
+    
+    def get_body_stats(self) -> Optional[Dict[str, Any]]:
+        """Get body deduplication statistics, or None if bodies are not deduplicated."""
+        return None
+    
+    def parse_pending_messages(self, limit: int = 100) -> int:
+        """Fully parse up to `limit` deferred messages. Returns how many were parsed."""
+        return 0
+    
+    @abstractmethod
+    def reprocess_magic_links(self) -> int:
+        """Re-extract the stored magic links of every message. Returns the message count."""
+    
+    def flush(self) -> None:
+        """Make all pending writes durable. No-op for volatile backends."""
+    
+    def close(self) -> None:
+        """Flush and release any resources held by the backend."""
+        self.flush()
+
+
+LOCK_STRIPES = 64
+
+
+class InternedBody:
+    """A stored message body and the number of messages using it."""
+    
+    __slots__ = ("value", "size", "users")
+    
+    def __init__(self, value, size: int):
+        # The body string itself, its CompressedText, or its raw store
+        # record id
+        self.value = value
+        self.size = size
+        self.users = 0
+
+
+class Mailbox:
+    """Per-account message index, unread counter and total message size."""
+    
+    __slots__ = ("message_ids", "unread", "size", "link_ids", "unparsed", "version")
+    
+    def __init__(self):
+        # Message ids, oldest first. IDs are allocated in arrival order under
+        # the account's lock, so this list is also sorted by received_at.
+        self.message_ids: List[int] = []
+        self.unread = 0
+        self.size = 0
+        # Ids of the messages that have magic links, oldest first
+        self.link_ids: List[int] = []
+        # Messages whose parsing was deferred, so their links are not known yet
+        self.unparsed = 0
+        self.version = 0
+    
+    def index_links(self, message_id: int, has_links: bool) -> None:
+        """Add a message to or drop it from `link_ids`."""
+        i = bisect_left(self.link_ids, message_id)
+        present = i < len(self.link_ids) and self.link_ids[i] == message_id
+        if has_links and not present:
+            self.link_ids.insert(i, message_id)
+        elif present and not has_links:
+            del self.link_ids[i]
+
+
+class Storage(StorageBackend):
+    """In-memory storage for the email server.
+    
+    Safe for concurrent use by the SMTP and API threads. Each account's
+    mailbox is guarded by one of `LOCK_STRIPES` striped locks, so writers to
+    different accounts rarely contend; account creation takes a separate
+    lock. Shared dicts are only touched with single get/set/pop operations,
+    never iterated while other threads may write to them.
+    
+    Messages are kept as compact `MessageRecord` objects, not pydantic
+    models.
+    
+    With a `raw_store`, message bodies and original RFC 822 bytes are kept in
+    its mmap-backed segment files instead of the heap, and are loaded into the
+    returned messages on access.
+    
+    Bodies are interned: each distinct text or HTML body (and, in the raw
+    store, each distinct raw message) is stored once and reference-counted,
+    and freed with the last message using it. Copies of a message delivered
+    to several recipients also share their headers; only the id, account
+    and read flag are their own.
+    
+    With `compress_bodies`, text and HTML bodies on the heap are kept
+    deflated (see CompressedText) and decompressed on access, through an
+    LRU cache of `body_cache_size` characters of the most recently read
+    ones. get_compressed_message() hands out the compressed bodies for
+    responses that are compressed anyway. Bodies in the raw store are not
+    compressed.
+    
+    Versions are drawn from one counter, which starts at the current time in
+    microseconds so that a restarted server does not hand out the versions
+    of a previous run again.
+    """
+    
+    def __init__(
+        self,
+        raw_store: Optional[RawMessageStore] = None,
+        blob_store: Optional[BlobStore] = None,
+        compress_bodies: bool = False,
+        body_cache_size: int = 16 * 1024 * 1024
+    ):
+        if compress_bodies and raw_store is not None:
+            raise ValueError("Bodies kept in the raw store cannot be compressed")
+        self.email_accounts: Dict[int, EmailAccount] = {}
+        self.email_messages: Dict[int, MessageRecord] = {}
+        self.mailboxes: Dict[int, Mailbox] = {}
+        # Normalized address -> account id, and domain -> account ids
+        self.account_ids_by_email: Dict[str, int] = {}
+        self.account_ids_by_domain: Dict[str, List[int]] = {}
+        
+        self.account_lock = threading.Lock()
+        self.account_current_id = 1
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.id_lock = threading.Lock()
+        self.message_current_id = 1
+        self.version_lock = threading.Lock()
+        self.version = time.time_ns() // 1000
+        self.notifier = MessageNotifier()
+        self.search_index = SearchIndex()
+        # Every message id in arrival order, for evicting the oldest mail
+        # across all accounts. Deleted ids are skipped when they reach the
+        # front.
+        self.arrivals: deque = deque()
+        self.retention_lock = threading.Lock()
+        
+        # Interned bodies. On the heap they are keyed by the string itself;
+        # compressed or in the raw store, by the SHA-256 digest of their
+        # bytes, and messages refer to them through `body_refs`.
+        self.bodies: Dict[Any, InternedBody] = {}
+        self.body_lock = threading.Lock()
+        self.references = 0
+        self.referenced_bytes = 0
+        self.stored_bytes = 0
+        self.compress_bodies = compress_bodies
+        self.compressed_bytes = 0
+        self.body_cache = TextCache(body_cache_size) if compress_bodies else None
+        self.bodies_by_digest = compress_bodies or raw_store is not None
+        
+        # Message id -> body digests of (raw message, text, html)
+        self.raw_store = raw_store
+        self.body_refs: Dict[int, Tuple[Optional[bytes], bytes, Optional[bytes]]] = {}
+        # Deferred messages awaiting a full parse: message id -> raw bytes
+        # (or None when the raw store already holds them)
+        self.unparsed: Dict[int, Optional[bytes]] = {}
+        # Deferred message id -> ids of all copies delivered with it
+        self.deliveries: Dict[int, List[int]] = {}
+        self.blob_store = blob_store
+        
+        # Create some initial accounts for demo purposes
+        self._seed_data()
+    
+    def _lock_for(self, account_id: int) -> threading.Lock:
+        """Get the striped lock guarding an account's mailbox."""
+        return self.locks[account_id % LOCK_STRIPES]
+    
+    def _changed(self, *mailboxes: Mailbox) -> None:
+        """Advance the account list's version, and that of the given mailboxes to match.
+        
+        Called after the change is made, under the lock it was made with, so
+        a reader that sees the new version also sees the change.
+        """
+        with self.version_lock:
+            self.version += 1
+            for mailbox in mailboxes:
+                mailbox.version = self.version
+    
+    def _next_message_id(self, count: int = 1) -> int:
+        """Allocate `count` consecutive message ids and return the first."""
+        with self.id_lock:
+            message_id = self.message_current_id
+            self.message_current_id += count
+            return message_id
+        
     # Email Account Methods
     def get_email_accounts(self) -> List[EmailAccount]:
         """Get all email accounts."""
@@ -53,48 +421,501 @@ class Storage:
     
     def get_email_account_by_email(self, email: str) -> Optional[EmailAccount]:
         """Get an email account by email address."""
-        email = email.lower()
-        for account in self.email_accounts.values():
-            if account.email.lower() == email:
-                return account
-        return None
+        account_id = self.account_ids_by_email.get(_normalize_email(email))
+        if account_id is None:
+            return None
+        return self.email_accounts.get(account_id)
+    
+    def get_email_accounts_by_domain(self, domain: str) -> List[EmailAccount]:
+        """Get all email accounts for a domain."""
+        account_ids = list(self.account_ids_by_domain.get(domain.strip().lower(), []))
+        return [self.email_accounts[account_id] for account_id in account_ids]
     
     def create_email_account(self, account_data: Dict[str, Any]) -> EmailAccount:
-        """Create a new email account."""
-        account_id = self.account_current_id
-        self.account_current_id += 1
-        
-        account = EmailAccount(
-            id=account_id,
-            username=account_data["username"],
-            domain=account_data["domain"],
-            email=account_data["email"],
-            password=account_data["password"],
-            created_at=datetime.now()
-        )
+        """Create a new email account.
         
-        self.email_accounts[account_id] = account
+        Raises ValueError if the email address is already taken.
+        """
+        email = _normalize_email(account_data["email"])
+        with self.account_lock:
+            if email in self.account_ids_by_email:
+                raise ValueError(f"Email address {account_data['email']} already exists")
+            
+            account_id = self.account_current_id
+            self.account_current_id += 1
+            
+            account = EmailAccount(
+                id=account_id,
+                username=account_data["username"],
+                domain=account_data["domain"],
+                email=account_data["email"],
+                password=account_data["password"],
+                created_at=datetime.now()
+            )
+            
+            mailbox = self.mailboxes.setdefault(account_id, Mailbox())
+            self.email_accounts[account_id] = account
+            self.account_ids_by_email[email] = account_id
+            domain = email.rpartition("@")[2]
+            self.account_ids_by_domain.setdefault(domain, []).append(account_id)
+            self._changed(mailbox)
         return account
     
+    def create_email_accounts(self, accounts_data: List[Dict[str, Any]]) -> List[Optional[EmailAccount]]:
+        """Create several accounts under one lock acquisition.
+        
+        Duplicates are found with set lookups and the address and domain
+        indexes are updated once for the whole batch.
+        """
+        created_at = datetime.now()
+        emails = [_normalize_email(account_data["email"]) for account_data in accounts_data]
+        results: List[Optional[EmailAccount]] = []
+        with self.account_lock:
+            taken = self.account_ids_by_email.keys()
+            new_ids: Dict[str, int] = {}
+            new_accounts: Dict[int, EmailAccount] = {}
+            ids_by_domain: Dict[str, List[int]] = {}
+            account_id = self.account_current_id
+            for account_data, email in zip(accounts_data, emails):
+                if email in taken or email in new_ids:
+                    results.append(None)
+                    continue
+                # Skip revalidating plain values, the main cost of a large batch
+                account = EmailAccount.model_construct(
+                    id=account_id,
+                    username=account_data["username"],
+                    domain=account_data["domain"],
+                    email=account_data["email"],
+                    password=account_data["password"],
+                    created_at=created_at
+                )
+                new_ids[email] = account_id
+                new_accounts[account_id] = account
+                ids_by_domain.setdefault(email.rpartition("@")[2], []).append(account_id)
+                results.append(account)
+                account_id += 1
+            
+            self.account_current_id = account_id
+            mailboxes = [self.mailboxes.setdefault(new_id, Mailbox()) for new_id in new_accounts]
+            self.email_accounts.update(new_accounts)
+            self.account_ids_by_email.update(new_ids)
+            for domain, domain_ids in ids_by_domain.items():
+                self.account_ids_by_domain.setdefault(domain, []).extend(domain_ids)
+            if new_accounts:
+                self._changed(*mailboxes)
+        return results
+    
     # Email Message Methods
-    def get_email_messages(self, account_id: int) -> List[EmailMessage]:
+    def _message_ids(self, account_id: int) -> List[int]:
+        """Snapshot an account's message ids, oldest first."""
+        mailbox = self.mailboxes.get(account_id)
+        if mailbox is None:
+            return []
+        with self._lock_for(account_id):
+            return list(mailbox.message_ids)
+    
+    def _load_messages(self, message_ids) -> List[MessageRecord]:
+        """Load messages by id, skipping any deleted in the meantime."""
+        return list(self._iter_messages(message_ids))
+    
+    def _iter_messages(self, message_ids) -> Iterator[MessageRecord]:
+        """Load messages by id as they are iterated, skipping any deleted in the meantime."""
+        for message_id in message_ids:
+            message = self.email_messages.get(message_id)
+            if message is not None:
+                yield self._load_body(message)
+    
+    def get_email_messages(self, account_id: int) -> List[MessageRecord]:
         """Get all email messages for an account."""
-        messages = [
-            msg for msg in self.email_messages.values()
-            if msg.account_id == account_id
-        ]
-        # Sort by received_at, newest first
-        return sorted(messages, key=lambda x: x.received_at, reverse=True)
+        # Newest first
+        return self._load_messages(reversed(self._message_ids(account_id)))
     
-    def get_email_message(self, message_id: int) -> Optional[EmailMessage]:
+    def stream_email_messages(self, account_id: int) -> Tuple[int, Iterable[MessageRecord]]:
+        """Get the number of an account's messages and the messages, newest first.
+        
+        The ids are read up front; each message's bodies are read back from
+        the raw store or decompressed only when the iterable reaches it.
+        """
+        message_ids = self._message_ids(account_id)
+        return len(message_ids), self._iter_messages(reversed(message_ids))
+    
+    def get_email_message_page(
+        self,
+        account_id: int,
+        limit: int,
+        before_id: Optional[int] = None,
+        after_id: Optional[int] = None
+    ) -> List[MessageRecord]:
+        """Get up to `limit` messages for an account, newest first."""
+        mailbox = self.mailboxes.get(account_id)
+        if mailbox is None:
+            return []
+        with self._lock_for(account_id):
+            message_ids = mailbox.message_ids
+            if after_id is not None:
+                start = bisect_right(message_ids, after_id)
+                end = min(start + limit, len(message_ids))
+            else:
+                end = len(message_ids) if before_id is None else bisect_left(message_ids, before_id)
+                start = max(end - limit, 0)
+            page_ids = message_ids[start:end]
+        return self._load_messages(reversed(page_ids))
+    
+    def get_email_message(self, message_id: int) -> Optional[MessageRecord]:
         """Get an email message by ID."""
-        return self.email_messages.get(message_id)
+        message = self.email_messages.get(message_id)
+        return self._load_body(message) if message else None
+    
+    def get_latest_magic_link_message(
+        self,
+        account_id: int,
+        match: Optional[MessageFilter] = None
+    ) -> Optional[MessageRecord]:
+        """Get an account's newest message with magic links, optionally filtered.
+        
+        Without a filter this is the last entry of the mailbox's link index;
+        with one, the index is walked from the newest entry.
+        """
+        mailbox = self.mailboxes.get(account_id)
+        if mailbox is None:
+            return None
+        # Links of deferred messages are only known once they are parsed
+        self._complete_account_parses(account_id, mailbox)
+        
+        with self._lock_for(account_id):
+            for message_id in reversed(mailbox.link_ids):
+                message = self.email_messages[message_id]
+                if match is None or match(message):
+                    break
+            else:
+                return None
+        return self._load_body(message)
+    
+    def search_email_messages(
+        self,
+        account_id: int,
+        query: str,
+        limit: int,
+        offset: int = 0
+    ) -> Tuple[int, List[MessageRecord]]:
+        """Search an account's messages, best match first.
+        
+        Bodies of messages whose parsing was deferred are only indexed once
+        they have been parsed, so the account's are parsed first.
+        """
+        terms = query_terms(query)
+        mailbox = self.mailboxes.get(account_id)
+        if mailbox is None or not terms:
+            return 0, []
+        self._complete_account_parses(account_id, mailbox)
+        with self._lock_for(account_id):
+            total, message_ids = self.search_index.search(
+                account_id, terms, len(mailbox.message_ids), limit, offset
+            )
+        return total, self._load_messages(message_ids)
+    
+    def _complete_account_parses(self, account_id: int, mailbox: Mailbox) -> None:
+        """Fully parse an account's deferred messages, newest first."""
+        if not mailbox.unparsed:
+            return
+        with self._lock_for(account_id):
+            pending = []
+            for message_id in reversed(mailbox.message_ids):
+                if len(pending) == mailbox.unparsed:
+                    break
+                if message_id in self.unparsed:
+                    pending.append(message_id)
+        for message_id in pending:
+            self._complete_parse(message_id)
+    
+    def _indexed_terms(self, message: MessageRecord) -> Dict[str, int]:
+        """Get the terms a stored message is indexed under."""
+        content, html_content = message.content, message.html_content
+        refs = self.body_refs.get(message.id)
+        if refs is not None:
+            # Mostly called for mail being removed, which need not be cached
+            content = self._read_text(refs[1], keep=False) or ""
+            html_content = self._read_text(refs[2], keep=False) if refs[2] is not None else None
+        return message_terms(message, body_terms(content, html_content))
+    
+    def _load_body(self, message: MessageRecord) -> MessageRecord:
+        """Return the message with its bodies read back from the raw store."""
+        if message.id in self.unparsed:
+            self._complete_parse(message.id)
+        refs = self.body_refs.get(message.id)
+        if refs is None:
+            return message
+        _, text_key, html_key = refs
+        text = self._read_text(text_key)
+        html = self._read_text(html_key) if html_key is not None else None
+        if text is None:
+            # Deleted while we were reading it
+            return message
+        return message.copy(content=text, html_content=html)
+    
+    def get_raw_message(self, message_id: int) -> Optional[bytes]:
+        """Get the original RFC 822 bytes of a message, if they were kept."""
+        raw = self.unparsed.get(message_id)
+        if raw is not None:
+            return raw
+        refs = self.body_refs.get(message_id)
+        if refs is None or refs[0] is None:
+            return None
+        return self._read_body(refs[0])
+    
+    def get_compressed_message(
+        self,
+        message_id: int,
+        mark_read: bool = False
+    ) -> Optional[Tuple[MessageRecord, CompressedText, Optional[CompressedText]]]:
+        """Get a message without its bodies, and its text and HTML bodies as stored compressed.
+        
+        With `mark_read` the message is marked as read first. None if the
+        message does not exist, bodies are not compressed or it has not
+        been parsed yet.
+        """
+        if not self.compress_bodies:
+            return None
+        message = self.email_messages.get(message_id)
+        if message is None or message_id in self.unparsed:
+            return None
+        refs = self.body_refs.get(message_id)
+        if refs is None:
+            return None
+        _, text_key, html_key = refs
+        text = self.bodies.get(text_key)
+        html = self.bodies.get(html_key) if html_key is not None else None
+        if text is None or (html_key is not None and html is None):
+            # Deleted while we were reading it
+            return None
+        if mark_read:
+            self._mark_read(message)
+        return message, text.value, html.value if html is not None else None
+    
+    # Body interning
+    def _read_body(self, digest: bytes) -> Optional[bytes]:
+        """Read an interned body from the raw store, or None if it was freed."""
+        body = self.bodies.get(digest)
+        return self.raw_store.read(body.value) if body is not None else None
+    
+    def _read_text(self, digest: bytes, keep: bool = True) -> Optional[str]:
+        """Read an interned text or HTML body by digest, or None if it was freed.
+        
+        Compressed bodies go through the cache; with `keep` false, one that
+        was not cached is not added.
+        """
+        body = self.bodies.get(digest)
+        if body is None:
+            return None
+        if self.raw_store is not None:
+            # None if it was freed after our lookup
+            data = self.raw_store.read(body.value)
+            return data.decode("utf-8") if data is not None else None
+        return self.body_cache.get(digest, body.value, keep)
+    
+    def _intern(self, body, users: int = 1):
+        """Store a body once per distinct content, counting `users` more users.
+        
+        Returns the key messages refer to it by: the SHA-256 digest for raw
+        store and compressed bodies, the shared string for other heap ones.
+        """
+        if body is None:
+            return None
+        if not self.bodies_by_digest:
+            key = data = body
+        else:
+            data = body if isinstance(body, bytes) else body.encode("utf-8")
+            key = hashlib.sha256(data).digest()
+        
+        with self.body_lock:
+            interned = self.bodies.get(key)
+            if interned is not None:
+                interned.users += users
+                self.references += users
+                self.referenced_bytes += interned.size * users
+                return key if self.bodies_by_digest else interned.value
+        
+        # Write to the raw store or compress without holding the lock; if
+        # another thread stores the same body meanwhile, keep its copy and
+        # drop this one
+        if self.raw_store is not None:
+            value = self.raw_store.append(data)
+        elif self.compress_bodies:
+            value = compress_text(body)
+        else:
+            value = body
+        with self.body_lock:
+            interned = self.bodies.get(key)
+            if interned is None:
+                interned = self.bodies[key] = InternedBody(value, len(data))
+                self.stored_bytes += interned.size
+                if self.compress_bodies:
+                    self.compressed_bytes += len(value.data)
+                value = None
+            interned.users += users
+            self.references += users
+            self.referenced_bytes += interned.size * users
+        if value is not None and self.raw_store is not None:
+            self.raw_store.delete(value)
+        return key if self.bodies_by_digest else interned.value
+    
+    def _acquire(self, keys, users: int = 1) -> None:
+        """Count `users` more users of already interned bodies."""
+        with self.body_lock:
+            for key in keys:
+                if key is not None:
+                    interned = self.bodies[key]
+                    interned.users += users
+                    self.references += users
+                    self.referenced_bytes += interned.size * users
+    
+    def _release(self, keys) -> None:
+        """Drop one user of interned bodies, freeing those left unused."""
+        freed = []
+        with self.body_lock:
+            for key in keys:
+                if key is None:
+                    continue
+                interned = self.bodies[key]
+                interned.users -= 1
+                self.references -= 1
+                self.referenced_bytes -= interned.size
+                if not interned.users:
+                    del self.bodies[key]
+                    self.stored_bytes -= interned.size
+                    if self.compress_bodies:
+                        self.compressed_bytes -= len(interned.value.data)
+                        self.body_cache.discard(key)
+                    freed.append(interned.value)
+        if self.raw_store is not None:
+            for record_id in freed:
+                self.raw_store.delete(record_id)
     
-    def create_email_message(self, message_data: Dict[str, Any]) -> EmailMessage:
+    def get_body_stats(self) -> Dict[str, Any]:
+        """Get the number and size of distinct stored bodies versus referenced ones.
+        
+        With compression, also the compressed size of the distinct bodies
+        and the decompressed body cache's use.
+        """
+        with self.body_lock:
+            stats = {
+                "bodies": len(self.bodies),
+                "references": self.references,
+                "stored_bytes": self.stored_bytes,
+                "referenced_bytes": self.referenced_bytes,
+                "saved_bytes": self.referenced_bytes - self.stored_bytes,
+                "dedup_ratio": self.referenced_bytes / self.stored_bytes if self.stored_bytes else 1.0
+            }
+            if self.compress_bodies:
+                stats["compressed_bytes"] = self.compressed_bytes
+                stats["compression_ratio"] = (
+                    self.stored_bytes / self.compressed_bytes if self.compressed_bytes else 1.0
+                )
+        if self.compress_bodies:
+            stats["cache"] = self.body_cache.stats()
+        return stats
+    
+    def _complete_parse(self, message_id: int) -> None:
+        """Fully parse a deferred message and store the result.
+        
+        Copies delivered to other recipients along with it get the same
+        result, so a delivery is only parsed once.
+        """
+        if message_id not in self.unparsed:
+            return
+        message = self.email_messages.get(message_id)
+        raw = self.get_raw_message(message_id)
+        refs = self.body_refs.get(message_id)
+        if message is None or raw is None or (self.bodies_by_digest and refs is None):
+            return
+        
+        # Parse without holding a lock; if another thread gets there
+        # first, its result wins and this one is discarded.
+        fields = message_fields(parse_email(raw, self.blob_store))
+        fields["attachments"] = tuple(fields["attachments"])
+        content = fields.pop("content")
+        html_content = fields.pop("html_content")
+        fields["snippet"] = make_snippet(content, html_content)
+        fields["magic_links"] = tuple(extract_message_magic_links(content, html_content))
+        
+        terms = body_terms(content, html_content)
+        
+        # The new bodies are held while they are installed on the copies
+        held = (self._intern(content), self._intern(html_content))
+        if self.bodies_by_digest:
+            new_keys = (refs[0], *held)
+        else:
+            new_keys = held
+            fields["content"], fields["html_content"] = held
+        
+        for copy_id in list(self.deliveries.get(message_id, [message_id])):
+            copy = self.email_messages.get(copy_id)
+            if copy is None:
+                continue
+            with self._lock_for(copy.account_id):
+                if self.unparsed.pop(copy_id, False) is False:
+                    continue
+                self.deliveries.pop(copy_id, None)
+                self._acquire(new_keys)
+                if self.bodies_by_digest:
+                    old_keys = self.body_refs[copy_id]
+                    self.body_refs[copy_id] = new_keys
+                else:
+                    old_keys = (copy.content, copy.html_content)
+                for name, value in fields.items():
+                    setattr(copy, name, value)
+                self.search_index.add(copy.account_id, copy_id, terms)
+                mailbox = self.mailboxes[copy.account_id]
+                mailbox.unparsed -= 1
+                mailbox.index_links(copy_id, bool(copy.magic_links))
+            self._release(old_keys)
+        self._release(held)
+    
+    def parse_pending_messages(self, limit: int = 100) -> int:
+        """Fully parse up to `limit` deferred messages, oldest first."""
+        message_ids = list(self.unparsed)[:limit]
+        for message_id in message_ids:
+            self._complete_parse(message_id)
+        return len(message_ids)
+    
+    def reprocess_magic_links(self) -> int:
+        """Re-extract the stored magic links of every message."""
+        count = 0
+        for message_id in list(self.email_messages):
+            message = self.email_messages.get(message_id)
+            if message is None:
+                continue
+            body = self._load_body(message)
+            magic_links = tuple(extract_message_magic_links(body.content, body.html_content))
+            with self._lock_for(message.account_id):
+                if message_id not in self.email_messages:
+                    continue
+                if magic_links != message.magic_links:
+                    message.magic_links = magic_links
+                    mailbox = self.mailboxes[message.account_id]
+                    mailbox.index_links(message_id, bool(magic_links))
+                    self._changed(mailbox)
+            count += 1
+        return count
+    
+    def create_email_message(self, message_data: Dict[str, Any]) -> MessageRecord:
         """Create a new email message."""
-        message_id = self.message_current_id
-        self.message_current_id += 1
+        recipient = (message_data["account_id"], message_data["recipient"])
+        return self.create_email_messages(message_data, [recipient])[0]
+    
+    def _prepare_message(
+        self,
+        message_data: Dict[str, Any],
+        account_id: int,
+        recipient: str,
+        users: int
+    ) -> Tuple[MessageRecord, MessageRecord, Optional[tuple], Optional[Dict[str, int]]]:
+        """Build a message record and intern its bodies for `users` deliveries.
         
+        Returns the record, the copy kept in `email_messages` (without bodies
+        when they live in the raw store), the body references held for it
+        and the terms of its body, which are None until a deferred parse.
+        """
         # Ensure html_content is string or None
         html_content = message_data.get("html_content")
         if html_content is None and "html_content" in message_data:
@@ -103,38 +924,345 @@ class Storage:
         # Ensure headers is a dict
         headers = message_data.get("headers", {})
         
-        message = EmailMessage(
-            id=message_id,
-            account_id=message_data["account_id"],
+        message = MessageRecord(
+            id=0,
+            account_id=account_id,
             sender=message_data["sender"],
             sender_email=message_data["sender_email"],
-            recipient=message_data["recipient"],
+            recipient=recipient,
             subject=message_data["subject"],
             content=message_data["content"],
             html_content=html_content,
+            snippet=make_snippet(message_data["content"], html_content),
+            magic_links=tuple(extract_message_magic_links(message_data["content"], html_content)),
+            attachments=tuple(message_data.get("attachments", ())),
             headers=headers,
-            received_at=datetime.now(),
             read=False
         )
         
-        self.email_messages[message_id] = message
-        return message
+        raw = message_data.get("raw")
+        deferred = bool(message_data.get("deferred_parse")) and raw is not None
+        if raw is not None:
+            message.size = len(raw)
+        else:
+            message.size = len(message.content) + len(html_content or "")
+        
+        body = body_terms(message.content, html_content) if not deferred else None
+        
+        stored = message
+        refs = None
+        if self.bodies_by_digest:
+            refs = (
+                self._intern(raw, users) if self.raw_store is not None else None,
+                self._intern(message.content, users),
+                self._intern(html_content, users)
+            )
+            stored = message.copy(content="", html_content=None)
+        else:
+            message.content = self._intern(message.content, users)
+            message.html_content = self._intern(html_content, users)
+        return message, stored, refs, body
+    
+    def _file_message(
+        self,
+        message: MessageRecord,
+        stored: MessageRecord,
+        refs: Optional[tuple],
+        body: Optional[Dict[str, int]],
+        raw: Optional[bytes]
+    ) -> None:
+        """Add a message with its id allocated to its mailbox and indexes.
+        
+        Called under the account's lock. `raw` is the source of a message
+        whose parsing was deferred.
+        """
+        message_id = message.id
+        mailbox = self.mailboxes[message.account_id]
+        if refs is not None:
+            self.body_refs[message_id] = refs
+        if body is None:
+            self.unparsed[message_id] = None if self.raw_store is not None else raw
+            mailbox.unparsed += 1
+        self.email_messages[message_id] = stored
+        self.search_index.add(message.account_id, message_id, message_terms(message, body))
+        mailbox.message_ids.append(message_id)
+        mailbox.unread += 1
+        mailbox.size += stored.size
+        if stored.magic_links:
+            mailbox.link_ids.append(message_id)
+        self.arrivals.append(message_id)
+        self._changed(mailbox)
+    
+    def create_email_messages(
+        self,
+        message_data: Dict[str, Any],
+        recipients: List[Tuple[int, str]]
+    ) -> List[MessageRecord]:
+        """Deliver one message to several accounts, sharing a single body."""
+        account_id, recipient = recipients[0]
+        message, stored, refs, body = self._prepare_message(message_data, account_id, recipient, len(recipients))
+        raw = message_data.get("raw")
+        
+        messages = []
+        delivery: List[int] = []
+        for account_id, recipient in recipients:
+            copy, stored_copy = message, stored
+            if messages:
+                # Shallow copies: the body strings and headers are shared
+                copy = message.copy(account_id=account_id, recipient=recipient)
+                stored_copy = copy if stored is message else stored.copy(account_id=account_id, recipient=recipient)
+            
+            self.mailboxes.setdefault(account_id, Mailbox())
+            with self._lock_for(account_id):
+                # Allocate the id and timestamp under the account's lock so the
+                # mailbox stays sorted by both
+                message_id = self._next_message_id()
+                copy.id = stored_copy.id = message_id
+                copy.received_at = stored_copy.received_at = datetime.now()
+                
+                if body is None and len(recipients) > 1:
+                    delivery.append(message_id)
+                    self.deliveries[message_id] = delivery
+                self._file_message(copy, stored_copy, refs, body, raw)
+            messages.append(copy)
+        self.notifier.notify(messages)
+        return messages
+    
+    def create_email_message_batch(self, messages_data: List[Dict[str, Any]]) -> List[MessageRecord]:
+        """Create several messages, taking each account lock they need once.
+        
+        Records are built and their bodies interned before any lock is
+        taken; then the messages are filed one lock stripe at a time, with
+        the ids of a stripe allocated in one block.
+        """
+        prepared = []
+        stripes: Dict[int, List[int]] = {}
+        for i, message_data in enumerate(messages_data):
+            account_id = message_data["account_id"]
+            prepared.append(self._prepare_message(message_data, account_id, message_data["recipient"], 1))
+            self.mailboxes.setdefault(account_id, Mailbox())
+            stripes.setdefault(account_id % LOCK_STRIPES, []).append(i)
+        
+        for stripe, indexes in stripes.items():
+            with self.locks[stripe]:
+                message_id = self._next_message_id(len(indexes))
+                received_at = datetime.now()
+                for i in indexes:
+                    message, stored, refs, body = prepared[i]
+                    message.id = stored.id = message_id
+                    message.received_at = stored.received_at = received_at
+                    self._file_message(message, stored, refs, body, messages_data[i].get("raw"))
+                    message_id += 1
+        
+        messages = [message for message, _, _, _ in prepared]
+        self.notifier.notify(messages)
+        return messages
     
-    def mark_email_as_read(self, message_id: int) -> EmailMessage:
+    def mark_email_as_read(self, message_id: int) -> MessageRecord:
         """Mark an email message as read."""
-        message = self.get_email_message(message_id)
+        message = self.email_messages.get(message_id)
         if not message:
             raise ValueError(f"Email message with id {message_id} not found")
         
-        message.read = True
-        return message
+        self._mark_read(message)
+        return self._load_body(message)
     
-    def get_unread_count(self, account_id: int) -> int:
-        """Get the number of unread email messages for an account."""
+    def _mark_read(self, message: MessageRecord) -> None:
+        with self._lock_for(message.account_id):
+            if not message.read and message.id in self.email_messages:
+                message.read = True
+                mailbox = self.mailboxes[message.account_id]
+                mailbox.unread -= 1
+                self._changed(mailbox)
+    
+    def delete_email_message(self, message_id: int) -> bool:
+        """Delete an email message."""
+        message = self.email_messages.get(message_id)
+        if message is None:
+            return False
+        return bool(self._remove_messages(message.account_id, [message_id]))
+    
+    def _remove_messages(self, account_id: int, message_ids: List[int]) -> int:
+        """Remove messages of one account under a single lock acquisition.
+        
+        Ids that no longer exist are skipped. Returns how many were removed.
+        """
+        removed = []
+        released = []
+        with self._lock_for(account_id):
+            mailbox = self.mailboxes[account_id]
+            for message_id in message_ids:
+                message = self.email_messages.pop(message_id, None)
+                if message is None:
+                    continue
+                removed.append(message_id)
+                self.search_index.remove(account_id, message_id, self._indexed_terms(message))
+                if not message.read:
+                    mailbox.unread -= 1
+                mailbox.size -= message.size
+                
+                if message_id in self.unparsed:
+                    del self.unparsed[message_id]
+                    mailbox.unparsed -= 1
+                self.deliveries.pop(message_id, None)
+                refs = self.body_refs.pop(message_id, None)
+                if not self.bodies_by_digest:
+                    refs = (message.content, message.html_content)
+                if refs is not None:
+                    released.append(refs)
+            
+            if len(removed) == 1:
+                del mailbox.message_ids[bisect_left(mailbox.message_ids, removed[0])]
+                mailbox.index_links(removed[0], False)
+            elif removed:
+                gone = set(removed)
+                mailbox.message_ids[:] = [
+                    message_id for message_id in mailbox.message_ids if message_id not in gone
+                ]
+                mailbox.link_ids[:] = [
+                    message_id for message_id in mailbox.link_ids if message_id not in gone
+                ]
+            if removed:
+                self._changed(mailbox)
+        
+        for refs in released:
+            self._release(refs)
+        return len(removed)
+    
+    def _evict(self, messages: List[MessageRecord]) -> int:
+        """Remove a batch of messages, taking each account's lock once."""
+        by_account: Dict[int, List[int]] = {}
+        for message in messages:
+            by_account.setdefault(message.account_id, []).append(message.id)
         return sum(
-            1 for msg in self.email_messages.values()
-            if msg.account_id == account_id and not msg.read
+            self._remove_messages(account_id, message_ids)
+            for account_id, message_ids in by_account.items()
         )
+    
+    def _evict_oldest(self, batch_size: int, should_evict) -> int:
+        """Evict the oldest messages across all accounts while `should_evict(message)` holds."""
+        evicted = 0
+        while True:
+            batch = []
+            while self.arrivals and len(batch) < batch_size:
+                message = self.email_messages.get(self.arrivals[0])
+                if message is not None:
+                    if not should_evict(message):
+                        break
+                    batch.append(message)
+                self.arrivals.popleft()
+            if not batch:
+                return evicted
+            evicted += self._evict(batch)
+    
+    def _evict_account(self, account_id: int, policy: RetentionPolicy, batch_size: int) -> Tuple[int, int]:
+        """Evict an account's oldest messages beyond the per-account limits.
+        
+        Returns the number evicted for the message limit and for the size limit.
+        """
+        by_count = by_size = 0
+        mailbox = self.mailboxes[account_id]
+        while True:
+            with self._lock_for(account_id):
+                excess_count = 0
+                if policy.account_max_messages is not None:
+                    excess_count = max(len(mailbox.message_ids) - policy.account_max_messages, 0)
+                excess_size = 0
+                if policy.account_max_bytes is not None:
+                    excess_size = max(mailbox.size - policy.account_max_bytes, 0)
+                
+                # Oldest first: enough to meet the count limit, then more
+                # until the size limit is met too
+                batch = []
+                freed = 0
+                for message_id in mailbox.message_ids:
+                    if len(batch) >= batch_size or (len(batch) >= excess_count and freed >= excess_size):
+                        break
+                    message = self.email_messages[message_id]
+                    batch.append(message_id)
+                    freed += message.size
+            if not batch:
+                return by_count, by_size
+            
+            removed = self._remove_messages(account_id, batch)
+            counted = min(removed, excess_count)
+            by_count += counted
+            by_size += removed - counted
+    
+    def enforce_retention(self, policy: RetentionPolicy, batch_size: int = 1000) -> Dict[str, int]:
+        """Evict messages beyond the policy's limits, oldest first."""
+        evicted = dict.fromkeys(EVICTION_REASONS, 0)
+        # One sweep at a time: the sweep is the only reader of `arrivals`
+        with self.retention_lock:
+            if policy.max_age is not None:
+                cutoff = datetime.now() - timedelta(seconds=policy.max_age)
+                evicted["age"] = self._evict_oldest(
+                    batch_size, lambda message: message.received_at < cutoff
+                )
+            
+            if policy.account_max_messages is not None or policy.account_max_bytes is not None:
+                for account_id, mailbox in list(self.mailboxes.items()):
+                    if (
+                        (policy.account_max_messages is not None
+                         and len(mailbox.message_ids) > policy.account_max_messages)
+                        or (policy.account_max_bytes is not None and mailbox.size > policy.account_max_bytes)
+                    ):
+                        by_count, by_size = self._evict_account(account_id, policy, batch_size)
+                        evicted["account_messages"] += by_count
+                        evicted["account_bytes"] += by_size
+            
+            if policy.max_messages is not None:
+                excess = [len(self.email_messages) - policy.max_messages]
+                
+                def over_count(message):
+                    excess[0] -= 1
+                    return excess[0] >= 0
+                
+                evicted["global_messages"] = self._evict_oldest(batch_size, over_count)
+            
+            if policy.max_bytes is not None:
+                excess = [sum(mailbox.size for mailbox in list(self.mailboxes.values())) - policy.max_bytes]
+                
+                def over_size(message):
+                    if excess[0] <= 0:
+                        return False
+                    excess[0] -= message.size
+                    return True
+                
+                evicted["global_bytes"] = self._evict_oldest(batch_size, over_size)
+            
+            # Ids deleted by other means pile up behind live ones
+            if len(self.arrivals) > 2 * len(self.email_messages) + batch_size:
+                self._compact_arrivals()
+        return evicted
+    
+    def _compact_arrivals(self) -> None:
+        """Drop deleted ids from `arrivals`, keeping arrival order."""
+        # New ids are only ever appended on the right, so the ids popped from
+        # the left can be filtered and pushed back in front of them
+        live = []
+        for _ in range(len(self.arrivals)):
+            message_id = self.arrivals.popleft()
+            if message_id in self.email_messages:
+                live.append(message_id)
+        self.arrivals.extendleft(reversed(live))
+    
+    def get_version(self, account_id: Optional[int] = None) -> Optional[int]:
+        """Get the version of an account's messages, or of the account list."""
+        if account_id is None:
+            return self.version
+        mailbox = self.mailboxes.get(account_id)
+        return mailbox.version if mailbox is not None and account_id in self.email_accounts else None
+    
+    def get_unread_count(self, account_id: int) -> int:
+        """Get the number of unread email messages for an account."""
+        mailbox = self.mailboxes.get(account_id)
+        return mailbox.unread if mailbox is not None else 0
+    
+    def close(self) -> None:
+        """Close the raw store, if any."""
+        if self.raw_store is not None:
+            self.raw_store.close()
 
 
 # Create a singleton instance of Storage
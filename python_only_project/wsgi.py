@@ -1,14 +1,32 @@
 """
 WSGI entry point for production deployment
+
+With SERVER_ROLE=api, this serves only the API, from the SQLite database of
+a separate SERVER_ROLE=ingest process, so that every Gunicorn worker sees
+the same mail.
 """
 
-from python_email_server.main import create_app, start_smtp_server
+from python_email_server.main import (
+    create_app, create_ingestion_pipeline, create_retention_sweeper, create_storage, get_server_role,
+    import_startup_accounts, start_smtp_server
+)
+
+# Select the storage backend
+storage = create_storage()
+
+if get_server_role() == 'api':
+    # Mail is received by the ingest process
+    app = create_app(storage)
+else:
+    import_startup_accounts(storage)
+    pipeline = create_ingestion_pipeline(storage)
+    sweeper = create_retention_sweeper(storage)
 
-# Start the SMTP server
-smtp_server = start_smtp_server()
+    # Start the SMTP server
+    smtp_server = start_smtp_server(storage, pipeline)
 
-# Create the Flask application
-app = create_app()
+    # Create the Flask application
+    app = create_app(storage, pipeline, sweeper)
 
 if __name__ == "__main__":
     app.run()
\ No newline at end of file